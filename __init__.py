@@ -1,3 +1,3 @@
 from .ui.main_window import PhotoGalleryApp
 from .config.config_manager import ConfigManager
-from .constants.app_constants import BASE_PHOTOS_PATH, THUMBNAILS_PATH, MONTHS
\ No newline at end of file
+from .constants.app_constants import MONTHS
@@ -4,11 +4,39 @@ import json
 class ConfigManager:
     DEFAULT_CONFIG = {
         "clip": {
-            "confidence_threshold": 90.0
+            "confidence_threshold": 90.0,
+            "batch_size": 32,
+            "decode_workers": 0,
+            "processes": 1,
+            "decode_from_thumbnails": False,
+            "backend": "pytorch",
+            "preload": True
         },
         "paths": {
             "photos": "",
             "thumbnails": ""
+        },
+        "thumbnails": {
+            "workers": 0,
+            "incremental": True,
+            "exif_preview": "never",
+            "storage": "files"
+        },
+        "search": {
+            "index": "flat",
+            "results": 500
+        },
+        "index": {
+            "incremental": True,
+            "sharded": False
+        },
+        "catalog": {
+            "backend": "json"
+        },
+        "watcher": {
+            "enabled": False,
+            "debounce_ms": 2000,
+            "max_delay_ms": 30000
         }
     }
     
@@ -54,6 +82,20 @@ class ConfigManager:
     def get_thumbnails_path(self):
         return self.get_value("paths", "thumbnails")
         
+    def get_thumbnail_workers(self):
+        workers = self.get_value("thumbnails", "workers")
+        return workers if workers else (os.cpu_count() or 1)
+
+    def get_decode_workers(self):
+        workers = self.get_value("clip", "decode_workers")
+        return workers if workers else min(4, os.cpu_count() or 1)
+
+    def get_classification_processes(self):
+        processes = self.get_value("clip", "processes")
+        # Automatic: one process per four cores, beyond which a single model
+        # gains little from more threads
+        return processes if processes else max(1, (os.cpu_count() or 1) // 4)
+
     def are_paths_configured(self):
         photos_path = self.get_photos_path()
         thumbnails_path = self.get_thumbnails_path()
@@ -13,4 +13,33 @@ MONTHS = {
     "10": "October",
     "11": "November",
     "12": "December"
-}
\ No newline at end of file
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+THUMBNAIL_SIZE = 300
+THUMBNAIL_QUALITY = 85
+# Size of a grid cell in the gallery
+THUMBNAIL_DISPLAY_SIZE = 150
+
+# Policies for using the preview embedded in the EXIF data as thumbnail
+EXIF_PREVIEW_NEVER = "never"
+EXIF_PREVIEW_IF_LARGE_ENOUGH = "if_large_enough"
+EXIF_PREVIEW_ALWAYS = "always"
+# Smallest square preview "if large enough" accepts. The usual 160x120 EXIF
+# thumbnail crops to 120 px, which the gallery cell upscales by 1.25x.
+EXIF_PREVIEW_MIN_SIZE = 120
+
+# Where thumbnails are kept: one file per photo or a single packed store
+THUMBNAIL_STORAGE_FILES = "files"
+THUMBNAIL_STORAGE_PACKED = "packed"
+
+# How the CLIP image encoder runs: the fp32 model, with its linear layers
+# quantised to int8, or as an exported ONNX graph
+CLIP_BACKEND_PYTORCH = "pytorch"
+CLIP_BACKEND_INT8 = "int8"
+CLIP_BACKEND_ONNX = "onnx"
+
+# Present while a classification run is in progress; kept here rather than
+# in utils.image_classifier so that checking for it does not load torch
+CLASSIFICATION_CHECKPOINT_FILE = "classification_checkpoint.json"
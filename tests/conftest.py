@@ -0,0 +1,67 @@
+import os
+import sys
+import copy
+
+import pytest
+
+# The modules import each other as top-level packages (utils, constants...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config_manager import ConfigManager
+from utils.facets import FacetSummary
+
+from helpers import index_image, write_json
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """A small catalog in the working directory, where the application keeps
+    its data files: five photos over two years, labels and one duplicate
+    pair."""
+    monkeypatch.chdir(tmp_path)
+    images = [
+        index_image("2020", "01", "05", "a.jpg"),
+        index_image("2020", "01", "07", "b.jpg"),
+        index_image("2020", "02", "01", "c.jpg"),
+        index_image("2021", "01", "03", "d.jpg"),
+        index_image("2021", "03", "09", "e.jpg"),
+    ]
+    labels = ["photo", "photo", "meme", "screenshot", "photo"]
+    classifications = {
+        image["thumbnail"]: {"label": label, "confidence": 99.0}
+        for image, label in zip(images, labels)
+    }
+    duplicates = {"hash": [{
+        "original": images[0]["original"],
+        "duplicate": images[1]["original"],
+        "similarity": 100.0,
+        "method": "hash",
+    }]}
+    write_json("index.json", images)
+    write_json("classification_results.json", classifications)
+    write_json("duplicates.json", duplicates)
+    # The generation stages keep facets.json up to date as they write
+    facets = FacetSummary()
+    facets.record_index(images)
+    facets.record_labels(classifications)
+    return {"images": images, "classifications": classifications, "duplicates": duplicates}
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """A ConfigManager with the default settings, in a working directory of
+    its own. The defaults are copied, as set_value changes them in place."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ConfigManager, "DEFAULT_CONFIG", copy.deepcopy(ConfigManager.DEFAULT_CONFIG))
+    return ConfigManager()
+
+
+@pytest.fixture(scope="session")
+def clip_model():
+    """A small randomly initialised CLIP model, named so its results are
+    cached like those of a downloaded one."""
+    from utils.clip_backends import tiny_clip_model
+
+    model = tiny_clip_model()
+    model.config._name_or_path = "tiny-clip"
+    return model
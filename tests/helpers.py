@@ -0,0 +1,89 @@
+"""Builders of the data files the generation stages write, shared by the
+tests."""
+import io
+import os
+import json
+import struct
+import zlib
+
+from utils.photo_index import index_entry
+from utils.photo_scanner import ScannedFile
+
+
+def index_image(year, month, day, name):
+    """The index.json entry index_entry builds for a photo taken at noon on
+    the given day, stored in photos/<year>/<month>/ with its thumbnail in
+    thumbs/."""
+    name = f"{year}_{month}_{day}_12_00_00_{name}"
+    relative_dir = os.path.join(year, month)
+    scanned = ScannedFile(os.path.join("photos", relative_dir, name), name, relative_dir, None)
+    return index_entry(scanned, "thumbs")
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+    # Make sure readers keyed on the mtime see the new version
+    stat_result = os.stat(path)
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+
+
+class TinyClipProcessor:
+    """Stands in for the CLIPProcessor of tiny_clip_model, which has no
+    vocabulary to load: images go through the real CLIPImageProcessor,
+    and words are hashed into the model's small vocabulary."""
+
+    def __init__(self):
+        from transformers import CLIPImageProcessor
+
+        self.image_processor = CLIPImageProcessor()
+        self.text_calls = 0
+
+    def __call__(self, text=None, images=None, return_tensors="pt", padding=False, truncation=False):
+        import torch
+
+        if images is not None:
+            return self.image_processor(images=images, return_tensors=return_tensors)
+        self.text_calls += 1
+        tokens = [[zlib.crc32(word.encode("utf-8")) % 1000 for word in line.split()][:77] for line in text]
+        length = max(len(line) for line in tokens)
+        return {
+            "input_ids": torch.tensor([line + [0] * (length - len(line)) for line in tokens]),
+            "attention_mask": torch.tensor([[1] * len(line) + [0] * (length - len(line)) for line in tokens]),
+        }
+
+
+def save_photos(directory, count, size=(320, 240)):
+    """Saves count JPEGs of different colours in directory and returns
+    their index entries, thumbnails in thumbs/."""
+    from PIL import Image
+
+    os.makedirs(directory, exist_ok=True)
+    images = []
+    for number in range(count):
+        name = f"{number:03}.jpg"
+        path = os.path.join(directory, name)
+        colour = (number * 37 % 256, number * 91 % 256, 255 - number * 53 % 256)
+        Image.new("RGB", size, colour).save(path)
+        images.append({"original": path, "thumbnail": os.path.join("thumbs", name)})
+    return images
+
+
+def save_photo_with_preview(path, size=(640, 480), preview_size=(160, 120), orientation=1):
+    """Saves a blue JPEG whose EXIF data carries a red preview JPEG of
+    preview_size in IFD1, and the given Orientation in IFD0."""
+    from PIL import Image
+
+    preview = io.BytesIO()
+    Image.new("RGB", preview_size, (255, 0, 0)).save(preview, "JPEG")
+    preview_data = preview.getvalue()
+
+    # TIFF header, IFD0 at 8 holding the orientation, IFD1 at 26 pointing
+    # at the preview JPEG stored right after it at 56
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack("<I", 26)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x0201, 4, 1, 56) + struct.pack("<HHII", 0x0202, 4, 1, len(preview_data))
+    tiff += struct.pack("<I", 0) + preview_data
+    Image.new("RGB", size, (0, 0, 255)).save(path, "JPEG", exif=b"Exif\x00\x00" + tiff)
+    return path
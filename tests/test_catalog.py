@@ -0,0 +1,204 @@
+import os
+import json
+
+import pytest
+
+from utils.catalog import (
+    CATALOG_BACKEND_BINARY, CATALOG_BACKEND_JSON, CATALOG_BACKEND_SQLITE, JsonCatalog,
+    create_catalog
+)
+from utils.catalog_journal import JOURNAL_FILE
+
+from helpers import index_image, write_json
+
+BACKENDS = (CATALOG_BACKEND_JSON, CATALOG_BACKEND_BINARY, CATALOG_BACKEND_SQLITE)
+
+
+def originals(images):
+    return [image["original"] for image in images]
+
+
+def selection(images):
+    # What the gallery passes in: only the paths of the selected thumbnails
+    return [{"thumbnail": image["thumbnail"], "original": image["original"]} for image in images]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_query_images_sorted_and_filtered(library, backend):
+    catalog = create_catalog(backend)
+    images = library["images"]
+
+    assert originals(catalog.query_images()) == originals(images)
+    assert originals(catalog.query_images(descending=True)) == originals(images[::-1])
+    assert originals(catalog.query_images(year="2020", month="01")) == originals(images[:2])
+    assert originals(catalog.query_images(label="photo")) == originals([images[0], images[1], images[4]])
+    assert originals(catalog.query_images(duplicates_only=True)) == originals(images[:2])
+    catalog.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_query_results_page_like_a_list(library, backend):
+    catalog = create_catalog(backend)
+    expected = originals(library["images"][::-1])
+    images = catalog.query_images(descending=True)
+
+    assert len(images) == 5
+    assert originals(images[1:3]) == expected[1:3]
+    assert originals(images[3:10]) == expected[3:]
+    assert originals(images[5:]) == []
+    assert images[0]["original"] == expected[0]
+    assert images[-1]["original"] == expected[-1]
+    assert originals(images) == expected
+    assert len(catalog.query_images(year="2021", label="photo")) == 1
+    catalog.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_search_images_keeps_rank_and_filters(library, backend):
+    catalog = create_catalog(backend)
+    images = library["images"]
+    ranked = originals([images[4], images[0], images[2]]) + ["photos/missing.jpg"]
+
+    assert originals(catalog.search_images(ranked)) == ranked[:3]
+    assert originals(catalog.search_images(ranked, label="photo")) == originals([images[4], images[0]])
+    assert originals(catalog.search_images(ranked, year="2020")) == originals([images[0], images[2]])
+
+    catalog.remove_images(selection([images[0]]))
+    assert originals(catalog.search_images(ranked)) == originals([images[4], images[2]])
+    catalog.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_facets(library, backend):
+    catalog = create_catalog(backend)
+    facets = catalog.get_facets()
+    assert facets["years"] == {"2020": 3, "2021": 2}
+    assert facets["months"] == {"01": 3, "02": 1, "03": 1}
+    assert facets["year_months"] == {"2020/01": 2, "2020/02": 1, "2021/01": 1, "2021/03": 1}
+    assert facets["labels"] == {"photo": 3, "meme": 1, "screenshot": 1}
+    catalog.close()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_remove_images(library, backend):
+    catalog = create_catalog(backend)
+    # Read the facets first, so the deletion has to update a current summary
+    catalog.get_facets()
+    images = library["images"]
+
+    catalog.remove_images(selection([images[1], images[3]]))
+
+    remaining = [images[0], images[2], images[4]]
+    assert originals(catalog.get_images()) == originals(remaining)
+    assert originals(catalog.query_images()) == originals(remaining)
+    assert list(catalog.query_images(duplicates_only=True)) == []
+    assert images[1]["thumbnail"] not in catalog.get_classifications()
+    facets = catalog.get_facets()
+    assert facets["years"] == {"2020": 2, "2021": 1}
+    assert facets["months"] == {"01": 1, "02": 1, "03": 1}
+    assert facets["year_months"] == {"2020/01": 1, "2020/02": 1, "2021/03": 1}
+    assert facets["labels"] == {"photo": 2, "meme": 1}
+    catalog.close()
+
+    # A new catalog sees the same library
+    reopened = create_catalog(backend)
+    assert originals(reopened.get_images()) == originals(remaining)
+    assert reopened.get_facets() == facets
+    reopened.close()
+
+
+def test_remove_images_keeps_facet_summary_current(library):
+    catalog = JsonCatalog(compaction_ratio=100)
+    catalog.get_facets()
+    images = library["images"]
+
+    catalog.remove_images(selection([images[0]]))
+
+    # Answered from facets.json, which was updated rather than invalidated
+    sections = catalog.facets.load()
+    assert sections["index"]["years"] == {"2020": 2, "2021": 2}
+    assert sections["labels"]["labels"] == {"photo": 2, "meme": 1, "screenshot": 1}
+
+
+def test_failed_removal_leaves_no_journal_entry(library, monkeypatch):
+    catalog = JsonCatalog(compaction_ratio=100)
+
+    def fail(*args):
+        raise RuntimeError("facets")
+
+    monkeypatch.setattr(catalog.facets, "subtract_removed", fail)
+    with pytest.raises(RuntimeError):
+        catalog.remove_images(selection(library["images"][:1]))
+    assert not os.path.exists(JOURNAL_FILE)
+    assert originals(catalog.get_images()) == originals(library["images"])
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_refresh_picks_up_added_images(library, backend):
+    catalog = create_catalog(backend)
+    catalog.get_facets()
+    catalog.query_images()
+
+    # A generation stage rewrites the index with a new photo
+    added = index_image("2022", "05", "01", "f.jpg")
+    write_json("index.json", library["images"] + [added])
+    catalog.refresh()
+
+    assert originals(catalog.query_images())[-1] == added["original"]
+    assert originals(catalog.query_images(year="2022")) == [added["original"]]
+    facets = catalog.get_facets()
+    assert facets["years"] == {"2020": 3, "2021": 2, "2022": 1}
+    assert facets["year_months"]["2022/05"] == 1
+    catalog.close()
+
+
+def test_journal_replayed_by_new_catalog(library):
+    images = library["images"]
+    catalog = JsonCatalog(compaction_ratio=100)
+    catalog.remove_images(selection([images[2]]))
+    assert os.path.exists(JOURNAL_FILE)
+
+    # The data files are untouched until compaction
+    with open("index.json") as f:
+        assert originals(json.load(f)) == originals(images)
+
+    reopened = JsonCatalog(compaction_ratio=100)
+    assert originals(reopened.get_images()) == originals(images[:2] + images[3:])
+    assert images[2]["thumbnail"] not in reopened.get_classifications()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_compact_folds_journal_into_data_files(library, backend):
+    images = library["images"]
+    catalog = create_catalog(backend)
+    if backend == CATALOG_BACKEND_JSON:
+        catalog = JsonCatalog(compaction_ratio=100)
+    catalog.remove_images(selection([images[0]]))
+    catalog.compact()
+
+    assert not os.path.exists(JOURNAL_FILE)
+    assert not catalog.compact()
+    with open("index.json") as f:
+        assert originals(json.load(f)) == originals(images[1:])
+    with open("classification_results.json") as f:
+        assert images[0]["thumbnail"] not in json.load(f)
+    with open("duplicates.json") as f:
+        assert json.load(f) == {"hash": []}
+    assert originals(catalog.query_images()) == originals(images[1:])
+    assert catalog.get_facets()["years"] == {"2020": 2, "2021": 2}
+    catalog.close()
+
+
+def test_sharded_index_remove_images(library):
+    from utils.index_shards import write_index_shards, index_source
+
+    images = library["images"]
+    write_index_shards(images, index_source("index.json"))
+    catalog = JsonCatalog(compaction_ratio=100)
+    assert catalog.get_shards() is not None
+    catalog.get_facets()
+
+    catalog.remove_images(selection([images[3]]))
+
+    assert originals(catalog.query_images(year="2021")) == [images[4]["original"]]
+    assert catalog.get_facets()["years"] == {"2020": 3, "2021": 1}
@@ -0,0 +1,93 @@
+import os
+import json
+
+from utils.catalog_journal import (
+    CatalogJournal, apply_to_classifications, apply_to_duplicates, apply_to_index,
+    compact_journal
+)
+
+from helpers import index_image
+
+
+def deletion(*images):
+    return {
+        "op": "delete",
+        "originals": [image["original"] for image in images],
+        "thumbnails": [image["thumbnail"] for image in images],
+    }
+
+
+def test_read_skips_torn_last_line(tmp_path):
+    journal = CatalogJournal(str(tmp_path / "journal.jsonl"))
+    assert journal.read() == []
+
+    image = index_image("2020", "01", "01", "a.jpg")
+    journal.append(deletion(image))
+    with open(journal.journal_file, "a") as f:
+        f.write('{"op": "delete", "origin')
+
+    assert journal.read() == [deletion(image)]
+    journal.clear()
+    assert not os.path.exists(journal.journal_file)
+    assert journal.size() == 0
+
+
+def test_apply_deletions(library):
+    images = library["images"]
+    changes = [deletion(images[0]), deletion(images[3])]
+
+    assert apply_to_index(images, changes) == [images[1], images[2], images[4]]
+    classifications = apply_to_classifications(library["classifications"], changes)
+    assert set(classifications) == {images[i]["thumbnail"] for i in (1, 2, 4)}
+    assert apply_to_duplicates(library["duplicates"], changes) == {"hash": []}
+
+
+def test_apply_without_changes_returns_data_unchanged(library):
+    assert apply_to_index(library["images"], []) is library["images"]
+    assert apply_to_classifications(library["classifications"], []) is library["classifications"]
+    assert apply_to_duplicates(library["duplicates"], []) is library["duplicates"]
+
+
+def test_replay_is_idempotent(library):
+    images = library["images"]
+    changes = [deletion(images[2])]
+    once = apply_to_index(images, changes)
+    assert apply_to_index(once, changes) == once
+    labels = apply_to_classifications(library["classifications"], changes)
+    assert apply_to_classifications(labels, changes) == labels
+
+
+def test_compact_journal(library):
+    images = library["images"]
+    journal = CatalogJournal()
+    assert not compact_journal(
+        journal, "index.json", "classification_results.json", "duplicates.json"
+    )
+
+    journal.append(deletion(images[1]))
+    journal.append(deletion(images[4]))
+    assert compact_journal(
+        journal, "index.json", "classification_results.json", "duplicates.json"
+    )
+
+    assert journal.read() == []
+    with open("index.json") as f:
+        assert json.load(f) == [images[0], images[2], images[3]]
+    with open("classification_results.json") as f:
+        assert set(json.load(f)) == {images[i]["thumbnail"] for i in (0, 2, 3)}
+    with open("duplicates.json") as f:
+        assert json.load(f) == {"hash": []}
+    assert not os.path.exists("index.json.tmp")
+
+
+def test_compact_interrupted_before_clearing_is_harmless(library):
+    images = library["images"]
+    journal = CatalogJournal()
+    journal.append(deletion(images[0]))
+    compact_journal(journal, "index.json", "classification_results.json", "duplicates.json")
+
+    # As if the journal had survived a crash right after the files were rewritten
+    journal.append(deletion(images[0]))
+    compact_journal(journal, "index.json", "classification_results.json", "duplicates.json")
+    with open("index.json") as f:
+        assert json.load(f) == images[1:]
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+import torch
+
+from constants.app_constants import CLIP_BACKEND_PYTORCH, CLIP_BACKEND_INT8, CLIP_BACKEND_ONNX
+from utils.clip_backends import OnnxImageEncoder, benchmark_backends, create_image_encoder
+from utils.image_classifier import ImageClassifierThread, projected_features
+
+from helpers import TinyClipProcessor
+
+
+@pytest.fixture
+def pixel_values():
+    torch.manual_seed(1)
+    return torch.randn(6, 3, 224, 224)
+
+
+def normalised(features):
+    features = features.float()
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+def test_backends_agree_with_the_model(clip_model, config, pixel_values):
+    with torch.inference_mode():
+        expected = normalised(projected_features(clip_model.get_image_features(pixel_values=pixel_values)))
+
+    for backend, min_cosine in ((CLIP_BACKEND_PYTORCH, 0.9999), (CLIP_BACKEND_INT8, 0.95), (CLIP_BACKEND_ONNX, 0.9999)):
+        encoder = create_image_encoder(clip_model, backend, "tiny-clip")
+        assert encoder.backend == backend
+        features = normalised(encoder(pixel_values))
+        assert features.shape == expected.shape
+        assert (features * expected).sum(dim=1).min().item() > min_cosine
+
+
+def test_int8_leaves_the_model_untouched(clip_model, config):
+    create_image_encoder(clip_model, CLIP_BACKEND_INT8)
+    assert isinstance(clip_model.visual_projection, torch.nn.Linear)
+    assert clip_model.visual_projection.weight.dtype == torch.float32
+
+
+def test_onnx_export_is_reused(clip_model, config, pixel_values, monkeypatch):
+    first = create_image_encoder(clip_model, CLIP_BACKEND_ONNX, "tiny-clip")
+    assert os.path.exists(first.path)
+
+    def no_export(model, path):
+        raise AssertionError("exported again")
+    monkeypatch.setattr(OnnxImageEncoder, "export", staticmethod(no_export))
+    second = create_image_encoder(clip_model, CLIP_BACKEND_ONNX, "tiny-clip")
+    assert torch.allclose(second(pixel_values), first(pixel_values))
+
+
+def test_classifier_tells_backends_apart(clip_model, config):
+    onnx = ImageClassifierThread(
+        clip_model, TinyClipProcessor(), [], config,
+        image_encoder=create_image_encoder(clip_model, CLIP_BACKEND_ONNX, "tiny-clip")
+    )
+    pytorch = ImageClassifierThread(clip_model, TinyClipProcessor(), [], config)
+    # Cached labels and embeddings of one backend are not reused by another
+    assert (pytorch.model_name, onnx.model_name) == ("tiny-clip", "tiny-clip+onnx")
+    assert pytorch.label_key != onnx.label_key
+    assert onnx.pretrained_name == "tiny-clip"
+
+
+def test_benchmark_reports_every_backend(clip_model, config, pixel_values):
+    text_features = normalised(torch.randn(4, clip_model.config.projection_dim))
+    report = benchmark_backends(clip_model, pixel_values, text_features, batch_size=4, model_name="tiny-clip")
+
+    assert set(report) == {CLIP_BACKEND_PYTORCH, CLIP_BACKEND_INT8, CLIP_BACKEND_ONNX}
+    assert report[CLIP_BACKEND_PYTORCH]["agreement"] == 1.0
+    assert report[CLIP_BACKEND_PYTORCH]["cosine"] == pytest.approx(1.0)
+    assert report[CLIP_BACKEND_ONNX]["cosine"] == pytest.approx(1.0, abs=1e-4)
+    assert all(result["images_per_second"] > 0 for result in report.values())
@@ -0,0 +1,74 @@
+import os
+import json
+
+import pytest
+from PIL import Image
+
+from utils.duplicate_detector import DuplicateDetector
+from utils.file_cache import FileCache, file_identity
+
+
+def save_photo(path, color, mark=None):
+    img = Image.new("RGB", (64, 64), color)
+    if mark is not None:
+        img.paste(mark, (0, 0, 32, 64))
+    img.save(path)
+    return {"original": str(path)}
+
+
+def pairs(duplicates):
+    return {
+        (os.path.basename(dup["original"]), os.path.basename(dup["duplicate"]))
+        for dup in duplicates["hash"]
+    }
+
+
+@pytest.fixture
+def photos(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return {
+        "a": save_photo(tmp_path / "a.png", "black", "white"),
+        "b": save_photo(tmp_path / "b.png", "black", "white"),
+        "c": save_photo(tmp_path / "c.png", "white", "black"),
+    }
+
+
+def test_find_duplicates_caches_fingerprints(photos):
+    duplicates = DuplicateDetector().find_duplicates([photos["a"], photos["b"], photos["c"]])
+    assert pairs(duplicates) == {("a.png", "b.png")}
+    assert os.path.exists("duplicates.json")
+
+    cache = FileCache()
+    fingerprints = cache.fingerprints()
+    assert set(fingerprints) == {photos[name]["original"] for name in "abc"}
+    path = photos["a"]["original"]
+    assert cache.get(path, file_identity(path))["fingerprint"] == fingerprints[path]
+    cache.close()
+
+
+def test_update_duplicates_compares_new_photos(photos, tmp_path):
+    detector = DuplicateDetector()
+    assert detector.update_duplicates([photos["c"]]) is None
+
+    detector.find_duplicates([photos["a"], photos["c"]])
+    d = save_photo(tmp_path / "d.png", "white", "black")
+    duplicates = detector.update_duplicates([d])
+    assert pairs(duplicates) == {("c.png", "d.png")}
+
+    duplicates = detector.update_duplicates([photos["b"]], removed_paths=[d["original"]])
+    assert pairs(duplicates) == {("a.png", "b.png")}
+    with open("duplicates.json") as f:
+        assert pairs(json.load(f)) == {("a.png", "b.png")}
+    cache = FileCache()
+    assert d["original"] not in cache.fingerprints()
+    cache.close()
+
+
+def test_interrupted_run_forces_full_run(photos, monkeypatch):
+    detector = DuplicateDetector()
+    detector.find_duplicates([photos["a"], photos["c"]])
+    monkeypatch.setattr(detector, "save_duplicates", lambda duplicates: False)
+    detector.update_duplicates([photos["b"]])
+
+    assert detector.update_duplicates([photos["b"]]) is None
+
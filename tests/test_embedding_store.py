@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+
+from utils.embedding_store import EmbeddingStore
+from utils.file_cache import FileCache
+
+
+def vectors(count, dim=8, start=0):
+    return np.arange(start, start + count * dim, dtype=np.float32).reshape(count, dim) / 100
+
+
+def test_append_and_read_back(tmp_path):
+    cache = FileCache(str(tmp_path / "cache.db"))
+    store = EmbeddingStore(cache, str(tmp_path / "embeddings"))
+    assert store.vectors() is None
+
+    assert store.append("clip", vectors(3)) == 0
+    assert store.append("clip", vectors(2, start=24)) == 3
+    store.close()
+    cache.close()
+
+    cache = FileCache(str(tmp_path / "cache.db"))
+    store = EmbeddingStore(cache, str(tmp_path / "embeddings"))
+    stored = store.vectors()
+    assert (store.model, store.count) == ("clip", 5)
+    assert stored.dtype == np.float16
+    np.testing.assert_allclose(stored, vectors(5), atol=1e-3)
+    cache.close()
+
+
+def test_other_model_starts_a_new_array(tmp_path):
+    directory = str(tmp_path / "embeddings")
+    cache = FileCache(str(tmp_path / "cache.db"))
+    store = EmbeddingStore(cache, directory)
+    store.append("clip", vectors(3))
+
+    assert store.append("clip+onnx", vectors(2, dim=4)) == 0
+    assert (store.model, store.count, store.vectors().shape) == ("clip+onnx", 2, (2, 4))
+    assert os.listdir(directory) == ["vectors-1.f16"]
+    store.close()
+    cache.close()
+
+
+def test_uncommitted_rows_are_dropped(tmp_path):
+    cache = FileCache(str(tmp_path / "cache.db"))
+    store = EmbeddingStore(cache, str(tmp_path / "embeddings"))
+    store.append("clip", vectors(3))
+    cache.commit()
+    store.append("clip", vectors(2, start=100))
+    store.close()
+    # Like a crash before the count of the last rows was committed
+    cache.connection.rollback()
+
+    store = EmbeddingStore(cache, str(tmp_path / "embeddings"))
+    assert store.count == 3
+    assert store.append("clip", vectors(1, start=200)) == 3
+    np.testing.assert_allclose(store.vectors()[3], vectors(1, start=200)[0], atol=1e-2)
+    assert store.vectors().shape == (4, 8)
+    store.close()
+    cache.close()
+
+
+def test_compact_keeps_only_referenced_rows(tmp_path):
+    directory = str(tmp_path / "embeddings")
+    cache = FileCache(str(tmp_path / "cache.db"))
+    store = EmbeddingStore(cache, directory)
+    store.append("clip", vectors(10))
+    kept = {"a.jpg": 7, "b.jpg": 2, "c.jpg": 9}
+    for path, row in kept.items():
+        cache.put(path, (1, 1, 1), embedding_row=row, embedding_model="clip")
+
+    assert not store.compact(min_rows=100)
+    assert store.compact(min_rows=1)
+    assert os.listdir(directory) == ["vectors-1.f16"]
+    assert store.count == 3
+
+    rows = cache.embedding_rows("clip")
+    assert sorted(rows.values()) == [0, 1, 2]
+    for path, old_row in kept.items():
+        np.testing.assert_allclose(store.vectors()[rows[path]], vectors(10)[old_row], atol=1e-2)
+    # Less than half the rows are unused now
+    assert not store.compact(min_rows=1)
+    store.close()
+    cache.close()
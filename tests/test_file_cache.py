@@ -0,0 +1,84 @@
+import os
+
+from utils.file_cache import FileCache, file_identity
+
+
+def photo(path, content=b"jpeg"):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_get_requires_same_identity(tmp_path):
+    path = photo(tmp_path / "a.jpg")
+    identity = file_identity(path)
+    cache = FileCache(str(tmp_path / "cache.db"))
+    cache.put(path, identity, thumbnail="thumbs/a.jpg", fingerprint={"hash": "ff", "exif": {}})
+
+    cached = cache.get(path, identity)
+    assert cached["thumbnail"] == "thumbs/a.jpg"
+    assert cached["fingerprint"] == {"hash": "ff", "exif": {}}
+
+    size, mtime_ns, inode = identity
+    assert cache.get(path, (size + 1, mtime_ns, inode)) is None
+    assert cache.get(path, (size, mtime_ns + 1, inode)) is None
+    assert cache.get(path, (size, mtime_ns, inode + 1)) is None
+    assert cache.get(path, None) is None
+    cache.close()
+
+
+def test_changed_file_invalidates_artefacts(tmp_path):
+    path = photo(tmp_path / "a.jpg")
+    cache = FileCache(str(tmp_path / "cache.db"))
+    cache.put(path, file_identity(path), thumbnail="thumbs/a.jpg", label="photo")
+
+    photo(path, b"edited jpeg")
+    os.utime(path, ns=(1, 1))
+    identity = file_identity(path)
+    assert cache.get(path, identity) is None
+
+    # Storing anything for the new identity drops the rest
+    cache.put(path, identity, label="meme")
+    cached = cache.get(path, identity)
+    assert cached["label"] == "meme"
+    assert cached["thumbnail"] is None
+    assert not cache.contains(path, "thumbnail")
+    cache.close()
+
+
+def test_put_for_same_identity_keeps_other_artefacts(tmp_path):
+    path = photo(tmp_path / "a.jpg")
+    identity = file_identity(path)
+    cache = FileCache(str(tmp_path / "cache.db"))
+    cache.put(path, identity, thumbnail="thumbs/a.jpg")
+    cache.put(path, identity, label="photo")
+
+    cached = cache.get(path, identity)
+    assert cached["thumbnail"] == "thumbs/a.jpg"
+    assert cached["label"] == "photo"
+    cache.close()
+
+
+def test_clear_remove_and_persistence(tmp_path):
+    a, b = photo(tmp_path / "a.jpg"), photo(tmp_path / "b.jpg")
+    db_file = str(tmp_path / "cache.db")
+    cache = FileCache(db_file)
+    cache.put(a, file_identity(a), thumbnail="thumbs/a.jpg", fingerprint={"hash": "01", "exif": {}})
+    cache.put(b, file_identity(b), thumbnail="thumbs/b.jpg", fingerprint={"hash": "02", "exif": {}})
+    cache.set_meta("state", {"generation": 2})
+    cache.close()
+
+    cache = FileCache(db_file)
+    assert cache.get_meta("state") == {"generation": 2}
+    assert cache.get_meta("missing") is None
+    assert cache.fingerprints() == {a: {"hash": "01", "exif": {}}, b: {"hash": "02", "exif": {}}}
+
+    cache.clear(a, "fingerprint")
+    assert cache.contains(a)
+    assert not cache.contains(a, "fingerprint")
+    assert cache.get(a, file_identity(a))["thumbnail"] == "thumbs/a.jpg"
+
+    cache.remove([b])
+    assert not cache.contains(b)
+    assert sorted(cache.paths()) == [(a, "thumbs/a.jpg")]
+    cache.close()
@@ -0,0 +1,101 @@
+import numpy as np
+
+from utils.filter_engine import FilterEngine
+
+
+def image(original, timestamp):
+    year, month = timestamp.split("_")[:2]
+    return {
+        "thumbnail": "thumbs/" + original,
+        "original": original,
+        "year": year,
+        "month": month,
+        "timestamp": timestamp,
+    }
+
+
+IMAGES = [
+    image("c.jpg", "2021_05_01_12_00_00"),
+    image("a.jpg", "2020_01_01_12_00_00"),
+    image("b.jpg", "2020_01_02_12_00_00"),
+    image("d.jpg", "2020_03_01_12_00_00"),
+]
+LABELS = {
+    "thumbs/a.jpg": {"label": "photo"},
+    "thumbs/b.jpg": {"label": "meme"},
+    "thumbs/c.jpg": {"label": "photo"},
+}
+
+
+def originals(images):
+    return [image["original"] for image in images]
+
+
+def test_query_sorts_and_filters():
+    engine = FilterEngine(IMAGES, LABELS, {"a.jpg", "b.jpg"})
+
+    assert originals(engine.query()) == ["a.jpg", "b.jpg", "d.jpg", "c.jpg"]
+    assert originals(engine.query(descending=True)) == ["c.jpg", "d.jpg", "b.jpg", "a.jpg"]
+    assert originals(engine.query(year="2020", month="01")) == ["a.jpg", "b.jpg"]
+    assert originals(engine.query(label="photo")) == ["a.jpg", "c.jpg"]
+    assert originals(engine.query(duplicates_only=True)) == ["a.jpg", "b.jpg"]
+    assert originals(engine.query(year="1999")) == []
+
+
+def test_label_and_duplicate_filters_ignored_without_data():
+    engine = FilterEngine(IMAGES)
+    assert len(engine.query(label="photo")) == len(IMAGES)
+    assert len(engine.query(duplicates_only=True)) == len(IMAGES)
+
+
+def test_rank_keeps_given_order():
+    engine = FilterEngine(IMAGES, LABELS)
+    ranked = ["d.jpg", "missing.jpg", "c.jpg", "a.jpg"]
+
+    assert originals(engine.rank(ranked)) == ["d.jpg", "c.jpg", "a.jpg"]
+    assert originals(engine.rank(ranked, label="photo")) == ["c.jpg", "a.jpg"]
+    assert originals(engine.rank(ranked, year="2020")) == ["d.jpg", "a.jpg"]
+    assert originals(engine.rank([])) == []
+
+
+def test_rank_leaves_out_excluded_rows():
+    engine = FilterEngine(IMAGES, LABELS)
+    excluded = np.zeros(len(IMAGES), dtype=bool)
+    excluded[0] = True
+    columns = FilterEngine.from_columns(
+        IMAGES,
+        np.array([1, 0, 0, 0]), ["2020", "2021"],
+        np.array([1, 0, 0, 2]), ["01", "05", "03"],
+        np.array([0, 0, 1, -1]), ["photo", "meme"],
+        np.zeros(len(IMAGES), dtype=bool),
+        engine.ascending, engine.descending, excluded
+    )
+    assert originals(columns.rank(["c.jpg", "b.jpg", "a.jpg"])) == ["b.jpg", "a.jpg"]
+    assert originals(columns.rank(["c.jpg", "b.jpg", "a.jpg"], label="photo")) == ["a.jpg"]
+    assert originals(columns.query()) == ["a.jpg", "b.jpg", "d.jpg"]
+
+
+def test_original_positions_are_built_once():
+    engine = FilterEngine(IMAGES)
+    positions = engine.original_positions()
+    assert positions == {"c.jpg": 0, "a.jpg": 1, "b.jpg": 2, "d.jpg": 3}
+    assert engine.original_positions() is positions
+
+    calls = []
+
+    def source():
+        calls.append(True)
+        return positions
+
+    columns = FilterEngine.from_columns(
+        IMAGES,
+        np.array([1, 0, 0, 0]), ["2020", "2021"],
+        np.array([1, 0, 0, 2]), ["01", "05", "03"],
+        np.array([0, 0, 1, -1]), ["photo", "meme"],
+        None, engine.ascending, engine.descending,
+        original_positions=source
+    )
+    assert originals(columns.rank(["d.jpg", "a.jpg"])) == ["d.jpg", "a.jpg"]
+    assert originals(columns.rank(["b.jpg"])) == ["b.jpg"]
+    assert columns.original_positions() is positions
+    assert len(calls) == 1
@@ -0,0 +1,286 @@
+import os
+import json
+import shutil
+
+import pytest
+import torch
+
+import utils.image_classifier as image_classifier
+from constants.app_constants import CLASSIFICATION_CHECKPOINT_FILE
+from utils.image_classifier import (
+    CLASSIFICATION_RESULTS_FILE, TEXT_FEATURES_FILE, PREFETCH_BATCHES, ImageClassifierThread
+)
+from utils.thumbnail_store import PackedThumbnailStore
+
+from helpers import TinyClipProcessor, save_photos
+
+
+@pytest.fixture
+def photos(config):
+    return save_photos("photos", 10)
+
+
+def classifier(clip_model, config, images, **kwargs):
+    config.set_value("clip", "batch_size", 4)
+    config.set_value("clip", "decode_workers", 1)
+    return ImageClassifierThread(clip_model, TinyClipProcessor(), images, config, **kwargs)
+
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def forget_results():
+    """Removes everything a run caches, so the next one starts afresh."""
+    for name in ("file_cache.db", "file_cache.db-wal", "file_cache.db-shm", CLASSIFICATION_RESULTS_FILE):
+        if os.path.exists(name):
+            os.remove(name)
+    shutil.rmtree("embeddings", ignore_errors=True)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def count_encoded(monkeypatch, thread):
+    """Counts the images that go through the image encoder of thread."""
+    encoded = []
+    encoder = thread.image_encoder
+
+    def counting_encoder(pixel_values):
+        encoded.append(len(pixel_values))
+        return encoder(pixel_values)
+    counting_encoder.backend = encoder.backend
+    monkeypatch.setattr(thread, "image_encoder", counting_encoder)
+    return encoded
+
+
+def test_interrupted_run_leaves_checkpoint_and_resumes(clip_model, config, photos, monkeypatch):
+    monkeypatch.setattr(image_classifier, "CHECKPOINT_INTERVAL", 0)
+    thread = classifier(clip_model, config, photos, resumable=True)
+    record_batch = thread.record_batch
+
+    def record_then_die(*args):
+        record_batch(*args)
+        # Like the application being killed after the first checkpoint
+        raise Interrupted()
+    monkeypatch.setattr(thread, "record_batch", record_then_die)
+    with pytest.raises(Interrupted):
+        thread.run()
+
+    assert read_json(CLASSIFICATION_CHECKPOINT_FILE) == {"done": 4, "total": 10, "relabel": False}
+    assert len(read_json(CLASSIFICATION_RESULTS_FILE)) == 4
+
+    resumed = classifier(clip_model, config, photos, resumable=True)
+    encoded = count_encoded(monkeypatch, resumed)
+    resumed.run()
+    # The four images classified before the interruption come from the cache
+    assert sum(encoded) == 6
+    assert len(read_json(CLASSIFICATION_RESULTS_FILE)) == 10
+    assert not os.path.exists(CLASSIFICATION_CHECKPOINT_FILE)
+
+
+def test_quiet_run_writes_no_checkpoint(clip_model, config, photos, monkeypatch):
+    monkeypatch.setattr(image_classifier, "CHECKPOINT_INTERVAL", 0)
+    thread = classifier(clip_model, config, photos[:6])
+    checkpoints = []
+    monkeypatch.setattr(thread, "write_checkpoint_file", checkpoints.append)
+    thread.run()
+
+    assert checkpoints == []
+    assert len(read_json(CLASSIFICATION_RESULTS_FILE)) == 6
+
+
+def test_quiet_run_keeps_checkpoint_of_interrupted_run(clip_model, config, photos):
+    with open(CLASSIFICATION_CHECKPOINT_FILE, "w") as f:
+        json.dump({"done": 4, "total": 10, "relabel": False}, f)
+
+    classifier(clip_model, config, photos[:2]).run()
+    assert read_json(CLASSIFICATION_CHECKPOINT_FILE)["done"] == 4
+
+
+def test_cancel_stops_after_the_batches_in_flight(clip_model, config, photos):
+    thread = classifier(clip_model, config, photos, base_results={"thumbs/old.jpg": {
+        "label": "meme", "confidence": 99.0
+    }}, resumable=True)
+    thread.progress.connect(lambda *args: thread.cancel())
+    thread.run()
+
+    results = read_json(CLASSIFICATION_RESULTS_FILE)
+    # The batch that reported progress is kept, the ones decoded ahead are dropped
+    assert 1 + 4 <= len(results) < 1 + 10
+    assert results["thumbs/old.jpg"]["label"] == "meme"
+    assert not os.path.exists(CLASSIFICATION_CHECKPOINT_FILE)
+
+
+def test_batches_match_one_image_at_a_time(clip_model, config, photos, monkeypatch):
+    with open(os.path.join("photos", "broken.jpg"), "wb") as f:
+        f.write(b"not a jpeg")
+    images = photos[:5] + [{"original": os.path.join("photos", "broken.jpg"), "thumbnail": "thumbs/broken.jpg"}] + photos[5:]
+
+    runs = []
+    for batch_size in (1, 4):
+        forget_results()
+        thread = classifier(clip_model, config, images)
+        thread.batch_size = batch_size
+        encoded = count_encoded(monkeypatch, thread)
+        progress = []
+        thread.progress.connect(lambda thumbnail, label, confidence: progress.append(thumbnail))
+        thread.run()
+        runs.append((encoded, progress, read_json(CLASSIFICATION_RESULTS_FILE)))
+
+    (single_encoded, single_progress, single), (batch_encoded, batch_progress, batched) = runs
+    assert single_encoded == [1] * 10
+    # The image that cannot be decoded leaves its batch one short
+    assert batch_encoded == [4, 3, 3]
+    assert single_progress == batch_progress == [image["thumbnail"] for image in images]
+    assert batched["thumbs/broken.jpg"] == {"label": "error", "confidence": 0.0}
+    assert batched.keys() == single.keys()
+    for thumbnail, result in single.items():
+        assert batched[thumbnail]["label"] == result["label"]
+        assert batched[thumbnail]["confidence"] == pytest.approx(result["confidence"], abs=1e-3)
+
+
+def test_text_features_are_computed_once(clip_model, config, photos, monkeypatch):
+    first = classifier(clip_model, config, photos[:2])
+    first.run()
+    assert first.processor.text_calls == 1
+    assert list(read_json(TEXT_FEATURES_FILE)) == [first.label_key]
+    labels = read_json(CLASSIFICATION_RESULTS_FILE)
+
+    forget_results()
+    second = classifier(clip_model, config, photos[:2])
+    second.run()
+    # Read back from clip_text_features.json, the text tower is not run
+    assert second.processor.text_calls == 0
+    assert torch.allclose(second.text_features(), first.text_features())
+    assert {thumbnail: result["label"] for thumbnail, result in read_json(CLASSIFICATION_RESULTS_FILE).items()} == {
+        thumbnail: result["label"] for thumbnail, result in labels.items()
+    }
+
+    # Other prompts are stored alongside under a key of their own
+    monkeypatch.setattr(image_classifier, "LABEL_PROMPTS", ["a photo", "a screenshot", "a document", "a meme"])
+    reworded = classifier(clip_model, config, photos[:2])
+    reworded.text_features()
+    assert reworded.processor.text_calls == 1
+    assert set(read_json(TEXT_FEATURES_FILE)) == {first.label_key, reworded.label_key}
+
+
+def test_relabel_uses_stored_embeddings(clip_model, config, photos, monkeypatch):
+    config.set_value("clip", "confidence_threshold", 0.0)
+    classifier(clip_model, config, photos).run()
+    first = read_json(CLASSIFICATION_RESULTS_FILE)
+    assert {result["label"] for result in first.values()} != {"photo"}
+
+    config.set_value("clip", "confidence_threshold", 100.0)
+    thread = classifier(clip_model, config, photos, relabel=True)
+    encoded = count_encoded(monkeypatch, thread)
+    relabelled = []
+    thread.relabelled.connect(relabelled.append)
+    thread.run()
+
+    assert encoded == []
+    assert relabelled == [10]
+    results = read_json(CLASSIFICATION_RESULTS_FILE)
+    # Only the threshold changed, so every label falls back to photo
+    assert {result["label"] for result in results.values()} == {"photo"}
+    for thumbnail, result in first.items():
+        assert results[thumbnail]["confidence"] == pytest.approx(result["confidence"], abs=0.1)
+
+
+def test_decoding_runs_a_bounded_number_of_batches_ahead(clip_model, config, photos, monkeypatch):
+    config.set_value("clip", "decode_workers", 2)
+    thread = ImageClassifierThread(clip_model, TinyClipProcessor(), photos, config)
+    thread.batch_size = 2
+    events = []
+    prepare_batch, record_batch = thread.prepare_batch, thread.record_batch
+
+    def recording_prepare(batch, *args):
+        events.append("prepare")
+        return prepare_batch(batch, *args)
+
+    def recording_record(*args):
+        events.append("record")
+        return record_batch(*args)
+    monkeypatch.setattr(thread, "prepare_batch", recording_prepare)
+    monkeypatch.setattr(thread, "record_batch", recording_record)
+    thread.run()
+
+    ahead = [events[:index].count("prepare") - events[:index].count("record")
+             for index, event in enumerate(events) if event == "record"]
+    assert ahead[0] == PREFETCH_BATCHES + 1
+    assert max(ahead) == PREFETCH_BATCHES + 1
+    assert events.count("record") == 5
+    assert len(read_json(CLASSIFICATION_RESULTS_FILE)) == 10
+
+
+def test_images_are_decoded_from_thumbnails(clip_model, config, photos, monkeypatch):
+    config.set_value("clip", "decode_from_thumbnails", True)
+    os.makedirs("thumbs")
+    for image in photos[:3]:
+        shutil.copy(image["original"], image["thumbnail"])
+    store = PackedThumbnailStore("thumbs")
+    for image in photos[3:6]:
+        with open(image["original"], "rb") as f:
+            store.put(image["thumbnail"], f.read())
+
+    loaded = []
+    load_image = image_classifier.load_image
+
+    def recording_load_image(path, *args):
+        loaded.append(path)
+        return load_image(path, *args)
+    monkeypatch.setattr(image_classifier, "load_image", recording_load_image)
+
+    classifier(clip_model, config, photos[:3]).run()
+    assert loaded == [image["thumbnail"] for image in photos[:3]]
+
+    # Packed thumbnails are decoded from their bytes; without a thumbnail
+    # the original is used
+    loaded.clear()
+    classifier(clip_model, config, photos[3:7], thumbnail_store=store).run()
+    assert loaded == [photos[6]["original"]]
+    assert all(result["label"] != "error" for result in read_json(CLASSIFICATION_RESULTS_FILE).values())
+    store.close()
+
+
+def test_worker_processes_match_a_single_process(clip_model, config, photos, monkeypatch):
+    from transformers import CLIPImageProcessor
+
+    # The workers load the model by name, here a folder in the working directory
+    clip_model.save_pretrained("tiny-clip")
+    CLIPImageProcessor().save_pretrained("tiny-clip")
+
+    runs = []
+    for processes in (1, 2):
+        forget_results()
+        config.set_value("clip", "processes", processes)
+        thread = classifier(clip_model, config, photos)
+        encoded = count_encoded(monkeypatch, thread)
+        progress = []
+        thread.progress.connect(lambda thumbnail, label, confidence: progress.append(thumbnail))
+        thread.run()
+        runs.append((encoded, progress, read_json(CLASSIFICATION_RESULTS_FILE)))
+
+    (single_encoded, single_progress, single), (pool_encoded, pool_progress, pooled) = runs
+    assert single_encoded == [4, 4, 2]
+    # Every image went through the worker processes
+    assert pool_encoded == []
+    assert single_progress == pool_progress == [image["thumbnail"] for image in photos]
+    for thumbnail, result in single.items():
+        assert pooled[thumbnail]["label"] == result["label"]
+        assert pooled[thumbnail]["confidence"] == pytest.approx(result["confidence"], abs=1e-3)
+
+
+def test_workers_that_cannot_load_the_model_fall_back(clip_model, config, photos, monkeypatch):
+    config.set_value("clip", "processes", 2)
+    thread = classifier(clip_model, config, photos[:3])
+    # Nothing is saved under the model's name, so the workers fail to start,
+    # without trying to download it
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    encoded = count_encoded(monkeypatch, thread)
+    thread.run()
+
+    assert encoded == [3]
+    assert len(read_json(CLASSIFICATION_RESULTS_FILE)) == 3
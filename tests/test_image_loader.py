@@ -0,0 +1,40 @@
+from PIL import Image
+
+from utils.image_loader import load_image
+
+
+def save(path, size, mode="RGB", **kwargs):
+    Image.new(mode, size, 128).save(path, **kwargs)
+    return str(path)
+
+
+def test_jpeg_is_decoded_just_above_min_side(tmp_path):
+    path = save(tmp_path / "large.jpg", (2000, 1500))
+    img = load_image(path, 300)
+    assert img.mode == "RGB"
+    # DCT scaling to 1/4 leaves 375 px, too little to halve again
+    assert img.size == (500, 375)
+
+    assert load_image(path).size == (2000, 1500)
+
+
+def test_leftover_factor_is_reduced(tmp_path):
+    # PNGs have no draft mode, so the whole reduction is a box reduce
+    path = save(tmp_path / "large.png", (2000, 1500))
+    assert load_image(path, 300).size == (400, 300)
+    assert load_image(path, 700).size == (1000, 750)
+
+
+def test_small_images_are_not_upscaled(tmp_path):
+    path = save(tmp_path / "small.jpg", (200, 100))
+    assert load_image(path, 300).size == (200, 100)
+
+
+def test_mode_and_exif_are_kept(tmp_path):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    path = save(tmp_path / "grey.jpg", (1200, 900), mode="L", exif=exif.tobytes())
+    img = load_image(path, 150)
+    assert img.mode == "RGB"
+    assert min(img.size) >= 150
+    assert img.getexif()[0x0112] == 6
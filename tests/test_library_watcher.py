@@ -0,0 +1,121 @@
+import os
+import time
+
+import pytest
+from PyQt5.QtCore import QCoreApplication
+
+from utils.library_watcher import DirectoryWalkThread, LibraryWatcher
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+def wait_for(app, condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        app.processEvents()
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for month in ("2020/01", "2020/02", "2021/01"):
+        os.makedirs(tmp_path / "photos" / month)
+    return str(tmp_path / "photos")
+
+
+def test_start_watches_every_directory(app, tree):
+    watcher = LibraryWatcher(tree)
+    watcher.start()
+    assert wait_for(app, lambda: not watcher.walkers)
+
+    expected = {tree} | {
+        os.path.join(tree, path) for path in ("2020", "2021", "2020/01", "2020/02", "2021/01")
+    }
+    assert set(watcher.watcher.directories()) == expected
+    watcher.stop()
+    assert watcher.watcher.directories() == []
+
+
+def test_walk_arrives_in_chunks(tree):
+    walker = DirectoryWalkThread(tree, chunk_size=2)
+    chunks = []
+    walker.found.connect(lambda sender, chunk: chunks.append(chunk))
+    walker.run()
+
+    assert all(len(chunk) <= 3 for chunk in chunks) and len(chunks) > 1
+    assert chunks[0][0] == tree
+    assert len({path for chunk in chunks for path in chunk}) == 6
+
+    # Directories already watched are left out
+    walker = DirectoryWalkThread(tree, {tree, os.path.join(tree, "2020")})
+    chunks = []
+    walker.found.connect(lambda sender, chunk: chunks.append(chunk))
+    walker.run()
+    assert sorted(path for chunk in chunks for path in chunk) == [
+        os.path.join(tree, path) for path in ("2020/01", "2020/02", "2021", "2021/01")
+    ]
+
+
+def test_stop_cancels_the_walk(app, tree):
+    watcher = LibraryWatcher(tree)
+    watcher.start()
+    watcher.stop()
+    assert watcher.walkers == []
+    app.processEvents()
+    assert watcher.watcher.directories() == []
+
+
+def test_changes_are_debounced_into_one_batch(app, tree):
+    watcher = LibraryWatcher(tree, debounce_ms=100, max_delay_ms=5000)
+    batches = []
+    watcher.changes_ready.connect(batches.append)
+
+    watcher.on_directory_changed(os.path.join(tree, "2020", "01"))
+    watcher.on_directory_changed(os.path.join(tree, "2020", "02"))
+    watcher.on_directory_changed(os.path.join(tree, "2020"))
+    assert batches == []
+    assert wait_for(app, lambda: batches)
+    assert batches == [["2020"]]
+    watcher.stop()
+
+
+def test_max_delay_flushes_a_steady_stream(app, tree):
+    watcher = LibraryWatcher(tree, debounce_ms=200, max_delay_ms=300)
+    batches = []
+    watcher.changes_ready.connect(batches.append)
+
+    start = time.monotonic()
+    while not batches and time.monotonic() - start < 3:
+        # Each change restarts the debounce timer
+        watcher.on_directory_changed(os.path.join(tree, "2021", "01"))
+        wait_for(app, lambda: batches, timeout=0.05)
+    assert batches and batches[0] == [os.path.join("2021", "01")]
+    assert time.monotonic() - start < 1.5
+    watcher.stop()
+
+
+def test_new_directories_are_watched(app, tree):
+    watcher = LibraryWatcher(tree, debounce_ms=50)
+    batches = []
+    watcher.changes_ready.connect(batches.append)
+    watcher.start()
+    assert wait_for(app, lambda: not watcher.walkers)
+
+    os.makedirs(os.path.join(tree, "2022", "05"))
+    assert wait_for(app, lambda: batches)
+    assert batches[0] == ["."]
+    assert wait_for(app, lambda: os.path.join(tree, "2022", "05") in watcher.watcher.directories())
+    watcher.stop()
+
+
+def test_relative_dirs_drop_nested_directories(tree):
+    watcher = LibraryWatcher(tree)
+    paths = [os.path.join(tree, path) for path in ("2020", "2020/01", "2021/01")]
+    assert watcher.relative_dirs(paths) == ["2020", os.path.join("2021", "01")]
+    assert watcher.relative_dirs(paths + [tree]) == ["."]
@@ -0,0 +1,101 @@
+import os
+
+from utils.photo_index import (
+    index_entry, index_sort_key, merge_index,
+    load_index_snapshot, save_index_snapshot, remove_index_snapshot
+)
+from utils.photo_scanner import PhotoScanner, ScannedFile
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"jpeg")
+
+
+def bump_mtime(directory):
+    stat_result = os.stat(directory)
+    os.utime(directory, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+
+
+def build(photos, snapshot=None, index=None):
+    """Indexes photos like the gallery does: in full, or merged into index
+    given the snapshot it was built with."""
+    scanner = PhotoScanner(photos, snapshot=snapshot)
+    entries = [entry for entry in (index_entry(scanned, "thumbs") for scanned in scanner.scan()) if entry]
+    if snapshot is None:
+        return sorted(entries, key=index_sort_key), scanner.directories
+    return merge_index(index, entries, scanner.changed_dirs, photos), scanner.directories
+
+
+def test_index_entry():
+    scanned = ScannedFile(os.path.join("photos", "2021", "05", "2021_05_14_08_30_00.jpg"),
+                          "2021_05_14_08_30_00.jpg", os.path.join("2021", "05"), None)
+    assert index_entry(scanned, "thumbs") == {
+        "thumbnail": os.path.join("thumbs", "2021", "05", "2021_05_14_08_30_00.jpg"),
+        "original": scanned.path,
+        "year": "2021",
+        "month": "05",
+        "day": "14",
+        "timestamp": "2021_05_14_08_30_00",
+    }
+
+    # Without a timestamp in the name the photo sorts to the month start
+    undated = index_entry(ScannedFile("photos/2021/05/IMG.jpg", "IMG.jpg", os.path.join("2021", "05"), None), "thumbs")
+    assert (undated["day"], undated["timestamp"]) == ("01", "2021_05_01_00_00_00")
+
+    assert index_entry(ScannedFile("photos/IMG.jpg", "IMG.jpg", ".", None), "thumbs") is None
+    assert index_entry(ScannedFile("photos/2021/IMG.jpg", "IMG.jpg", "2021", None), "thumbs") is None
+
+
+def test_merge_matches_full_rebuild(tmp_path):
+    photos = str(tmp_path / "photos")
+    for name in ("2020/01/2020_01_05_10_00_00.jpg", "2020/01/2020_01_20_10_00_00.jpg",
+                 "2020/02/2020_02_01_10_00_00.jpg", "2021/03/2021_03_01_10_00_00.jpg"):
+        touch(os.path.join(photos, name))
+    index, directories = build(photos)
+
+    # A photo added to one month, another month removed, a new year added
+    touch(os.path.join(photos, "2020", "01", "2020_01_10_10_00_00.jpg"))
+    bump_mtime(os.path.join(photos, "2020", "01"))
+    os.remove(os.path.join(photos, "2020", "02", "2020_02_01_10_00_00.jpg"))
+    bump_mtime(os.path.join(photos, "2020", "02"))
+    touch(os.path.join(photos, "2019", "12", "2019_12_31_10_00_00.jpg"))
+    bump_mtime(photos)
+
+    merged, _ = build(photos, directories, index)
+    rebuilt, _ = build(photos)
+    assert merged == rebuilt
+    assert [entry["timestamp"][:10] for entry in merged] == [
+        "2019_12_31", "2020_01_05", "2020_01_10", "2020_01_20", "2021_03_01"
+    ]
+
+
+def test_unchanged_entries_are_kept_as_they_are():
+    index = [
+        {"original": os.path.join("photos", "2020", "01", "a.jpg"), "timestamp": "2020_01_01_00_00_00"},
+        {"original": os.path.join("photos", "2020", "02", "b.jpg"), "timestamp": "2020_02_01_00_00_00"},
+    ]
+    new_entry = {"original": os.path.join("photos", "2020", "01", "c.jpg"), "timestamp": "2020_03_01_00_00_00"}
+    merged = merge_index(index, [new_entry], {os.path.join("2020", "01")}, "photos")
+    assert merged == [index[1], new_entry]
+    assert merged[0] is index[1]
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot_file = str(tmp_path / "snapshot.json")
+    directories = {".": {"mtime": 1, "subdirs": ["2020"]}}
+    assert load_index_snapshot("photos", "thumbs", snapshot_file) is None
+
+    assert save_index_snapshot(directories, "photos", "thumbs", snapshot_file)
+    assert load_index_snapshot("photos", "thumbs", snapshot_file) == directories
+    # A snapshot of other folders is no use
+    assert load_index_snapshot("other", "thumbs", snapshot_file) is None
+    assert load_index_snapshot("photos", "other", snapshot_file) is None
+
+    with open(snapshot_file, "w") as f:
+        f.write("{")
+    assert load_index_snapshot("photos", "thumbs", snapshot_file) is None
+
+    remove_index_snapshot(snapshot_file)
+    assert not os.path.exists(snapshot_file)
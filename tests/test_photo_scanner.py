@@ -0,0 +1,104 @@
+import os
+import shutil
+
+from utils.photo_scanner import PhotoScanner
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"jpeg")
+
+
+def bump_mtime(directory):
+    stat_result = os.stat(directory)
+    os.utime(directory, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+
+
+def make_tree(root):
+    for name in ("2020/01/b.jpg", "2020/01/a.JPG", "2020/02/c.png", "2021/05/d.jpeg", "top.jpg"):
+        touch(os.path.join(root, name))
+    touch(os.path.join(root, "2020", "01", "notes.txt"))
+
+
+def scan(scanner):
+    return [(scanned.relative_dir, scanned.name) for scanned in scanner.scan()]
+
+
+def test_scan_yields_photos_with_their_stat(tmp_path):
+    make_tree(str(tmp_path))
+    scanner = PhotoScanner(str(tmp_path))
+    scanned_files = list(scanner.scan())
+
+    assert [(scanned.relative_dir, scanned.name) for scanned in scanned_files] == [
+        (".", "top.jpg"),
+        (os.path.join("2020", "01"), "a.JPG"),
+        (os.path.join("2020", "01"), "b.jpg"),
+        (os.path.join("2020", "02"), "c.png"),
+        (os.path.join("2021", "05"), "d.jpeg"),
+    ]
+    assert all(scanned.stat.st_size == 4 for scanned in scanned_files)
+    assert scanned_files[1].path == os.path.join(str(tmp_path), "2020", "01", "a.JPG")
+    assert scanner.finished
+    assert scanner.estimated_total() == 5
+    assert scanner.directories[os.path.join("2020")]["subdirs"] == ["01", "02"]
+
+
+def test_snapshot_lists_only_changed_directories(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    first = PhotoScanner(root, snapshot={})
+    scan(first)
+
+    touch(os.path.join(root, "2020", "02", "e.jpg"))
+    bump_mtime(os.path.join(root, "2020", "02"))
+    touch(os.path.join(root, "2022", "01", "f.jpg"))
+    bump_mtime(root)
+    shutil.rmtree(os.path.join(root, "2021"))
+    bump_mtime(root)
+
+    # The root changed too, so its own photos are listed again
+    second = PhotoScanner(root, snapshot=first.directories)
+    assert scan(second) == [
+        (".", "top.jpg"),
+        (os.path.join("2020", "02"), "c.png"),
+        (os.path.join("2020", "02"), "e.jpg"),
+        (os.path.join("2022", "01"), "f.jpg"),
+    ]
+    assert second.changed_dirs == {
+        ".", os.path.join("2020", "02"), "2022", os.path.join("2022", "01"),
+        "2021", os.path.join("2021", "05"),
+    }
+    assert "2021" not in second.directories
+
+
+def test_start_dirs_limit_the_scan(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+    first = PhotoScanner(root, snapshot={})
+    scan(first)
+
+    shutil.rmtree(os.path.join(root, "2021"))
+    bump_mtime(root)
+    touch(os.path.join(root, "2020", "01", "g.jpg"))
+    bump_mtime(os.path.join(root, "2020", "01"))
+    partial = PhotoScanner(root, snapshot=first.directories, start_dirs=[os.path.join("2020", "01")])
+    assert scan(partial) == [
+        (os.path.join("2020", "01"), "a.JPG"),
+        (os.path.join("2020", "01"), "b.jpg"),
+        (os.path.join("2020", "01"), "g.jpg"),
+    ]
+    # Directories outside start_dirs are carried over as they were, even
+    # if they have since disappeared
+    assert partial.changed_dirs == {os.path.join("2020", "01")}
+    assert partial.directories[os.path.join("2021", "05")] == first.directories[os.path.join("2021", "05")]
+
+
+def test_cancelled_scan_is_not_finished(tmp_path):
+    make_tree(str(tmp_path))
+    scanner = PhotoScanner(str(tmp_path))
+    scanned = scanner.scan()
+    next(scanned)
+    scanner.cancel()
+    assert list(scanned) == []
+    assert not scanner.finished
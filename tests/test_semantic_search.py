@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from utils.embedding_store import EmbeddingStore
+from utils.file_cache import FileCache
+from utils.semantic_search import (
+    SEARCH_INDEX_CLUSTERED, SEARCH_INDEX_FLAT, ClusteredSearchIndex, FlatSearchIndex,
+    load_search_index, normalise
+)
+
+MODEL = "openai/clip-vit-base-patch32"
+
+
+@pytest.fixture
+def embeddings(tmp_path, monkeypatch):
+    """400 photos with random normalised embeddings in a file cache."""
+    monkeypatch.chdir(tmp_path)
+    vectors = normalise(np.random.default_rng(1).standard_normal((400, 32))).astype(np.float32)
+    paths = [f"photos/{number:03}.jpg" for number in range(len(vectors))]
+    cache = FileCache()
+    store = EmbeddingStore(cache)
+    start = store.append(MODEL, vectors)
+    for offset, path in enumerate(paths):
+        cache.put(path, (offset, offset, offset), embedding_row=start + offset, embedding_model=MODEL)
+    store.close()
+    cache.close()
+    return {"paths": paths, "vectors": vectors}
+
+
+def stored():
+    cache = FileCache()
+    store = EmbeddingStore(cache)
+    rows = cache.embedding_rows(store.model)
+    cache.close()
+    paths = sorted(rows, key=rows.get)
+    return store, paths, np.array([rows[path] for path in paths], dtype=np.int64)
+
+
+def test_flat_index_ranks_by_similarity(embeddings):
+    index = load_search_index(SEARCH_INDEX_FLAT)
+    assert isinstance(index, FlatSearchIndex)
+    assert index.model_name == MODEL
+
+    query = embeddings["vectors"][7]
+    paths, scores = index.search(query, 5)
+    assert paths[0] == embeddings["paths"][7]
+    assert len(paths) == 5
+    assert list(scores) == sorted(scores, reverse=True)
+    expected = np.argsort(-(embeddings["vectors"] @ query), kind="stable")[:5]
+    assert paths == [embeddings["paths"][position] for position in expected]
+
+
+def test_changed_photos_are_left_out(embeddings):
+    cache = FileCache()
+    # A new identity drops the embedding of the old file
+    cache.put(embeddings["paths"][7], (1, 2, 3), label="photo")
+    cache.close()
+
+    paths, _ = load_search_index().search(embeddings["vectors"][7], 400)
+    assert embeddings["paths"][7] not in paths
+    assert len(paths) == 399
+
+
+def test_small_library_is_searched_exhaustively(embeddings):
+    assert isinstance(load_search_index(SEARCH_INDEX_CLUSTERED), FlatSearchIndex)
+
+
+def test_clustered_index_finds_stored_vectors(embeddings, monkeypatch):
+    store, paths, rows = stored()
+    index = ClusteredSearchIndex.build(store, paths, rows)
+    assert index.probes < len(index.centroids)
+    vectors = store.vectors()
+    for position in (0, 123, 399):
+        # A stored vector is nearest to the centroid of its own group
+        found, _ = index.search(vectors[position].astype(np.float32), 3)
+        assert found[0] == embeddings["paths"][position]
+
+    # The saved centroids are reused while the store is unchanged
+    def train(*args, **kwargs):
+        raise AssertionError("retrained")
+    monkeypatch.setattr(ClusteredSearchIndex, "train", staticmethod(train))
+    again = ClusteredSearchIndex.build(store, paths, rows)
+    np.testing.assert_array_equal(again.centroids, index.centroids)
+
+
+def test_no_embeddings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert load_search_index() is None
@@ -0,0 +1,195 @@
+import os
+
+from PIL import Image
+
+from constants.app_constants import (
+    EXIF_PREVIEW_NEVER, EXIF_PREVIEW_IF_LARGE_ENOUGH, EXIF_PREVIEW_ALWAYS, THUMBNAIL_SIZE
+)
+from utils.image_loader import load_exif_preview
+from utils.thumbnail_manifest import ThumbnailManifest
+from utils.thumbnail_generator import (
+    ThumbnailGeneratorThread, render_thumbnail, THUMBNAIL_FROM_PREVIEW, THUMBNAIL_FROM_ORIGINAL
+)
+from helpers import save_photo_with_preview, save_photos
+
+
+def make_library(root):
+    """Five photos in 2021/05, three in 2021/06 and an unreadable one."""
+    save_photos(os.path.join(root, "2021", "05"), 5)
+    save_photos(os.path.join(root, "2021", "06"), 3)
+    with open(os.path.join(root, "2021", "06", "broken.jpg"), "wb") as f:
+        f.write(b"not a jpeg")
+
+
+def thumbnail_files(thumbnails_path):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), thumbnails_path)
+        for directory, _, names in os.walk(thumbnails_path)
+        for name in names
+    )
+
+
+def is_red(img):
+    red, green, blue = img.convert("RGB").getpixel((img.width // 2, img.height // 2))
+    return red > 200 and blue < 60
+
+
+def test_exif_preview_is_read_and_rotated(tmp_path):
+    path = save_photo_with_preview(str(tmp_path / "a.jpg"))
+    preview = load_exif_preview(path)
+    assert preview.size == (160, 120)
+    assert is_red(preview)
+
+    # Orientation 6 means the camera was turned; the preview is turned back
+    path = save_photo_with_preview(str(tmp_path / "b.jpg"), orientation=6)
+    assert load_exif_preview(path).size == (120, 160)
+
+
+def test_photo_without_preview(tmp_path):
+    path = str(tmp_path / "plain.jpg")
+    Image.new("RGB", (640, 480), (0, 0, 255)).save(path)
+    assert load_exif_preview(path) is None
+
+    path = str(tmp_path / "plain.png")
+    Image.new("RGB", (640, 480), (0, 0, 255)).save(path)
+    assert load_exif_preview(path) is None
+
+
+def test_preview_policies(tmp_path):
+    usual = save_photo_with_preview(str(tmp_path / "usual.jpg"))
+    small = save_photo_with_preview(str(tmp_path / "small.jpg"), preview_size=(100, 75))
+
+    img, source = render_thumbnail(usual, EXIF_PREVIEW_NEVER)
+    assert source == THUMBNAIL_FROM_ORIGINAL
+    assert img.size == (THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+    assert not is_red(img)
+
+    # The usual 160x120 preview crops to 120 px, enough for "if large enough"
+    img, source = render_thumbnail(usual, EXIF_PREVIEW_IF_LARGE_ENOUGH)
+    assert source == THUMBNAIL_FROM_PREVIEW
+    assert img.size == (120, 120)
+    assert is_red(img)
+
+    assert render_thumbnail(small, EXIF_PREVIEW_IF_LARGE_ENOUGH)[1] == THUMBNAIL_FROM_ORIGINAL
+    assert render_thumbnail(small, EXIF_PREVIEW_ALWAYS)[1] == THUMBNAIL_FROM_PREVIEW
+
+
+def test_pool_generates_the_same_thumbnails_as_inline(tmp_path):
+    photos = str(tmp_path / "photos")
+    make_library(photos)
+
+    runs = []
+    for workers in (1, 2):
+        thumbnails = str(tmp_path / f"thumbs-{workers}")
+        thread = ThumbnailGeneratorThread(photos, thumbnails, workers=workers)
+        progress = []
+        thread.progress.connect(lambda done, total: progress.append((done, total)))
+        thread.run()
+        runs.append(thread)
+
+        assert (thread.generated, thread.failed, thread.queued) == (8, 1, 9)
+        assert progress[-1] == (9, 9)
+        assert len(thumbnail_files(thumbnails)) == 8
+        with Image.open(os.path.join(thumbnails, "2021", "05", "000.jpg")) as img:
+            assert img.size == (240, 240)
+
+    inline, pool = runs
+    assert sorted(inline.generated_files) == sorted(pool.generated_files)
+    assert thumbnail_files(str(tmp_path / "thumbs-1")) == thumbnail_files(str(tmp_path / "thumbs-2"))
+
+
+def test_cancelled_run_stops_generating(tmp_path):
+    photos = str(tmp_path / "photos")
+    make_library(photos)
+    thread = ThumbnailGeneratorThread(photos, str(tmp_path / "thumbs"), workers=2)
+    finished = []
+    thread.finished.connect(lambda: finished.append(True))
+    thread.cancel()
+    thread.run()
+
+    assert thread.generated == 0
+    assert finished == [True]
+
+
+def generate(photos, thumbnails, cache_file, **kwargs):
+    thread = ThumbnailGeneratorThread(photos, thumbnails, manifest=ThumbnailManifest(cache_file), **kwargs)
+    thread.run()
+    return thread
+
+
+def test_manifest_skips_unchanged_photos(tmp_path):
+    photos, thumbnails, cache_file = str(tmp_path / "photos"), str(tmp_path / "thumbs"), str(tmp_path / "cache.db")
+    make_library(photos)
+    first = generate(photos, thumbnails, cache_file)
+    assert (first.generated, first.failed, first.skipped) == (8, 1, 0)
+
+    second = generate(photos, thumbnails, cache_file)
+    # Only the photo that failed is tried again
+    assert (second.generated, second.failed, second.skipped) == (0, 1, 8)
+
+    # An edited photo is regenerated, and so is a deleted thumbnail
+    edited = os.path.join(photos, "2021", "05", "001.jpg")
+    Image.new("RGB", (320, 240), (1, 2, 3)).save(edited)
+    stat_result = os.stat(edited)
+    os.utime(edited, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 1_000_000_000))
+    os.remove(os.path.join(thumbnails, "2021", "06", "000.jpg"))
+    third = generate(photos, thumbnails, cache_file)
+    assert sorted(os.path.relpath(path, photos) for path in third.generated_files) == [
+        os.path.join("2021", "05", "001.jpg"), os.path.join("2021", "06", "000.jpg")
+    ]
+    assert third.skipped == 6
+
+
+def test_thumbnails_of_deleted_photos_are_removed(tmp_path):
+    photos, thumbnails, cache_file = str(tmp_path / "photos"), str(tmp_path / "thumbs"), str(tmp_path / "cache.db")
+    make_library(photos)
+    generate(photos, thumbnails, cache_file)
+    os.remove(os.path.join(photos, "2021", "05", "000.jpg"))
+    os.remove(os.path.join(photos, "2021", "06", "000.jpg"))
+
+    # A run limited to some folders leaves the others alone
+    partial = generate(photos, thumbnails, cache_file, start_dirs=[os.path.join("2021", "06")])
+    assert partial.removed == 1
+    assert not os.path.exists(os.path.join(thumbnails, "2021", "06", "000.jpg"))
+    assert os.path.exists(os.path.join(thumbnails, "2021", "05", "000.jpg"))
+
+    full = generate(photos, thumbnails, cache_file)
+    assert full.removed == 1
+    assert not os.path.exists(os.path.join(thumbnails, "2021", "05", "000.jpg"))
+
+
+def test_cancelled_scan_removes_nothing(tmp_path):
+    photos, thumbnails, cache_file = str(tmp_path / "photos"), str(tmp_path / "thumbs"), str(tmp_path / "cache.db")
+    make_library(photos)
+    generate(photos, thumbnails, cache_file)
+
+    thread = ThumbnailGeneratorThread(photos, thumbnails, manifest=ThumbnailManifest(cache_file))
+    thread.cancel()
+    thread.run()
+    assert thread.removed == 0
+    assert len(thumbnail_files(thumbnails)) == 8
+
+
+def test_existing_thumbnails_are_adopted(tmp_path):
+    photos, thumbnails, cache_file = str(tmp_path / "photos"), str(tmp_path / "thumbs"), str(tmp_path / "cache.db")
+    make_library(photos)
+    ThumbnailGeneratorThread(photos, thumbnails).run()
+
+    # Thumbnails made before the manifest existed are not generated again
+    adopted = generate(photos, thumbnails, cache_file)
+    assert (adopted.generated, adopted.skipped) == (0, 8)
+
+
+def test_preview_thumbnails_are_upgraded(tmp_path):
+    photos, thumbnails, cache_file = str(tmp_path / "photos"), str(tmp_path / "thumbs"), str(tmp_path / "cache.db")
+    os.makedirs(photos)
+    save_photo_with_preview(os.path.join(photos, "a.jpg"))
+
+    fast = generate(photos, thumbnails, cache_file, exif_preview=EXIF_PREVIEW_ALWAYS)
+    assert (fast.generated, fast.from_preview) == (1, 1)
+    assert generate(photos, thumbnails, cache_file, exif_preview=EXIF_PREVIEW_ALWAYS).skipped == 1
+
+    upgraded = generate(photos, thumbnails, cache_file)
+    assert (upgraded.generated, upgraded.from_preview) == (1, 0)
+    with Image.open(os.path.join(thumbnails, "a.jpg")) as img:
+        assert not is_red(img)
@@ -0,0 +1,122 @@
+import os
+
+from utils.thumbnail_store import PackedThumbnailStore
+
+
+def test_put_get_survives_reload(tmp_path):
+    store = PackedThumbnailStore(str(tmp_path))
+    store.put("thumbs/a.jpg", b"aaaa")
+    store.put("thumbs/b.jpg", b"bb")
+    assert store.get("thumbs/a.jpg") == b"aaaa"
+    store.put("thumbs/c.jpg", b"c")
+    assert store.get("thumbs/c.jpg") == b"c"
+    assert store.save()
+    store.close()
+
+    store = PackedThumbnailStore(str(tmp_path))
+    assert store.get("thumbs/b.jpg") == b"bb"
+    assert store.get("thumbs/missing.jpg") is None
+    store.close()
+
+
+def test_puts_share_one_append_handle(tmp_path, monkeypatch):
+    store = PackedThumbnailStore(str(tmp_path))
+    opened = []
+    real_open = open
+
+    def counting_open(path, *args, **kwargs):
+        opened.append(path)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", counting_open)
+    for i in range(20):
+        store.put(f"thumbs/{i}.jpg", bytes([i]) * 10)
+    assert opened.count(store.pack_file) == 1
+    store.close()
+
+
+def test_remove_appends_tombstones_without_rewriting_index(tmp_path):
+    store = PackedThumbnailStore(str(tmp_path))
+    store.put("thumbs/a.jpg", b"aaaa")
+    store.put("thumbs/b.jpg", b"bbbb")
+    store.save()
+    index_mtime = os.stat(store.index_file).st_mtime_ns
+
+    store.remove(["thumbs/a.jpg", "thumbs/unknown.jpg"])
+    assert "thumbs/a.jpg" not in store
+    assert os.stat(store.index_file).st_mtime_ns == index_mtime
+    assert store.read_tombstones() == [["thumbs/a.jpg"]]
+    store.close()
+
+    # The log is applied on load and folded in by the next save
+    store = PackedThumbnailStore(str(tmp_path))
+    assert "thumbs/a.jpg" not in store
+    assert store.get("thumbs/b.jpg") == b"bbbb"
+    assert store.dead_bytes == 4
+    store.save()
+    assert not os.path.exists(store.tombstone_file)
+    store.close()
+
+
+def test_torn_tombstone_line_is_ignored(tmp_path):
+    store = PackedThumbnailStore(str(tmp_path))
+    store.put("thumbs/a.jpg", b"aaaa")
+    store.put("thumbs/b.jpg", b"bbbb")
+    store.save()
+    store.remove(["thumbs/a.jpg"])
+    store.close()
+    with open(store.tombstone_file, "a") as f:
+        f.write('["thumbs/b.j')
+
+    store = PackedThumbnailStore(str(tmp_path))
+    assert "thumbs/a.jpg" not in store
+    assert store.get("thumbs/b.jpg") == b"bbbb"
+    store.close()
+
+
+def test_unsaved_entries_past_pack_end_are_dropped(tmp_path):
+    store = PackedThumbnailStore(str(tmp_path))
+    store.put("thumbs/a.jpg", b"aaaa")
+    store.save()
+    store.close()
+    with open(store.pack_file, "r+b") as f:
+        f.truncate(2)
+
+    store = PackedThumbnailStore(str(tmp_path))
+    assert "thumbs/a.jpg" not in store
+    store.close()
+
+
+def test_compaction_moves_live_thumbnails_to_new_pack(tmp_path):
+    store = PackedThumbnailStore(str(tmp_path), compaction_ratio=0.5)
+    for name in "abcd":
+        store.put(f"thumbs/{name}.jpg", name.encode() * 8)
+    store.save()
+    old_pack = store.pack_file
+
+    store.remove(["thumbs/a.jpg"])
+    assert not store.needs_compaction()
+    assert not store.compact_if_needed()
+    store.remove(["thumbs/b.jpg"])
+    assert store.compact_if_needed()
+
+    assert store.generation == 1
+    assert not os.path.exists(old_pack)
+    assert not os.path.exists(store.tombstone_file)
+    assert os.path.getsize(store.pack_file) == 16
+    assert store.dead_bytes == 0
+
+    # Writes after a compaction go to the new pack
+    store.put("thumbs/e.jpg", b"eeee")
+    store.save()
+    store.close()
+
+    store = PackedThumbnailStore(str(tmp_path))
+    assert store.generation == 1
+    assert {key: store.get(key) for key in ("thumbs/c.jpg", "thumbs/d.jpg", "thumbs/e.jpg")} == {
+        "thumbs/c.jpg": b"c" * 8,
+        "thumbs/d.jpg": b"d" * 8,
+        "thumbs/e.jpg": b"eeee",
+    }
+    assert "thumbs/a.jpg" not in store
+    store.close()
@@ -1,11 +1,19 @@
 import os
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QGridLayout, QLabel, QScrollArea, 
-    QWidget, QGroupBox, QDoubleSpinBox, QPushButton, QMessageBox,
-    QLineEdit, QFileDialog
+    QWidget, QGroupBox, QDoubleSpinBox, QSpinBox, QPushButton, QMessageBox,
+    QLineEdit, QFileDialog, QCheckBox, QComboBox
 )
 from PyQt5.QtCore import Qt
 
+from constants.app_constants import (
+    EXIF_PREVIEW_NEVER, EXIF_PREVIEW_IF_LARGE_ENOUGH, EXIF_PREVIEW_ALWAYS,
+    THUMBNAIL_STORAGE_FILES, THUMBNAIL_STORAGE_PACKED,
+    CLIP_BACKEND_PYTORCH, CLIP_BACKEND_INT8, CLIP_BACKEND_ONNX
+)
+from utils.catalog import CATALOG_BACKEND_JSON, CATALOG_BACKEND_SQLITE, CATALOG_BACKEND_BINARY
+from utils.semantic_search import SEARCH_INDEX_FLAT, SEARCH_INDEX_CLUSTERED
+
 class ConfigWindow(QDialog):
     def __init__(self, parent=None, config_manager=None):
         super().__init__(parent)
@@ -74,10 +82,201 @@ class ConfigWindow(QDialog):
         threshold_layout.addWidget(threshold_label)
         threshold_layout.addWidget(self.threshold_spin)
         clip_layout.addLayout(threshold_layout)
+
+        clip_backend_layout = QHBoxLayout()
+        clip_backend_label = QLabel("Inference backend:")
+        self.clip_backend_combo = QComboBox()
+        self.clip_backend_combo.addItem("PyTorch (full precision)", CLIP_BACKEND_PYTORCH)
+        self.clip_backend_combo.addItem("PyTorch int8 (quantised)", CLIP_BACKEND_INT8)
+        self.clip_backend_combo.addItem("ONNX Runtime", CLIP_BACKEND_ONNX)
+        self.clip_backend_combo.setCurrentIndex(max(0, self.clip_backend_combo.findData(
+            self.config_manager.get_value("clip", "backend")
+        )))
+
+        clip_backend_layout.addWidget(clip_backend_label)
+        clip_backend_layout.addWidget(self.clip_backend_combo)
+        clip_layout.addLayout(clip_backend_layout)
+
+        batch_layout = QHBoxLayout()
+        batch_label = QLabel("Images per batch:")
+        self.batch_spin = QSpinBox()
+        self.batch_spin.setRange(1, 1024)
+        self.batch_spin.setValue(
+            self.config_manager.get_value("clip", "batch_size")
+        )
+
+        batch_layout.addWidget(batch_label)
+        batch_layout.addWidget(self.batch_spin)
+        clip_layout.addLayout(batch_layout)
+
+        decode_layout = QHBoxLayout()
+        decode_label = QLabel("Decode threads:")
+        self.decode_workers_spin = QSpinBox()
+        self.decode_workers_spin.setRange(0, 64)
+        self.decode_workers_spin.setSpecialValueText("Automatic")
+        self.decode_workers_spin.setValue(
+            self.config_manager.get_value("clip", "decode_workers")
+        )
+
+        decode_layout.addWidget(decode_label)
+        decode_layout.addWidget(self.decode_workers_spin)
+        clip_layout.addLayout(decode_layout)
+
+        processes_layout = QHBoxLayout()
+        processes_label = QLabel("Classification processes:")
+        self.processes_spin = QSpinBox()
+        self.processes_spin.setRange(0, 64)
+        self.processes_spin.setSpecialValueText("Automatic")
+        self.processes_spin.setValue(
+            self.config_manager.get_value("clip", "processes")
+        )
+
+        processes_layout.addWidget(processes_label)
+        processes_layout.addWidget(self.processes_spin)
+        clip_layout.addLayout(processes_layout)
+
+        self.decode_thumbnails_check = QCheckBox("Classify from thumbnails instead of originals")
+        self.decode_thumbnails_check.setChecked(
+            bool(self.config_manager.get_value("clip", "decode_from_thumbnails"))
+        )
+        clip_layout.addWidget(self.decode_thumbnails_check)
+
+        self.preload_check = QCheckBox("Load the classification libraries in the background at startup")
+        self.preload_check.setChecked(
+            bool(self.config_manager.get_value("clip", "preload"))
+        )
+        clip_layout.addWidget(self.preload_check)
         
         clip_group.setLayout(clip_layout)
         
         scroll_layout.addWidget(clip_group)
+
+        # Grupo de miniaturas
+        thumbnails_group = QGroupBox("Thumbnails")
+        thumbnails_layout = QVBoxLayout()
+
+        workers_layout = QHBoxLayout()
+        workers_label = QLabel("Worker processes:")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(0, 256)
+        self.workers_spin.setSpecialValueText("Automatic")
+        self.workers_spin.setValue(
+            self.config_manager.get_value("thumbnails", "workers")
+        )
+
+        workers_layout.addWidget(workers_label)
+        workers_layout.addWidget(self.workers_spin)
+        thumbnails_layout.addLayout(workers_layout)
+
+        self.incremental_check = QCheckBox("Only regenerate new or changed photos")
+        self.incremental_check.setChecked(
+            bool(self.config_manager.get_value("thumbnails", "incremental"))
+        )
+        thumbnails_layout.addWidget(self.incremental_check)
+
+        preview_layout = QHBoxLayout()
+        preview_label = QLabel("Use embedded EXIF preview:")
+        self.preview_combo = QComboBox()
+        self.preview_combo.addItem("Never", EXIF_PREVIEW_NEVER)
+        self.preview_combo.addItem("If large enough", EXIF_PREVIEW_IF_LARGE_ENOUGH)
+        self.preview_combo.addItem("Always", EXIF_PREVIEW_ALWAYS)
+        self.preview_combo.setCurrentIndex(max(0, self.preview_combo.findData(
+            self.config_manager.get_value("thumbnails", "exif_preview")
+        )))
+
+        preview_layout.addWidget(preview_label)
+        preview_layout.addWidget(self.preview_combo)
+        thumbnails_layout.addLayout(preview_layout)
+
+        storage_layout = QHBoxLayout()
+        storage_label = QLabel("Storage:")
+        self.storage_combo = QComboBox()
+        self.storage_combo.addItem("One file per photo", THUMBNAIL_STORAGE_FILES)
+        self.storage_combo.addItem("Single packed file", THUMBNAIL_STORAGE_PACKED)
+        self.storage_combo.setCurrentIndex(max(0, self.storage_combo.findData(
+            self.config_manager.get_value("thumbnails", "storage")
+        )))
+
+        storage_layout.addWidget(storage_label)
+        storage_layout.addWidget(self.storage_combo)
+        thumbnails_layout.addLayout(storage_layout)
+
+        thumbnails_group.setLayout(thumbnails_layout)
+
+        scroll_layout.addWidget(thumbnails_group)
+
+        # Grupo del catálogo
+        catalog_group = QGroupBox("Catalog")
+        catalog_layout = QVBoxLayout()
+
+        backend_layout = QHBoxLayout()
+        backend_label = QLabel("Backend:")
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("JSON files", CATALOG_BACKEND_JSON)
+        self.backend_combo.addItem("SQLite database", CATALOG_BACKEND_SQLITE)
+        self.backend_combo.addItem("Binary columns (memory-mapped)", CATALOG_BACKEND_BINARY)
+        self.backend_combo.setCurrentIndex(max(0, self.backend_combo.findData(
+            self.config_manager.get_value("catalog", "backend")
+        )))
+
+        backend_layout.addWidget(backend_label)
+        backend_layout.addWidget(self.backend_combo)
+        catalog_layout.addLayout(backend_layout)
+
+        self.incremental_index_check = QCheckBox("Only rescan changed folders when indexing")
+        self.incremental_index_check.setChecked(
+            bool(self.config_manager.get_value("index", "incremental"))
+        )
+        catalog_layout.addWidget(self.incremental_index_check)
+
+        self.sharded_index_check = QCheckBox("Also write the index as one file per year")
+        self.sharded_index_check.setChecked(
+            bool(self.config_manager.get_value("index", "sharded"))
+        )
+        catalog_layout.addWidget(self.sharded_index_check)
+
+        self.watcher_check = QCheckBox("Watch the photos folder and update automatically")
+        self.watcher_check.setChecked(
+            bool(self.config_manager.get_value("watcher", "enabled"))
+        )
+        catalog_layout.addWidget(self.watcher_check)
+
+        catalog_group.setLayout(catalog_layout)
+
+        scroll_layout.addWidget(catalog_group)
+
+        # Grupo de búsqueda
+        search_group = QGroupBox("Search")
+        search_layout = QVBoxLayout()
+
+        search_index_layout = QHBoxLayout()
+        search_index_label = QLabel("Index:")
+        self.search_index_combo = QComboBox()
+        self.search_index_combo.addItem("Exact (every photo)", SEARCH_INDEX_FLAT)
+        self.search_index_combo.addItem("Clustered (faster on large libraries)", SEARCH_INDEX_CLUSTERED)
+        self.search_index_combo.setCurrentIndex(max(0, self.search_index_combo.findData(
+            self.config_manager.get_value("search", "index")
+        )))
+
+        search_index_layout.addWidget(search_index_label)
+        search_index_layout.addWidget(self.search_index_combo)
+        search_layout.addLayout(search_index_layout)
+
+        results_layout = QHBoxLayout()
+        results_label = QLabel("Results shown:")
+        self.search_results_spin = QSpinBox()
+        self.search_results_spin.setRange(10, 10000)
+        self.search_results_spin.setValue(
+            self.config_manager.get_value("search", "results")
+        )
+
+        results_layout.addWidget(results_label)
+        results_layout.addWidget(self.search_results_spin)
+        search_layout.addLayout(results_layout)
+
+        search_group.setLayout(search_layout)
+
+        scroll_layout.addWidget(search_group)
         scroll_layout.addStretch()
         
         scroll.setWidget(scroll_content)
@@ -118,6 +317,92 @@ class ConfigWindow(QDialog):
             "confidence_threshold", 
             self.threshold_spin.value()
         )
+        self.config_manager.set_value(
+            "clip",
+            "batch_size",
+            self.batch_spin.value()
+        )
+        self.config_manager.set_value(
+            "clip",
+            "backend",
+            self.clip_backend_combo.currentData()
+        )
+        self.config_manager.set_value(
+            "clip",
+            "decode_workers",
+            self.decode_workers_spin.value()
+        )
+        self.config_manager.set_value(
+            "clip",
+            "processes",
+            self.processes_spin.value()
+        )
+        self.config_manager.set_value(
+            "clip",
+            "decode_from_thumbnails",
+            self.decode_thumbnails_check.isChecked()
+        )
+        self.config_manager.set_value(
+            "clip",
+            "preload",
+            self.preload_check.isChecked()
+        )
+
+        # Guardar configuración de miniaturas
+        self.config_manager.set_value(
+            "thumbnails",
+            "workers",
+            self.workers_spin.value()
+        )
+        self.config_manager.set_value(
+            "thumbnails",
+            "incremental",
+            self.incremental_check.isChecked()
+        )
+        self.config_manager.set_value(
+            "thumbnails",
+            "exif_preview",
+            self.preview_combo.currentData()
+        )
+        self.config_manager.set_value(
+            "thumbnails",
+            "storage",
+            self.storage_combo.currentData()
+        )
+
+        # Guardar configuración del catálogo
+        self.config_manager.set_value(
+            "catalog",
+            "backend",
+            self.backend_combo.currentData()
+        )
+        self.config_manager.set_value(
+            "index",
+            "incremental",
+            self.incremental_index_check.isChecked()
+        )
+        self.config_manager.set_value(
+            "index",
+            "sharded",
+            self.sharded_index_check.isChecked()
+        )
+        self.config_manager.set_value(
+            "watcher",
+            "enabled",
+            self.watcher_check.isChecked()
+        )
+
+        # Guardar configuración de búsqueda
+        self.config_manager.set_value(
+            "search",
+            "index",
+            self.search_index_combo.currentData()
+        )
+        self.config_manager.set_value(
+            "search",
+            "results",
+            self.search_results_spin.value()
+        )
         
         if self.config_manager.save_config():
             self.accept()
@@ -4,22 +4,36 @@ import json
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QScrollArea, 
     QFrame, QPushButton, QLabel, QMenu, QAction, QActionGroup,
-    QProgressDialog, QMessageBox, QDialog
+    QProgressDialog, QMessageBox, QDialog, QLineEdit
 )
-from PyQt5.QtCore import Qt
-from transformers import CLIPProcessor, CLIPModel
+from PyQt5.QtCore import Qt, QTimer
 
 from config.config_manager import ConfigManager
-from constants.app_constants import MONTHS
+from constants.app_constants import (
+    MONTHS, THUMBNAIL_STORAGE_PACKED, CLASSIFICATION_CHECKPOINT_FILE
+)
 from utils.duplicate_detector import DuplicateDetector
-from utils.image_classifier import ImageClassifierThread
+from utils.catalog import create_catalog
+from utils.ml_preload import MLPreloadThread
+from utils.facets import FacetSummary, year_month_key
+from utils.index_shards import (
+    ShardLoaderThread, index_source, remove_index_shards, write_index_shards
+)
+from utils.library_watcher import LibraryWatcher, DuplicateUpdateThread
+from utils.photo_scanner import PhotoScanner
+from utils.semantic_search import SemanticSearchThread
+from utils.photo_index import (
+    index_entry, index_sort_key, merge_index,
+    load_index_snapshot, save_index_snapshot, remove_index_snapshot
+)
+from utils.thumbnail_generator import ThumbnailGeneratorThread
+from utils.thumbnail_manifest import ThumbnailManifest
+from utils.thumbnail_store import PackedThumbnailStore
 from ui.widgets.flow_layout import FlowLayout
 from ui.widgets.thumbnail_widget import ThumbnailWidget
 from ui.config_window import ConfigWindow
 from ui.image_window import ImageWindow
 
-from PIL import Image, ImageOps
-
 class PhotoGalleryApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -30,12 +44,32 @@ class PhotoGalleryApp(QMainWindow):
         self.setup_variables()
         self.setup_ui()
         self.load_initial_data()
+        self.setup_library_watcher()
+        # Se ofrece reanudar una clasificación interrumpida
+        QTimer.singleShot(0, self.offer_classification_resume)
+        # Las librerías de clasificación se cargan una vez visible la ventana
+        QTimer.singleShot(0, self.start_ml_preload)
 
     def setup_variables(self):
         self.config_manager = ConfigManager()
         self.image_windows = []
         self.model = None
         self.processor = None
+        self.image_encoder = None
+        self.ml_preload_thread = None
+        self.update_all_pending = False
+        self.thumbnail_store = None
+        self.catalog_backend = self.config_manager.get_value("catalog", "backend")
+        self.catalog = create_catalog(self.catalog_backend)
+        self.library_watcher = None
+        self.pending_library_dirs = set()
+        self.library_update_running = False
+        self.generation_in_progress = False
+        self.shard_loader = None
+        self.search_thread = None
+        self.search_index = None
+        # Paths matching the search, best first; None without a search
+        self.search_results = None
         
         # Filters and sorting
         self.filter_year = None
@@ -43,6 +77,8 @@ class PhotoGalleryApp(QMainWindow):
         self.filter_label = None
         self.sort_order = "ascending"
         self.show_duplicates = False
+        self.facets = {"years": {}, "months": {}, "year_months": {}, "labels": {}}
+        self.month_actions = {}
         
         # Pagination
         self.items_per_page = 100
@@ -58,6 +94,10 @@ class PhotoGalleryApp(QMainWindow):
         main_layout.setContentsMargins(0, 0, 0, 0)
         main_layout.setSpacing(0)
 
+        # Search
+        self.setup_search_frame()
+        main_layout.addWidget(self.search_frame)
+
         # Scroll area
         self.setup_scroll_area()
         main_layout.addWidget(self.scroll_area)
@@ -71,8 +111,8 @@ class PhotoGalleryApp(QMainWindow):
         self.setup_menu()
 
     def load_filter_options(self):
-        """Loads filtering options from data files"""
-        if not os.path.exists("index.json"):
+        """Loads filtering options from the catalog"""
+        if not self.catalog.exists():
             return
 
         # Clear existing menus
@@ -80,23 +120,11 @@ class PhotoGalleryApp(QMainWindow):
         self.month_menu.clear()
         self.label_menu.clear()
 
-        # Load index data
-        with open("index.json", "r") as f:
-            images = json.load(f)
-
-        # Get unique years and months
-        years = sorted(set(image["year"] for image in images))
-        months = sorted(set(image["month"] for image in images))
-
-        # Obtain labels if they exist
-        labels = set()
-        if os.path.exists("classification_results.json"):
-            try:
-                with open("classification_results.json", "r") as f:
-                    classification_data = json.load(f)
-                    labels = set(item["label"] for item in classification_data.values())
-            except Exception as e:
-                print(f"Error loading labels: {e}")
+        # Image counts per year, month and label
+        self.facets = self.catalog.get_facets()
+        years = sorted(self.facets["years"])
+        months = sorted(self.facets["months"])
+        labels = self.facets["labels"]
 
         # Create the groups of actions
         self.year_action_group = QActionGroup(self)
@@ -107,7 +135,7 @@ class PhotoGalleryApp(QMainWindow):
         self.setup_filter_actions("All", years, months, labels)
      
     def load_initial_data(self):
-        if os.path.exists("index.json"):
+        if self.catalog.exists():
             self.load_filter_options()
             self.load_gallery()
 
@@ -122,6 +150,21 @@ class PhotoGalleryApp(QMainWindow):
         self.content_widget.setLayout(self.flow_layout)
         self.scroll_area.setWidget(self.content_widget)
 
+    def setup_search_frame(self):
+        self.search_frame = QFrame()
+        layout = QHBoxLayout(self.search_frame)
+        layout.setContentsMargins(5, 5, 5, 5)
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search photos, e.g. \"a dog on the beach\", and press Enter")
+        self.search_edit.setClearButtonEnabled(True)
+        layout.addWidget(self.search_edit)
+
+        self.search_edit.returnPressed.connect(self.start_search)
+        self.search_edit.textChanged.connect(
+            lambda text: self.clear_search() if not text else None
+        )
+
     def setup_pagination_frame(self):
         self.pagination_frame = QFrame()
         self.pagination_frame.setFrameStyle(QFrame.StyledPanel)
@@ -201,6 +244,7 @@ class PhotoGalleryApp(QMainWindow):
         self.generate_thumbnails_action = QAction("Generate Thumbnails", self)
         self.generate_index_action = QAction("Generate Index", self)
         self.generate_labels_action = QAction("Generate Labels", self)
+        self.relabel_action = QAction("Relabel From Embeddings", self)
         self.generate_duplicates_action = QAction("Generate Duplicates", self)
         
         # Conectar las señales
@@ -208,6 +252,7 @@ class PhotoGalleryApp(QMainWindow):
         self.generate_thumbnails_action.triggered.connect(self.generate_thumbnails)
         self.generate_index_action.triggered.connect(self.generate_index)
         self.generate_labels_action.triggered.connect(self.start_classification)
+        self.relabel_action.triggered.connect(self.start_relabel)
         self.generate_duplicates_action.triggered.connect(self.start_duplicate_detection)
         
         # Agregar las acciones al menú
@@ -216,6 +261,7 @@ class PhotoGalleryApp(QMainWindow):
         generation_menu.addAction(self.generate_thumbnails_action)
         generation_menu.addAction(self.generate_index_action)
         generation_menu.addAction(self.generate_labels_action)
+        generation_menu.addAction(self.relabel_action)
         generation_menu.addAction(self.generate_duplicates_action)
 
         # Submenú Selección
@@ -248,6 +294,7 @@ class PhotoGalleryApp(QMainWindow):
             self.generate_thumbnails_action,
             self.generate_index_action,
             self.generate_labels_action,
+            self.relabel_action,
             self.generate_duplicates_action
         ]
         
@@ -256,7 +303,9 @@ class PhotoGalleryApp(QMainWindow):
 
     def update_tools_menu_state(self):
         """Updates the status of the options in the tools menu."""
-        enabled = self.config_manager.are_paths_configured()
+        self.set_generation_actions_enabled(self.config_manager.are_paths_configured())
+
+    def set_generation_actions_enabled(self, enabled):
         for action in self.generation_actions:
             action.setEnabled(enabled)
 
@@ -296,12 +345,38 @@ class PhotoGalleryApp(QMainWindow):
             return False
         
 
+    def get_thumbnail_store(self):
+        """Returns the packed thumbnail store, or None if thumbnails are files."""
+        thumbnails_path = self.config_manager.get_thumbnails_path()
+        storage = self.config_manager.get_value("thumbnails", "storage")
+        if storage != THUMBNAIL_STORAGE_PACKED or not thumbnails_path:
+            return None
+
+        if self.thumbnail_store is None or self.thumbnail_store.thumbnails_path != thumbnails_path:
+            if self.thumbnail_store is not None:
+                self.thumbnail_store.close()
+            os.makedirs(thumbnails_path, exist_ok=True)
+            self.thumbnail_store = PackedThumbnailStore(thumbnails_path)
+        return self.thumbnail_store
+
     def update_config(self):
+        # The index type or result count may have changed
+        self.search_index = None
+
+        backend = self.config_manager.get_value("catalog", "backend")
+        if backend != self.catalog_backend:
+            self.catalog.close()
+            self.catalog_backend = backend
+            self.catalog = create_catalog(backend)
+            self.load_initial_data()
+
         if hasattr(self, 'classifier_thread'):
             self.classifier_thread.confidence_threshold = self.config_manager.get_value(
                 "clip", "confidence_threshold"
             )
 
+        self.setup_library_watcher()
+
     def toggle_selection_mode(self, checked):
         self.selection_mode = checked
         for i in range(self.flow_layout.count()):
@@ -415,8 +490,14 @@ class PhotoGalleryApp(QMainWindow):
                 if os.path.exists(image['thumbnail']):
                     os.remove(image['thumbnail'])
 
-            # Update JSON files
-            self.update_json_after_deletion(selected_images)
+            # Drop them from the packed thumbnail store
+            store = self.get_thumbnail_store()
+            if store is not None:
+                store.remove(image['thumbnail'] for image in selected_images)
+                store.compact_if_needed()
+
+            # Update the catalog
+            self.catalog.remove_images(selected_images)
 
             # Desactivar la opción "Seleccionar Todo" si está activada
             if self.select_all_action.isChecked():
@@ -437,206 +518,390 @@ class PhotoGalleryApp(QMainWindow):
                 f"An error occurred during deletion: {str(e)}"  # En vez de "Ha ocurrido un error durante la eliminación"
             )
 
-    def update_json_after_deletion(self, selected_images):
-        deleted_originals = {img['original'] for img in selected_images}
-        deleted_thumbnails = {img['thumbnail'] for img in selected_images}
-
-        # Update index.json
-        if os.path.exists("index.json"):
-            with open("index.json", 'r') as f:
-                index_data = json.load(f)
-            index_data = [img for img in index_data if img['original'] not in deleted_originals]
-            with open("index.json", 'w') as f:
-                json.dump(index_data, f, indent=4)
-
-        # Update classification_results.json
-        if os.path.exists("classification_results.json"):
-            with open("classification_results.json", 'r') as f:
-                class_data = json.load(f)
-            class_data = {k: v for k, v in class_data.items() if k not in deleted_thumbnails}
-            with open("classification_results.json", 'w') as f:
-                json.dump(class_data, f, indent=4)
-
-        # Update duplicates.json
-        if os.path.exists("duplicates.json"):
-            with open("duplicates.json", 'r') as f:
-                dup_data = json.load(f)
-            for method in dup_data:
-                dup_data[method] = [
-                    dup for dup in dup_data[method]
-                    if dup['original'] not in deleted_originals
-                    and dup['duplicate'] not in deleted_originals
-                ]
-            with open("duplicates.json", 'w') as f:
-                json.dump(dup_data, f, indent=4)
-
     def generate_thumbnails(self):
         if not self.check_paths():
-            return
-
-        photos_path = self.config_manager.get_photos_path()
-        thumbnails_path = self.config_manager.get_thumbnails_path()
+            return False
 
-        total_images = sum(1 for _, _, files in os.walk(photos_path)
-                         for file in files if file.lower().endswith(('.jpg', '.jpeg', '.png')))
+        self.thumbnail_thread = self.create_thumbnail_thread()
+        self.thumbnail_thread.progress.connect(self.update_thumbnail_progress)
+        self.thumbnail_thread.finished.connect(self.thumbnails_finished)
 
-        progress_dialog = QProgressDialog(
-            "Generating thumbnails...", "Cancel", 0, total_images, self
+        self.thumbnail_progress_dialog = QProgressDialog(
+            "Generating thumbnails...", "Cancel", 0, 0, self
+        )
+        self.thumbnail_progress_dialog.setWindowModality(Qt.WindowModal)
+        self.thumbnail_progress_dialog.canceled.connect(self.thumbnail_thread.cancel)
+        self.thumbnail_progress_dialog.show()
+
+        self.set_generation_actions_enabled(False)
+        self.thumbnail_thread.start()
+        return True
+
+    def create_thumbnail_thread(self, start_dirs=None):
+        return ThumbnailGeneratorThread(
+            self.config_manager.get_photos_path(),
+            self.config_manager.get_thumbnails_path(),
+            self.config_manager.get_thumbnail_workers(),
+            ThumbnailManifest() if self.config_manager.get_value("thumbnails", "incremental") else None,
+            self.config_manager.get_value("thumbnails", "exif_preview"),
+            self.get_thumbnail_store(),
+            start_dirs
         )
-        progress_dialog.setWindowModality(Qt.WindowModal)
-        progress_dialog.show()
-
-        current_progress = 0
-
-        for root, _, files in os.walk(photos_path):
-            if progress_dialog.wasCanceled():
-                break
 
-            for file in files:
-                if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(root, photos_path)
-                    thumb_dir = os.path.join(thumbnails_path, relative_path)
-                    os.makedirs(thumb_dir, exist_ok=True)
+    def update_thumbnail_progress(self, current, total):
+        if self.thumbnail_progress_dialog.maximum() != total:
+            self.thumbnail_progress_dialog.setMaximum(total)
+        self.thumbnail_progress_dialog.setValue(current)
 
-                    if self.generate_thumbnail(file_path, thumb_dir):
-                        current_progress += 1
-                        progress_dialog.setValue(current_progress)
+    def thumbnails_finished(self):
+        self.thumbnail_thread.wait()
+        # Closing a progress dialog emits canceled, so read the state first
+        cancelled = self.thumbnail_thread.cancelled
+        self.thumbnail_progress_dialog.close()
+        self.update_tools_menu_state()
 
-        progress_dialog.close()
-
-    def generate_thumbnail(self, file_path, thumb_dir):
-        try:
-            with Image.open(file_path) as img:
-                img = img.convert("RGB")
-                min_dimension = min(img.size)
-                crop_box = (
-                    (img.width - min_dimension) // 2,
-                    (img.height - min_dimension) // 2,
-                    (img.width + min_dimension) // 2,
-                    (img.height + min_dimension) // 2,
-                )
-                img = img.crop(crop_box)
-                img.thumbnail((300, 300))
-                img = ImageOps.exif_transpose(img)
-                img.save(
-                    os.path.join(thumb_dir, os.path.basename(file_path)),
-                    "JPEG",
-                    quality=85,
-                )
-                return True
-        except Exception:
-            return False
+        if self.update_all_pending:
+            self.update_all_pending = False
+            if not cancelled:
+                self.continue_update_all()
+                return
+        self.process_library_changes()
 
     def generate_index(self):
         if not self.check_paths():
             return
 
+        photos_path = self.config_manager.get_photos_path()
+        snapshot = None
+        if self.config_manager.get_value("index", "incremental") and os.path.exists("index.json"):
+            snapshot = load_index_snapshot(photos_path, self.config_manager.get_thumbnails_path())
+
+        self.build_index(PhotoScanner(photos_path, snapshot=snapshot))
+        self.process_library_changes()
+
+    def build_index(self, scanner, scanned_files=None, show_progress=True):
+        """Writes index.json from the photos found by scanner.
+
+        scanned_files can be the result of a finished scan, as left by the
+        thumbnail stage, to avoid walking the tree again. If scanner was
+        given a directory snapshot, only the directories that changed since
+        are merged into the existing index.
+        """
+        self.generation_in_progress = True
+        try:
+            # index.json is merged and rewritten below, so it has to hold
+            # the deletions still pending in the catalog journal
+            self.catalog.compact()
+            self.write_index(scanner, scanned_files, show_progress)
+        finally:
+            self.generation_in_progress = False
+        self.catalog.refresh()
+
+    def write_index(self, scanner, scanned_files, show_progress):
         photos_path = self.config_manager.get_photos_path()
         thumbnails_path = self.config_manager.get_thumbnails_path()
+        if scanned_files is None:
+            scanned_files = scanner.scan()
+            estimated_total = scanner.estimated_total
+        else:
+            estimated_total = lambda: len(scanned_files)
 
-        index = []
-        total_images = sum(1 for _, _, files in os.walk(photos_path)
-                         for file in files if file.lower().endswith(('.jpg', '.jpeg', '.png')))
-
-        progress_dialog = QProgressDialog(
-            "Generating index...", "Cancel", 0, total_images, self
-        )
-        progress_dialog.setWindowModality(Qt.WindowModal)
-        progress_dialog.show()
+        new_entries = []
+        progress_dialog = None
+        if show_progress:
+            progress_dialog = QProgressDialog(
+                "Generating index...", "Cancel", 0, estimated_total(), self
+            )
+            progress_dialog.setWindowModality(Qt.WindowModal)
+            progress_dialog.show()
 
         current_progress = 0
+        cancelled = False
 
-        for root, _, files in os.walk(photos_path):
-            if progress_dialog.wasCanceled():
+        for scanned in scanned_files:
+            if progress_dialog is not None and progress_dialog.wasCanceled():
+                scanner.cancel()
+                cancelled = True
                 break
 
-            for file in files:
-                if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    relative_path = os.path.relpath(root, photos_path)
-                    thumbnail_file = os.path.join(thumbnails_path, relative_path, file)
-                    original_file = os.path.join(root, file)
-
-                    path_parts = relative_path.split(os.sep)
-                    if len(path_parts) >= 2:
-                        year, month = path_parts[:2]
-                        filename_base = os.path.splitext(file)[0]
-                        filename_parts = filename_base.split("_")
-                        
-                        if len(filename_parts) >= 6:
-                            day = filename_parts[2]
-                            timestamp = "_".join(filename_parts[:6])
-                        else:
-                            day = "01"
-                            timestamp = f"{year}_{month}_{day}_00_00_00"
-
-                        index.append({
-                            "thumbnail": thumbnail_file,
-                            "original": original_file,
-                            "year": year,
-                            "month": month,
-                            "day": day,
-                            "timestamp": timestamp
-                        })
-
-                    current_progress += 1
-                    progress_dialog.setValue(current_progress)
-
-        index.sort(key=lambda x: x["timestamp"])
+            entry = index_entry(scanned, thumbnails_path)
+            if entry:
+                new_entries.append(entry)
+
+            current_progress += 1
+            if progress_dialog is not None:
+                total_images = estimated_total()
+                if progress_dialog.maximum() != total_images:
+                    progress_dialog.setMaximum(total_images)
+                progress_dialog.setValue(current_progress)
+
+        if progress_dialog is not None:
+            progress_dialog.close()
+        complete = scanner.finished and not cancelled
+
+        if scanner.snapshot is not None:
+            # An interrupted incremental update leaves the index as it was
+            if not complete:
+                return
+            with open("index.json", "r") as f:
+                index = merge_index(json.load(f), new_entries, scanner.changed_dirs, photos_path)
+        else:
+            index = sorted(new_entries, key=index_sort_key)
+
         with open("index.json", "w") as f:
             json.dump(index, f, indent=4)
+        FacetSummary().record_index(index)
+        if self.config_manager.get_value("index", "sharded"):
+            write_index_shards(index, index_source("index.json"))
+        else:
+            remove_index_shards()
 
-        progress_dialog.close()
+        if complete:
+            save_index_snapshot(scanner.directories, photos_path, thumbnails_path)
+        else:
+            remove_index_snapshot()
 
     def start_classification(self):
         if not self.check_paths():
             return
 
-        if not os.path.exists("index.json"):
+        if not self.catalog.exists():
+            return
+
+        self.catalog.compact()
+        images_data = self.catalog.get_images()
+        self.run_classifier(images_data, self.current_results(images_data))
+
+    def current_results(self, images_data):
+        # Images keep their current label until they are reached, so the
+        # checkpoints written during the run never lose labels
+        thumbnails = {image["thumbnail"] for image in images_data}
+        return {
+            thumbnail: result for thumbnail, result in self.catalog.get_classifications().items()
+            if thumbnail in thumbnails
+        }
+
+    def start_ml_preload(self):
+        if not self.config_manager.get_value("clip", "preload"):
+            return
+        self.ml_preload_thread = MLPreloadThread()
+        self.ml_preload_thread.start()
+
+    def closeEvent(self, event):
+        """Stops the background threads before the window goes away.
+
+        Their finished signals are blocked first so no stage starts another
+        one, or touches the closed window, once they have stopped.
+        """
+        if self.library_watcher is not None:
+            self.library_watcher.stop()
+
+        threads = []
+        for name in ('ml_preload_thread', 'thumbnail_thread', 'library_thumbnail_thread',
+                     'classifier_thread', 'duplicate_update_thread', 'search_thread',
+                     'shard_loader'):
+            thread = getattr(self, name, None)
+            if thread is None:
+                continue
+            thread.blockSignals(True)
+            if hasattr(thread, 'cancel'):
+                thread.cancel()
+            threads.append(thread)
+        for thread in threads:
+            thread.wait()
+
+        if self.thumbnail_store is not None:
+            self.thumbnail_store.close()
+        self.catalog.close()
+        super().closeEvent(event)
+
+    def offer_classification_resume(self):
+        if not os.path.exists(CLASSIFICATION_CHECKPOINT_FILE):
+            return
+        try:
+            with open(CLASSIFICATION_CHECKPOINT_FILE, "r") as f:
+                checkpoint = json.load(f)
+        except Exception:
+            checkpoint = {}
+
+        reply = QMessageBox.question(
+            self,
+            "Resume Classification",
+            f"A classification run was interrupted after "
+            f"{checkpoint.get('done', 0)} of {checkpoint.get('total', 0)} images.\n"
+            "Resume it? Images already classified are not processed again.",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            os.remove(CLASSIFICATION_CHECKPOINT_FILE)
+            return
+        if checkpoint.get("relabel"):
+            self.start_relabel()
+        else:
+            self.start_classification()
+
+    def start_relabel(self):
+        # Las etiquetas se recalculan con los embeddings guardados
+        if not self.check_paths():
+            return
+
+        if not self.catalog.exists():
             return
 
+        self.catalog.compact()
+        images_data = self.catalog.get_images()
+        self.run_classifier(images_data, self.current_results(images_data), relabel=True)
+
+    def load_clip_model(self):
+        # torch and transformers take seconds to import, so they are only
+        # loaded here, or ahead of time by the preload thread. Importing
+        # them from two threads at once can fail half way, so a preload
+        # still running is waited for.
+        if self.ml_preload_thread is not None:
+            self.ml_preload_thread.wait()
+        from transformers import CLIPProcessor, CLIPModel
+
         if self.model is None:
             self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
             self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
 
-        with open("index.json", "r") as f:
-            images_data = json.load(f)
+    def load_image_encoder(self):
+        # Only classification encodes images; a search needs the text side
+        # alone, so it never exports or loads the vision tower
+        from utils.clip_backends import create_image_encoder
+
+        self.load_clip_model()
+        backend = self.config_manager.get_value("clip", "backend")
+        if self.image_encoder is None or self.image_encoder.backend != backend:
+            try:
+                self.image_encoder = create_image_encoder(
+                    self.model, backend, self.model.config._name_or_path
+                )
+            except Exception as e:
+                QMessageBox.warning(
+                    self,
+                    "Inference Backend",
+                    f"The {backend} backend is not available ({e}); using PyTorch instead."
+                )
+                self.image_encoder = create_image_encoder(self.model)
+
+    def run_classifier(self, images_data, base_results=None, finished_slot=None, relabel=False):
+        """Classifies images_data in the background.
+
+        Without finished_slot a progress dialog is shown and the gallery is
+        reloaded afterwards; otherwise finished_slot is called quietly. With
+        relabel, images with a stored embedding are labelled from it.
+        """
+        from utils.image_classifier import ImageClassifierThread
+
+        if images_data:
+            self.load_image_encoder()
 
         self.classifier_thread = ImageClassifierThread(
             self.model, 
             self.processor, 
             images_data,
-            self.config_manager
+            self.config_manager,
+            base_results,
+            relabel,
+            self.get_thumbnail_store(),
+            self.image_encoder,
+            resumable=finished_slot is None
         )
+        # New embeddings are only searched once the index is rebuilt
+        self.classifier_thread.finished.connect(self.invalidate_search_index)
+
+        if finished_slot is not None:
+            self.classifier_thread.finished.connect(finished_slot)
+            self.classifier_thread.start()
+            return
+
         self.classifier_thread.progress.connect(self.update_classification_progress)
+        self.classifier_thread.relabelled.connect(self.update_relabel_progress)
         self.classifier_thread.finished.connect(self.classification_finished)
 
         self.progress_dialog = QProgressDialog(
             "Classifying images...", "Cancel", 0, len(images_data), self
         )
         self.progress_dialog.setWindowModality(Qt.WindowModal)
+        self.progress_dialog.canceled.connect(self.classifier_thread.cancel)
         self.progress_dialog.show()
         
         self.classifier_thread.start()
 
+    def invalidate_search_index(self):
+        self.search_index = None
+
+    def start_search(self):
+        query = self.search_edit.text().strip()
+        if not query:
+            self.clear_search()
+            return
+        if not self.catalog.exists():
+            return
+        if self.search_thread is not None and self.search_thread.isRunning():
+            return
+
+        self.load_clip_model()
+        self.search_edit.setEnabled(False)
+        self.search_thread = SemanticSearchThread(
+            self.model,
+            self.processor,
+            query,
+            self.search_index,
+            self.config_manager.get_value("search", "index"),
+            self.config_manager.get_value("search", "results")
+        )
+        self.search_thread.finished.connect(self.search_finished)
+        self.search_thread.start()
+
+    def search_finished(self):
+        self.search_thread.wait()
+        self.search_edit.setEnabled(True)
+        self.search_edit.setFocus()
+        self.search_index = self.search_thread.index
+        if self.search_thread.error:
+            QMessageBox.information(self, "Search", self.search_thread.error)
+            return
+        # El texto se pudo borrar mientras se buscaba
+        if not self.search_edit.text().strip():
+            return
+
+        self.search_results = self.search_thread.results
+        self.loaded_thumbnails.clear()
+        self.load_gallery()
+
+    def clear_search(self):
+        if self.search_results is None:
+            return
+        self.search_results = None
+        self.loaded_thumbnails.clear()
+        self.load_gallery()
+
     def update_classification_progress(self, thumbnail_path, label, confidence):
         self.progress_dialog.setValue(self.progress_dialog.value() + 1)
 
+    def update_relabel_progress(self, count):
+        self.progress_dialog.setValue(self.progress_dialog.value() + count)
+
     def classification_finished(self):
+        self.classifier_thread.wait()
         self.progress_dialog.close()
+        self.catalog.refresh()
         self.load_filter_options()
         self.load_gallery()
+        self.process_library_changes()
 
     def start_duplicate_detection(self):
 
         if not self.check_paths():
             return
             
-        if not os.path.exists("index.json"):
+        if not self.catalog.exists():
             return
 
-        with open("index.json", "r") as f:
-            images_data = json.load(f)
+        self.catalog.compact()
+        images_data = self.catalog.get_images()
 
         progress_dialog = QProgressDialog(
             "Searching for duplicates...", "Cancel", 0, len(images_data), self
@@ -644,13 +909,18 @@ class PhotoGalleryApp(QMainWindow):
         progress_dialog.setWindowModality(Qt.WindowModal)
         progress_dialog.show()
 
-        detector = DuplicateDetector()
-        duplicates = detector.find_duplicates(
-            images_data, 
-            lambda current, total: progress_dialog.setValue(current)
-        )
+        self.generation_in_progress = True
+        try:
+            detector = DuplicateDetector()
+            duplicates = detector.find_duplicates(
+                images_data, 
+                lambda current, total: progress_dialog.setValue(current)
+            )
+        finally:
+            self.generation_in_progress = False
 
         progress_dialog.close()
+        self.catalog.refresh()
 
         total_duplicates = sum(len(group) for group in duplicates.values())
         QMessageBox.information(
@@ -660,13 +930,150 @@ class PhotoGalleryApp(QMainWindow):
             f"- By hash: {len(duplicates.get('hash', []))}\n"
             f"- By EXIF metadata: {len(duplicates.get('exif', []))}"
         )
+        self.process_library_changes()
 
     def update_all(self):
-        self.generate_thumbnails()
-        self.generate_index()
+        # Thumbnails are generated in the background; the remaining stages
+        # run once the thumbnail thread reports that it has finished.
+        self.update_all_pending = self.generate_thumbnails()
+
+    def continue_update_all(self):
+        # The thumbnail stage already scanned the whole tree; index from it
+        # instead of walking the photos again.
+        self.build_index(self.thumbnail_thread.scanner, self.thumbnail_thread.scanned_files)
         self.load_filter_options()
         self.start_classification()
 
+    def setup_library_watcher(self):
+        """Starts or stops watching the photos folder to match the configuration."""
+        if self.library_watcher is not None:
+            self.library_watcher.stop()
+            self.library_watcher.deleteLater()
+            self.library_watcher = None
+        self.pending_library_dirs.clear()
+
+        photos_path = self.config_manager.get_photos_path()
+        if not self.config_manager.get_value("watcher", "enabled"):
+            return
+        if not self.config_manager.are_paths_configured() or not os.path.isdir(photos_path):
+            return
+
+        self.library_watcher = LibraryWatcher(
+            photos_path,
+            self.config_manager.get_value("watcher", "debounce_ms"),
+            self.config_manager.get_value("watcher", "max_delay_ms"),
+            self
+        )
+        self.library_watcher.changes_ready.connect(self.library_changed)
+        self.library_watcher.start()
+
+    def library_changed(self, changed_dirs):
+        self.pending_library_dirs.update(changed_dirs)
+        self.process_library_changes()
+
+    def is_generation_running(self):
+        if self.generation_in_progress or self.library_update_running:
+            return True
+        for name in ('thumbnail_thread', 'classifier_thread'):
+            thread = getattr(self, name, None)
+            if thread is not None and thread.isRunning():
+                return True
+        return False
+
+    def process_library_changes(self):
+        """Brings the library up to date with the folders the watcher reported.
+
+        Changes that arrive while another generation stage runs are kept
+        and processed once it has finished.
+        """
+        if not self.pending_library_dirs or self.is_generation_running():
+            return
+        # There is nothing to keep up to date before the first index
+        if not self.catalog.exists():
+            self.pending_library_dirs.clear()
+            return
+
+        changed_dirs = sorted(self.pending_library_dirs)
+        self.pending_library_dirs.clear()
+
+        self.library_update_running = True
+        self.set_generation_actions_enabled(False)
+        self.library_thumbnail_thread = self.create_thumbnail_thread(changed_dirs)
+        self.library_thumbnail_thread.finished.connect(
+            lambda: self.library_thumbnails_finished(changed_dirs)
+        )
+        self.library_thumbnail_thread.start()
+
+    def library_thumbnails_finished(self, changed_dirs):
+        self.library_thumbnail_thread.wait()
+        previous_images = {image["original"]: image for image in self.catalog.get_images()}
+
+        photos_path = self.config_manager.get_photos_path()
+        snapshot = None
+        if self.config_manager.get_value("index", "incremental"):
+            snapshot = load_index_snapshot(photos_path, self.config_manager.get_thumbnails_path())
+        if snapshot is None:
+            scanner = PhotoScanner(photos_path)
+        else:
+            scanner = PhotoScanner(photos_path, snapshot=snapshot, start_dirs=changed_dirs)
+        self.build_index(scanner, show_progress=False)
+
+        images = self.catalog.get_images()
+        current_originals = {image["original"] for image in images}
+        regenerated = set(self.library_thumbnail_thread.generated_files)
+        new_images = [
+            image for image in images
+            if image["original"] not in previous_images or image["original"] in regenerated
+        ]
+        removed_images = [
+            image for original, image in previous_images.items()
+            if original not in current_originals
+        ]
+
+        if not new_images and not removed_images:
+            self.library_update_finished()
+            return
+
+        # Only libraries that were classified before are kept classified
+        base_results = None
+        classifications = self.catalog.get_classifications()
+        if classifications:
+            removed_thumbnails = {image["thumbnail"] for image in removed_images}
+            base_results = {
+                thumbnail: result for thumbnail, result in classifications.items()
+                if thumbnail not in removed_thumbnails
+            }
+
+        # Both stages write file_cache.db, so they run one after the other
+        # instead of waiting on each other's transactions
+        self.duplicate_update_thread = DuplicateUpdateThread(
+            new_images, [image["original"] for image in removed_images]
+        )
+        self.duplicate_update_thread.finished.connect(
+            lambda: self.library_duplicates_finished(new_images, base_results)
+        )
+        self.duplicate_update_thread.start()
+
+    def library_duplicates_finished(self, new_images, base_results):
+        self.duplicate_update_thread.wait()
+        if base_results is None:
+            self.library_update_finished()
+            return
+        self.run_classifier(new_images, base_results, self.library_update_finished)
+
+    def library_update_finished(self):
+        for name in ('classifier_thread', 'duplicate_update_thread'):
+            thread = getattr(self, name, None)
+            if thread is not None:
+                thread.wait()
+        self.library_update_running = False
+        self.catalog.refresh()
+        self.load_filter_options()
+        self.loaded_thumbnails.clear()
+        self.load_gallery(keep_page=True)
+        self.update_tools_menu_state()
+        self.process_library_changes()
+
     def set_sort_order(self, order, asc_action, desc_action):
         self.sort_order = order
         asc_action.setChecked(order == "ascending")
@@ -675,7 +1082,9 @@ class PhotoGalleryApp(QMainWindow):
         self.load_gallery()
 
     def create_thumbnail(self, thumbnail_path, original_path):
-        thumbnail = ThumbnailWidget(thumbnail_path, original_path, self.content_widget)
+        thumbnail = ThumbnailWidget(
+            thumbnail_path, original_path, self.content_widget, self.get_thumbnail_store()
+        )
         if hasattr(self, 'selection_mode') and self.selection_mode:
             thumbnail.set_selection_mode(True)
         return thumbnail
@@ -686,10 +1095,11 @@ class PhotoGalleryApp(QMainWindow):
         all_years_action.triggered.connect(lambda: self.set_filter(year=all_text))
         self.year_menu.addAction(all_years_action)
         self.year_action_group.addAction(all_years_action)
-        all_years_action.setChecked(True)
+        all_years_action.setChecked(self.filter_year is None)
 
         for year in years:
-            action = QAction(year, self, checkable=True)
+            action = QAction(f"{year} ({self.facets['years'][year]})", self, checkable=True)
+            action.setChecked(year == self.filter_year)
             action.triggered.connect(lambda checked, y=year: self.set_filter(year=y))
             self.year_menu.addAction(action)
             self.year_action_group.addAction(action)
@@ -699,11 +1109,13 @@ class PhotoGalleryApp(QMainWindow):
         all_months_action.triggered.connect(lambda: self.set_filter(month=all_text))
         self.month_menu.addAction(all_months_action)
         self.month_action_group.addAction(all_months_action)
-        all_months_action.setChecked(True)
+        all_months_action.setChecked(self.filter_month is None)
 
+        self.month_actions = {}
         for month in months:
-            month_name = MONTHS.get(month, month)
-            action = QAction(month_name, self, checkable=True)
+            action = QAction(self.month_action_text(month), self, checkable=True)
+            self.month_actions[month] = action
+            action.setChecked(month == self.filter_month)
             action.triggered.connect(lambda checked, m=month: self.set_filter(month=m))
             self.month_menu.addAction(action)
             self.month_action_group.addAction(action)
@@ -713,67 +1125,80 @@ class PhotoGalleryApp(QMainWindow):
         all_labels_action.triggered.connect(lambda: self.set_filter(label=all_text))
         self.label_menu.addAction(all_labels_action)
         self.label_action_group.addAction(all_labels_action)
-        all_labels_action.setChecked(True)
+        all_labels_action.setChecked(self.filter_label is None)
 
         for label in sorted(labels):
-            action = QAction(label, self, checkable=True)
+            action = QAction(f"{label} ({labels[label]})", self, checkable=True)
+            action.setChecked(label == self.filter_label)
             action.triggered.connect(lambda checked, l=label: self.set_filter(label=l))
             self.label_menu.addAction(action)
             self.label_action_group.addAction(action)
 
-    def load_gallery(self):
-        if not os.path.exists("index.json"):
+    def month_action_text(self, month):
+        # Con un año seleccionado se cuentan solo las fotos de ese año
+        if self.filter_year:
+            count = self.facets["year_months"].get(year_month_key(self.filter_year, month), 0)
+        else:
+            count = self.facets["months"][month]
+        return f"{MONTHS.get(month, month)} ({count})"
+
+    def update_month_counts(self):
+        for month, action in self.month_actions.items():
+            action.setText(self.month_action_text(month))
+
+    def load_gallery(self, keep_page=False):
+        if not self.catalog.exists():
             return
 
-        with open("index.json", "r") as f:
-            images = json.load(f)
-        
-        classifications = {}
-        if os.path.exists("classification_results.json"):
-            with open("classification_results.json", "r") as f:
-                classifications = json.load(f)
-
-        self.filtered_images = self.filter_images(images, classifications)
-        self.filtered_images.sort(
-            key=lambda x: x["timestamp"],
-            reverse=self.sort_order == "descending"
-        )
+        if self.search_results is not None:
+            # Best match first; the filters still apply
+            self.filtered_images = self.catalog.search_images(
+                self.search_results,
+                year=self.filter_year,
+                month=self.filter_month,
+                label=self.filter_label,
+                duplicates_only=self.show_duplicates
+            )
+        else:
+            self.filtered_images = self.catalog.query_images(
+                year=self.filter_year,
+                month=self.filter_month,
+                label=self.filter_label,
+                duplicates_only=self.show_duplicates,
+                descending=self.sort_order == "descending"
+            )
         
-        self.current_page = 0
+        if keep_page:
+            last_page = max(0, (len(self.filtered_images) - 1) // self.items_per_page)
+            self.current_page = min(self.current_page, last_page)
+        else:
+            self.current_page = 0
         self.load_current_page()
+        self.load_remaining_shards()
 
-    def filter_images(self, images, classifications):
-        filtered = images.copy()
-
+    def load_remaining_shards(self):
+        # Con "All" se muestran los años ya leídos y el resto se lee en segundo plano
         if self.filter_year:
-            filtered = [img for img in filtered if img["year"] == self.filter_year]
-        if self.filter_month:
-            filtered = [img for img in filtered if img["month"] == self.filter_month]
-        if self.filter_label and classifications:
-            filtered = [
-                img for img in filtered
-                if img["thumbnail"] in classifications
-                and classifications[img["thumbnail"]]["label"] == self.filter_label
-            ]
-
-        if self.show_duplicates and os.path.exists("duplicates.json"):
-            with open("duplicates.json", "r") as f:
-                duplicates = json.load(f)
-
-            duplicate_paths = {
-                path
-                for method_duplicates in duplicates.values()
-                for dup in method_duplicates
-                for path in (dup["original"], dup["duplicate"])
-            }
+            return
+        shards = self.catalog.get_shards()
+        if shards is None or not shards.pending_years():
+            return
+        if self.shard_loader is not None and self.shard_loader.isRunning():
+            return
 
-            filtered = [img for img in filtered if img["original"] in duplicate_paths]
+        self.shard_loader = ShardLoaderThread(shards)
+        self.shard_loader.finished.connect(self.shards_loaded)
+        self.shard_loader.start()
 
-        return filtered
+    def shards_loaded(self):
+        self.shard_loader.wait()
+        if self.filter_year is None and self.catalog.get_shards() is self.shard_loader.sharded_index:
+            self.load_gallery(keep_page=True)
 
     def set_filter(self, year=None, month=None, label=None, show_duplicates=None):
         if year is not None:
             self.filter_year = year if year != "All" else None
+            self.update_month_counts()
         if month is not None:
             self.filter_month = month if month != "All" else None
         if label is not None:
@@ -4,8 +4,10 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QPixmap
 from PIL import Image, ImageOps
 
+from constants.app_constants import THUMBNAIL_DISPLAY_SIZE
+
 class ThumbnailWidget(QWidget):
-    def __init__(self, thumbnail_path, original_path, parent=None):
+    def __init__(self, thumbnail_path, original_path, parent=None, store=None):
         super().__init__(parent)
         self.thumbnail_path = thumbnail_path
         self.original_path = original_path
@@ -44,25 +46,14 @@ class ThumbnailWidget(QWidget):
         
         # Label para la imagen
         self.image_label = QLabel()
-        self.image_label.setFixedSize(150, 150)
+        self.image_label.setFixedSize(THUMBNAIL_DISPLAY_SIZE, THUMBNAIL_DISPLAY_SIZE)
         self.image_label.setAlignment(Qt.AlignCenter)
         
         # Cargar la imagen
-        try:
-            with Image.open(thumbnail_path) as img:
-                img = img.convert('RGB')
-                img = ImageOps.exif_transpose(img)
-                img.thumbnail((150, 150))
-                
-                pixmap = QPixmap(thumbnail_path)
-                scaled_pixmap = pixmap.scaled(
-                    150, 150,
-                    Qt.KeepAspectRatio,
-                    Qt.SmoothTransformation
-                )
-                self.image_label.setPixmap(scaled_pixmap)
-        except Exception as e:
-            print(f"Error loading thumbnail {thumbnail_path}: {e}")
+        if store is not None:
+            self.load_from_store(store)
+        else:
+            self.load_from_file()
         
         # Añadir widgets al layout
         self.content_layout.addWidget(self.image_label)
@@ -73,7 +64,34 @@ class ThumbnailWidget(QWidget):
         self.checkbox.move(self.width() - 18, 4)
         
         # Establecer tamaño fijo del widget
-        self.setFixedSize(150, 150)
+        self.setFixedSize(THUMBNAIL_DISPLAY_SIZE, THUMBNAIL_DISPLAY_SIZE)
+    
+    def set_pixmap(self, pixmap):
+        scaled_pixmap = pixmap.scaled(
+            THUMBNAIL_DISPLAY_SIZE, THUMBNAIL_DISPLAY_SIZE,
+            Qt.KeepAspectRatio,
+            Qt.SmoothTransformation
+        )
+        self.image_label.setPixmap(scaled_pixmap)
+
+    def load_from_store(self, store):
+        data = store.get(self.thumbnail_path)
+        pixmap = QPixmap()
+        if data is None or not pixmap.loadFromData(data, "JPEG"):
+            print(f"Error loading thumbnail {self.thumbnail_path}: not in thumbnail store")
+            return
+        self.set_pixmap(pixmap)
+
+    def load_from_file(self):
+        try:
+            with Image.open(self.thumbnail_path) as img:
+                img = img.convert('RGB')
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((THUMBNAIL_DISPLAY_SIZE, THUMBNAIL_DISPLAY_SIZE))
+                
+                self.set_pixmap(QPixmap(self.thumbnail_path))
+        except Exception as e:
+            print(f"Error loading thumbnail {self.thumbnail_path}: {e}")
     
     def resizeEvent(self, event):
         super().resizeEvent(event)
@@ -1,2 +1,22 @@
 from .duplicate_detector import DuplicateDetector
-from .image_classifier import ImageClassifierThread
\ No newline at end of file
+from .thumbnail_generator import ThumbnailGeneratorThread
+from .thumbnail_manifest import ThumbnailManifest
+from .file_cache import FileCache, file_identity
+from .embedding_store import EmbeddingStore
+from .image_loader import load_image
+from .thumbnail_store import PackedThumbnailStore
+from .catalog import JsonCatalog, SqliteCatalog, BinaryCatalog, create_catalog
+from .photo_scanner import PhotoScanner
+from .library_watcher import LibraryWatcher, DuplicateUpdateThread
+from .binary_index import BinaryIndex, write_binary_index, export_index_json
+from .filter_engine import FilterEngine
+from .semantic_search import SemanticSearchThread, load_search_index
+
+
+def __getattr__(name):
+    # The classifier pulls in torch and transformers, which take seconds to
+    # import, so it is only imported when first asked for
+    if name == "ImageClassifierThread":
+        from .image_classifier import ImageClassifierThread
+        return ImageClassifierThread
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
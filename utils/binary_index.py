@@ -0,0 +1,279 @@
+import os
+import json
+import mmap
+
+import numpy as np
+
+BINARY_INDEX_DIR = "index_columns"
+BINARY_INDEX_VERSION = 1
+
+
+def _intern(table, codes, value):
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(table)
+        table.append(value)
+    return code
+
+
+def write_binary_index(images, classifications, directory=BINARY_INDEX_DIR, sources=None):
+    """Converts index.json entries (and classification results) to the
+    columnar format in directory.
+
+    Every column is written to files of a new generation; meta.json, which
+    names the generation in use, is replaced last, so readers always see a
+    complete index. sources is stored in meta.json for the caller to tell
+    whether the index is still current.
+
+    Raises ValueError for entries the format cannot represent, i.e. whose
+    thumbnail file name differs from the original's.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = read_meta(directory)
+    generation = previous["generation"] + 1 if previous else 0
+
+    tables = {name: [] for name in ("years", "months", "days", "labels", "original_dirs", "thumbnail_dirs")}
+    codes = {name: {} for name in tables}
+
+    size = len(images)
+    values = {name: [] for name in ("year", "month", "day", "original_dir", "thumbnail_dir", "label")}
+    confidences = []
+    timestamps = []
+    name_offsets = np.zeros(size + 1, dtype=np.uint64)
+    names = bytearray()
+
+    for position, image in enumerate(images):
+        original_dir, name = os.path.split(image["original"])
+        thumbnail_dir, thumbnail_name = os.path.split(image["thumbnail"])
+        if thumbnail_name != name:
+            raise ValueError(f"Thumbnail name differs from the original: {image['thumbnail']}")
+
+        values["year"].append(_intern(tables["years"], codes["years"], image["year"]))
+        values["month"].append(_intern(tables["months"], codes["months"], image["month"]))
+        values["day"].append(_intern(tables["days"], codes["days"], image["day"]))
+        values["original_dir"].append(
+            _intern(tables["original_dirs"], codes["original_dirs"], original_dir)
+        )
+        values["thumbnail_dir"].append(
+            _intern(tables["thumbnail_dirs"], codes["thumbnail_dirs"], thumbnail_dir)
+        )
+        timestamps.append(image["timestamp"].encode("utf-8"))
+
+        result = classifications.get(image["thumbnail"]) if classifications else None
+        if result is not None:
+            values["label"].append(_intern(tables["labels"], codes["labels"], result["label"]))
+            confidences.append(result["confidence"])
+        else:
+            values["label"].append(-1)
+            confidences.append(np.nan)
+
+        names += name.encode("utf-8")
+        name_offsets[position + 1] = len(names)
+
+    timestamp_width = max((len(timestamp) for timestamp in timestamps), default=1)
+    columns = np.zeros(size, dtype=column_dtype(timestamp_width))
+    for column, column_values in values.items():
+        columns[column] = column_values
+    columns["confidence"] = confidences
+    columns["timestamp"] = timestamps
+
+    ranks = np.unique(columns["timestamp"], return_inverse=True)[1].reshape(-1).astype(np.int64)
+    order = np.stack([np.argsort(ranks, kind="stable"), np.argsort(-ranks, kind="stable")])
+
+    paths = generation_paths(directory, generation)
+    np.save(paths["columns"], columns)
+    np.save(paths["order"], order)
+    np.save(paths["name_offsets"], name_offsets)
+    with open(paths["names"], "wb") as f:
+        f.write(names)
+
+    meta = dict(
+        tables,
+        version=BINARY_INDEX_VERSION,
+        generation=generation,
+        count=size,
+        classified=bool(classifications),
+        sources=sources
+    )
+    meta_file = os.path.join(directory, "meta.json")
+    with open(meta_file + ".tmp", "w") as f:
+        json.dump(meta, f, separators=(",", ":"))
+    os.replace(meta_file + ".tmp", meta_file)
+
+    # Indexes still open keep their mapping of the old files
+    if previous:
+        for path in generation_paths(directory, previous["generation"]).values():
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def column_dtype(timestamp_width):
+    return np.dtype([
+        ("year", np.uint16),
+        ("month", np.uint16),
+        ("day", np.uint16),
+        ("label", np.int16),
+        ("confidence", np.float32),
+        ("original_dir", np.uint32),
+        ("thumbnail_dir", np.uint32),
+        ("timestamp", f"S{timestamp_width}"),
+    ])
+
+
+def generation_paths(directory, generation):
+    return {
+        "columns": os.path.join(directory, f"columns-{generation}.npy"),
+        "order": os.path.join(directory, f"order-{generation}.npy"),
+        "name_offsets": os.path.join(directory, f"name_offsets-{generation}.npy"),
+        "names": os.path.join(directory, f"names-{generation}.bin"),
+    }
+
+
+def read_meta(directory=BINARY_INDEX_DIR):
+    meta_file = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_file):
+        return None
+    try:
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+    except Exception:
+        return None
+    if meta.get("version") != BINARY_INDEX_VERSION:
+        return None
+    return meta
+
+
+def export_index_json(binary_index, index_file="index.json"):
+    """Writes the entries of binary_index back out as index.json."""
+    with open(index_file, "w") as f:
+        json.dump(list(binary_index), f, indent=4)
+
+
+class BinaryIndex:
+    """Memory-mapped columnar index written by write_binary_index.
+
+    Behaves as a read-only sequence of index.json entries; an entry dict is
+    only built when it is accessed, so filtering and paging work on the
+    columns and never hold per-image dicts for the whole library.
+    """
+
+    def __init__(self, directory=BINARY_INDEX_DIR):
+        meta = read_meta(directory)
+        if meta is None:
+            raise FileNotFoundError(f"No binary index in {directory}")
+        self.directory = directory
+        self.meta = meta
+        self.years = meta["years"]
+        self.months = meta["months"]
+        self.days = meta["days"]
+        self.labels = meta["labels"]
+        self.original_dirs = meta["original_dirs"]
+        self.thumbnail_dirs = meta["thumbnail_dirs"]
+        self.classified = meta["classified"]
+        self.size = meta["count"]
+
+        paths = generation_paths(directory, meta["generation"])
+        self.columns = np.load(paths["columns"], mmap_mode="r")
+        self.ascending, self.descending = np.load(paths["order"], mmap_mode="r")
+        self.name_offsets = np.load(paths["name_offsets"], mmap_mode="r")
+        self._names = None
+        if os.path.getsize(paths["names"]):
+            with open(paths["names"], "rb") as f:
+                self._names = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._original_dir_codes = {path: code for code, path in enumerate(self.original_dirs)}
+        self._original_positions = None
+
+    def close(self):
+        if self._names is not None:
+            self._names.close()
+            self._names = None
+
+    def __len__(self):
+        return self.size
+
+    def name(self, position):
+        start, end = self.name_offsets[position:position + 2].tolist()
+        return self._names[start:end].decode("utf-8")
+
+    def entry(self, position):
+        row = self.columns[position]
+        name = self.name(position)
+        return {
+            "thumbnail": os.path.join(self.thumbnail_dirs[row["thumbnail_dir"]], name),
+            "original": os.path.join(self.original_dirs[row["original_dir"]], name),
+            "year": self.years[row["year"]],
+            "month": self.months[row["month"]],
+            "day": self.days[row["day"]],
+            "timestamp": row["timestamp"].decode("utf-8"),
+        }
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.entry(position) for position in range(*key.indices(self.size))]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("index out of range")
+        return self.entry(key)
+
+    def __iter__(self):
+        for position in range(self.size):
+            yield self.entry(position)
+
+    def positions_of(self, originals):
+        """Positions of the given original paths that are in the index."""
+        by_directory = {}
+        for path in originals:
+            directory, name = os.path.split(path)
+            code = self._original_dir_codes.get(directory)
+            if code is not None:
+                by_directory.setdefault(code, set()).add(name)
+
+        positions = []
+        dir_column = self.columns["original_dir"]
+        for code, names in by_directory.items():
+            for position in np.flatnonzero(dir_column == code).tolist():
+                if self.name(position) in names:
+                    positions.append(position)
+        return np.array(positions, dtype=np.int64)
+
+    def original_positions(self):
+        """{original path: position} of every row, built on first use."""
+        if self._original_positions is None:
+            dir_codes = self.columns["original_dir"].tolist()
+            offsets = self.name_offsets.tolist()
+            names = self._names
+            self._original_positions = {
+                os.path.join(
+                    self.original_dirs[code], names[offsets[position]:offsets[position + 1]].decode("utf-8")
+                ): position
+                for position, code in enumerate(dir_codes)
+            }
+        return self._original_positions
+
+    def bitmap_of(self, originals):
+        bitmap = np.zeros(self.size, dtype=bool)
+        bitmap[self.positions_of(originals)] = True
+        return bitmap
+
+    def year_month_counts(self, rows=None):
+        """Counts per (year, month) pair, keyed by their values. rows is an
+        optional boolean mask of the rows to count."""
+        months = len(self.months)
+        combined = self.columns["year"].astype(np.int64) * months + self.columns["month"]
+        if rows is not None:
+            combined = combined[rows]
+        counts = np.bincount(combined, minlength=len(self.years) * months)
+        return {
+            (self.years[code // months], self.months[code % months]): int(counts[code])
+            for code in np.flatnonzero(counts).tolist()
+        }
+
+    def value_counts(self, column, values, rows=None):
+        codes = self.columns[column]
+        if rows is not None:
+            codes = codes[rows]
+        if column == "label":
+            codes = codes[codes >= 0]
+        counts = np.bincount(codes, minlength=len(values))
+        return {value: int(count) for value, count in zip(values, counts.tolist()) if count}
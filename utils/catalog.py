@@ -0,0 +1,795 @@
+import os
+import json
+import sqlite3
+
+from utils.catalog_journal import (
+    JOURNAL_FILE, CatalogJournal, apply_to_classifications, apply_to_duplicates, apply_to_index,
+    compact_journal, deleted_originals, write_json_atomic
+)
+from utils.binary_index import BINARY_INDEX_DIR, BinaryIndex, read_meta, write_binary_index
+from utils.facets import FacetSummary, year_month_key
+from utils.filter_engine import FilterEngine
+from utils.index_shards import INDEX_SHARDS_DIR, index_source, load_index_shards, write_index_shards
+
+INDEX_FILE = "index.json"
+CLASSIFICATION_FILE = "classification_results.json"
+DUPLICATES_FILE = "duplicates.json"
+CATALOG_DB_FILE = "catalog.db"
+
+CATALOG_BACKEND_JSON = "json"
+CATALOG_BACKEND_SQLITE = "sqlite"
+CATALOG_BACKEND_BINARY = "binary"
+
+
+def duplicate_paths(duplicates):
+    """Returns every original path that takes part in a duplicate pair."""
+    return {
+        path
+        for method_duplicates in duplicates.values()
+        for dup in method_duplicates
+        for path in (dup["original"], dup["duplicate"])
+    }
+
+
+class JsonCatalog:
+    """Answers catalog queries from the JSON data files.
+
+    Each file is parsed once and kept in memory, and filters are answered
+    by a FilterEngine built from it, so filtering and sorting never touch
+    the disk. refresh() drops the files that were rewritten
+    since they were read; the lists and dicts handed out are shared and
+    must not be modified by callers.
+
+    If the index was also written as year shards, gallery queries only read
+    the shards they need: the filtered year, or for "All" whichever shards
+    have been loaded so far (see get_shards).
+
+    Deletions are appended to the catalog journal instead of rewriting the
+    data files, and the journal is replayed over every file as it is read.
+    compact() folds it back into the files, which happens once the journal
+    has grown past compaction_ratio of the index and before a generation
+    stage reads or rewrites the files.
+    """
+
+    def __init__(self, index_file=INDEX_FILE, classification_file=CLASSIFICATION_FILE,
+                 duplicates_file=DUPLICATES_FILE, shards_dir=INDEX_SHARDS_DIR,
+                 journal_file=JOURNAL_FILE, compaction_ratio=0.05):
+        self.index_file = index_file
+        self.classification_file = classification_file
+        self.duplicates_file = duplicates_file
+        self.shards_dir = shards_dir
+        self.journal = CatalogJournal(journal_file)
+        self.compaction_ratio = compaction_ratio
+        self._appliers = {
+            index_file: apply_to_index,
+            classification_file: apply_to_classifications,
+            duplicates_file: apply_to_duplicates,
+        }
+        # Changes read from the journal, and its stat when they were read
+        self._changes = None
+        self._journal_key = None
+        # path -> (stat key, parsed data with the journal applied)
+        self._cache = {}
+        self.facets = FacetSummary(index_file, classification_file)
+        self._duplicate_paths = None
+        self._engine = None
+        # None until looked up, False if there are no current shards
+        self._shards = None
+        self._shard_engines = {}
+
+    def exists(self):
+        return self._has(self.index_file)
+
+    def refresh(self):
+        """Picks up data files rewritten by a generation stage."""
+        if self._changes is not None and self.journal.stat_key() != self._journal_key:
+            self._changes = None
+            for path in list(self._cache):
+                self._invalidate(path)
+        for path in list(self._cache):
+            if self._cache[path][0] != self._stat_key(path):
+                self._invalidate(path)
+        if not self._shards or self._shards.source != index_source(self.index_file):
+            self._shards = None
+            self._shard_engines = {}
+
+    def close(self):
+        self._cache.clear()
+        self._changes = None
+        self._duplicate_paths = None
+        self._engine = None
+        self._shards = None
+        self._shard_engines = {}
+
+    def _stat_key(self, path):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    def _invalidate(self, path):
+        self._cache.pop(path, None)
+        self._engine = None
+        self._shard_engines = {}
+        if path == self.index_file:
+            self._shards = None
+        if path == self.duplicates_file:
+            self._duplicate_paths = None
+
+    def _has(self, path):
+        cached = self._cache.get(path)
+        if cached is not None:
+            return cached[0] is not None
+        return os.path.exists(path)
+
+    def get_changes(self):
+        """Changes in the journal that are not in the data files yet."""
+        if self._changes is None:
+            self._journal_key = self.journal.stat_key()
+            self._changes = self.journal.read()
+        return self._changes
+
+    def _load(self, path, default):
+        cached = self._cache.get(path)
+        if cached is not None:
+            return cached[1]
+
+        # Missing files are cached too, until refresh() sees them appear
+        stat_key = self._stat_key(path)
+        data = default
+        if stat_key is not None:
+            with open(path, "r") as f:
+                data = self._appliers[path](json.load(f), self.get_changes())
+        self._cache[path] = (stat_key, data)
+        return data
+
+    def _write(self, path, data):
+        write_json_atomic(path, data)
+        self._invalidate(path)
+        self._cache[path] = (self._stat_key(path), data)
+
+    def get_images(self):
+        return self._load(self.index_file, [])
+
+    def get_classifications(self):
+        return self._load(self.classification_file, {})
+
+    def get_duplicates(self):
+        return self._load(self.duplicates_file, {})
+
+    def get_duplicate_paths(self):
+        if self._duplicate_paths is None:
+            self._duplicate_paths = duplicate_paths(self.get_duplicates())
+        return self._duplicate_paths
+
+    def get_facets(self):
+        """Image counts by "years", "months", "year_months" ("YYYY/MM") and
+        "labels", read from facets.json unless the data files changed."""
+        sections = self.facets.load()
+        index_counts = sections["index"]
+        if index_counts is None:
+            index_counts = self.facets.record_index(self.get_images())
+        label_counts = sections["labels"]
+        if label_counts is None:
+            try:
+                label_counts = self.facets.record_labels(self.get_classifications())
+            except Exception as e:
+                print(f"Error loading labels: {e}")
+                label_counts = {"labels": {}}
+        return dict(index_counts, **label_counts)
+
+    def get_shards(self):
+        """Returns the ShardedIndex matching index.json, or None."""
+        if self._shards is None:
+            self._shards = load_index_shards(index_source(self.index_file), self.shards_dir) or False
+        return self._shards or None
+
+    def _build_engine(self, images):
+        return FilterEngine(
+            images,
+            self.get_classifications(),
+            self.get_duplicate_paths() if self._has(self.duplicates_file) else None
+        )
+
+    def get_filter_engine(self, year=None, descending=False):
+        shards = self.get_shards()
+        if shards is None:
+            if self._engine is None:
+                self._engine = self._build_engine(self.get_images())
+            return self._engine
+
+        if year:
+            key = (year,)
+        else:
+            # "All" starts with the shard holding the first page
+            if not shards.loaded_years() and shards.years:
+                shards.load(shards.years[-1] if descending else shards.years[0])
+            key = tuple(shards.loaded_years())
+        engine = self._shard_engines.get(key)
+        if engine is None:
+            images = shards.load(year) if year else shards.loaded_images()
+            engine = self._build_engine(apply_to_index(images, self.get_changes()))
+            self._shard_engines[key] = engine
+        return engine
+
+    def query_images(self, year=None, month=None, label=None, duplicates_only=False,
+                     descending=False):
+        """Returns the matching images, sorted by timestamp, as a lazy view."""
+        engine = self.get_filter_engine(year, descending)
+        return engine.query(year, month, label, duplicates_only, descending)
+
+    def search_images(self, originals, year=None, month=None, label=None, duplicates_only=False):
+        """Returns the images of originals that match the filters, in the
+        order given (e.g. best search match first), as a lazy view."""
+        engine = self.get_filter_engine(year)
+        return engine.rank(originals, year, month, label, duplicates_only)
+
+    def entries_of(self, originals):
+        """Index entries of the given original paths that are in the catalog."""
+        return [image for image in self.get_images() if image["original"] in originals]
+
+    def remove_images(self, selected_images):
+        """Records the deletion in the journal, in time proportional to the
+        number of images rather than the size of the catalog."""
+        originals = {img['original'] for img in selected_images}
+        change = {
+            "op": "delete",
+            "originals": sorted(originals),
+            "thumbnails": sorted({img['thumbnail'] for img in selected_images}),
+        }
+
+        # Everything is worked out before the journal is written, so a
+        # failure cannot leave a deletion that was only half applied. The
+        # selection only holds the paths; the facets need full entries.
+        classifications = self.get_classifications()
+        removed_labels = [
+            classifications[thumbnail]["label"]
+            for thumbnail in change["thumbnails"] if thumbnail in classifications
+        ]
+        facet_counts = self.facets.subtract_removed(
+            self.facets.load(), self.entries_of(originals), removed_labels
+        )
+
+        self.get_changes()
+        self.journal.append(change)
+        self._changes.append(change)
+        self._journal_key = self.journal.stat_key()
+
+        # Apply the change to what is already in memory
+        for path, (stat_key, data) in list(self._cache.items()):
+            if stat_key is not None:
+                self._cache[path] = (stat_key, self._appliers[path](data, [change]))
+        self._engine = None
+        self._shard_engines = {}
+        self._duplicate_paths = None
+
+        self.facets.record_removed(facet_counts)
+
+        index_size = os.path.getsize(self.index_file) if os.path.exists(self.index_file) else 0
+        if self.journal.size() > index_size * self.compaction_ratio:
+            self.compact()
+
+    def compact(self):
+        """Folds the journal into the data files. Returns whether it had
+        anything to fold."""
+        if not self.get_changes():
+            return False
+
+        shards = self.get_shards()
+        images = self.get_images()
+        files = (
+            (self.index_file, images),
+            (self.classification_file, self.get_classifications()),
+            (self.duplicates_file, self.get_duplicates()),
+        )
+        for path, data in files:
+            if self._has(path):
+                self._write(path, data)
+        self.journal.clear()
+        self._changes = []
+        self._journal_key = None
+
+        self.facets.record_index(images)
+        if self._has(self.classification_file):
+            self.facets.record_labels(self.get_classifications())
+        if shards is not None:
+            write_index_shards(images, index_source(self.index_file), self.shards_dir)
+        return True
+
+
+class BinaryCatalog(JsonCatalog):
+    """Catalog answered from the memory-mapped columnar index (BinaryIndex).
+
+    The generation stages still write the JSON data files. Whenever
+    index.json or the classification results change they are converted to
+    the binary index once; after that, opening the gallery, filtering and
+    paging only map its columns instead of parsing and holding the JSON.
+    Falls back to the JSON files for indexes the format cannot hold.
+
+    Deletions recorded in the catalog journal are hidden with a mask over
+    the columns until the journal is compacted and the index converted
+    again.
+    """
+
+    def __init__(self, directory=BINARY_INDEX_DIR, index_file=INDEX_FILE,
+                 classification_file=CLASSIFICATION_FILE, duplicates_file=DUPLICATES_FILE):
+        super().__init__(index_file, classification_file, duplicates_file)
+        self.directory = directory
+        self.binary_index = None
+        self.refresh()
+
+    def close(self):
+        super().close()
+        if self.binary_index is not None:
+            self.binary_index.close()
+            self.binary_index = None
+
+    def exists(self):
+        return self.binary_index is not None or super().exists()
+
+    def _sources(self):
+        sources = {}
+        for name, path in (("index", self.index_file), ("classifications", self.classification_file)):
+            stat_key = self._stat_key(path)
+            sources[name] = list(stat_key) if stat_key else None
+        return sources
+
+    def refresh(self):
+        """Converts the JSON data files to the binary index if they changed."""
+        super().refresh()
+        sources = self._sources()
+        if sources["index"] is None:
+            self.binary_index = None
+            return
+
+        meta = read_meta(self.directory)
+        if meta is None or meta["sources"] != sources:
+            try:
+                write_binary_index(
+                    super().get_images(), self.get_classifications(), self.directory, sources
+                )
+            except ValueError as e:
+                print(f"Error converting the index: {e}")
+                self.binary_index = None
+                return
+            finally:
+                # The parsed JSON is not needed once it is in columns
+                self._invalidate(self.index_file)
+                self._invalidate(self.classification_file)
+            meta = read_meta(self.directory)
+
+        if self.binary_index is None or self.binary_index.meta["generation"] != meta["generation"]:
+            # Views handed out earlier keep the old mapping alive until dropped
+            self.binary_index = BinaryIndex(self.directory)
+            self._engine = None
+
+    def get_images(self):
+        if self.binary_index is None:
+            return super().get_images()
+        return apply_to_index(list(self.binary_index), self.get_changes())
+
+    def deleted_mask(self):
+        """Rows of the binary index deleted through the journal, or None."""
+        deleted = deleted_originals(self.get_changes())
+        return self.binary_index.bitmap_of(deleted) if deleted else None
+
+    def entries_of(self, originals):
+        if self.binary_index is None:
+            return super().entries_of(originals)
+        positions = self.binary_index.positions_of(originals)
+        deleted = self.deleted_mask()
+        if deleted is not None:
+            positions = positions[~deleted[positions]]
+        return [self.binary_index.entry(position) for position in positions.tolist()]
+
+    def get_shards(self):
+        if self.binary_index is None:
+            return super().get_shards()
+        return None
+
+    def get_filter_engine(self, year=None, descending=False):
+        if self.binary_index is None:
+            return super().get_filter_engine(year, descending)
+        if self._engine is None:
+            index = self.binary_index
+            duplicate_bitmap = None
+            if self._has(self.duplicates_file):
+                duplicate_bitmap = index.bitmap_of(self.get_duplicate_paths())
+            self._engine = FilterEngine.from_columns(
+                index,
+                index.columns["year"], index.years,
+                index.columns["month"], index.months,
+                index.columns["label"], index.labels if index.classified else None,
+                duplicate_bitmap,
+                index.ascending,
+                index.descending,
+                self.deleted_mask(),
+                index.original_positions
+            )
+        return self._engine
+
+    def get_facets(self):
+        if self.binary_index is None:
+            return super().get_facets()
+        index = self.binary_index
+        deleted = self.deleted_mask()
+        rows = None if deleted is None else ~deleted
+        return {
+            "years": index.value_counts("year", index.years, rows),
+            "months": index.value_counts("month", index.months, rows),
+            "year_months": {
+                year_month_key(year, month): count
+                for (year, month), count in index.year_month_counts(rows).items()
+            },
+            "labels": index.value_counts("label", index.labels, rows),
+        }
+
+    def remove_images(self, selected_images):
+        super().remove_images(selected_images)
+        self.refresh()
+
+    def compact(self):
+        compacted = super().compact()
+        self.refresh()
+        return compacted
+
+
+class SqliteImages:
+    """Read-only view of the images matching a SqliteCatalog query, like
+    FilteredImages. The length is one COUNT and each page one indexed
+    SELECT with LIMIT and OFFSET, so only the rows on screen are read."""
+
+    def __init__(self, catalog, conditions, params, descending=False):
+        self.catalog = catalog
+        self.where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        self.params = list(params)
+        self.order = "i.timestamp DESC, i.rowid" if descending else "i.timestamp, i.rowid"
+        self._length = None
+
+    def __len__(self):
+        if self._length is None:
+            self._length = self.catalog.connection.execute(
+                f"SELECT COUNT(*) FROM images i{self.where}", self.params
+            ).fetchone()[0]
+        return self._length
+
+    def _rows(self, limit=-1, offset=0):
+        return self.catalog._image_rows(
+            f"SELECT {SqliteCatalog.SELECT_COLUMNS} FROM images i{self.where} "
+            f"ORDER BY {self.order} LIMIT ? OFFSET ?",
+            self.params + [limit, offset]
+        )
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return list(self)[key]
+            return self._rows(max(0, stop - start), start)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(key)
+        return self._rows(1, key)[0]
+
+    def __iter__(self):
+        return iter(self._rows())
+
+
+class SqliteRankedImages:
+    """Read-only view of the images of a ranked list of originals, in that
+    order. Only the paths are kept; each page is looked up by primary key."""
+
+    def __init__(self, catalog, originals):
+        self.catalog = catalog
+        self.originals = originals
+
+    def __len__(self):
+        return len(self.originals)
+
+    def _rows(self, originals):
+        rows = self.catalog.images_of(originals)
+        return [rows[original] for original in originals if original in rows]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._rows(self.originals[key])
+        return self._rows([self.originals[key]])[0]
+
+    def __iter__(self):
+        return iter(self._rows(self.originals))
+
+
+class SqliteCatalog:
+    """Catalog kept in an indexed SQLite database.
+
+    The generation stages still write the JSON data files; refresh() imports
+    whichever of them changed since the last import, and every query is then
+    answered by SQLite instead of parsing JSON. Gallery filters are indexed
+    SELECTs returned as SqliteImages views, so the library is never loaded
+    into memory as a whole.
+
+    Deletions go straight to the database and are also recorded in the
+    catalog journal, which is replayed whenever a data file is imported,
+    so the JSON files and the other backends stay in step.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            original TEXT PRIMARY KEY,
+            thumbnail TEXT NOT NULL,
+            year TEXT NOT NULL,
+            month TEXT NOT NULL,
+            day TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS images_year ON images (year, timestamp);
+        CREATE INDEX IF NOT EXISTS images_month ON images (month, timestamp);
+        CREATE INDEX IF NOT EXISTS images_timestamp ON images (timestamp);
+        CREATE INDEX IF NOT EXISTS images_thumbnail ON images (thumbnail);
+
+        CREATE TABLE IF NOT EXISTS classifications (
+            thumbnail TEXT PRIMARY KEY,
+            label TEXT NOT NULL,
+            confidence REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS classifications_label ON classifications (label);
+
+        CREATE TABLE IF NOT EXISTS duplicates (
+            method TEXT NOT NULL,
+            original TEXT NOT NULL,
+            duplicate TEXT NOT NULL,
+            similarity REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS duplicates_method ON duplicates (method);
+        CREATE INDEX IF NOT EXISTS duplicates_original ON duplicates (original);
+        CREATE INDEX IF NOT EXISTS duplicates_duplicate ON duplicates (duplicate);
+
+        CREATE TABLE IF NOT EXISTS sources (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        );
+    """
+
+    IMAGE_COLUMNS = ("thumbnail", "original", "year", "month", "day", "timestamp")
+    SELECT_COLUMNS = "i.thumbnail, i.original, i.year, i.month, i.day, i.timestamp"
+    # Paths looked up per statement, below SQLite's limit on parameters
+    LOOKUP_SIZE = 500
+
+    def __init__(self, db_file=CATALOG_DB_FILE, index_file=INDEX_FILE,
+                 classification_file=CLASSIFICATION_FILE, duplicates_file=DUPLICATES_FILE,
+                 journal_file=JOURNAL_FILE, compaction_ratio=0.05):
+        self.db_file = db_file
+        self.index_file = index_file
+        self.classification_file = classification_file
+        self.duplicates_file = duplicates_file
+        self.journal = CatalogJournal(journal_file)
+        self.compaction_ratio = compaction_ratio
+
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self.refresh()
+
+    def close(self):
+        self.connection.close()
+
+    def exists(self):
+        row = self.connection.execute("SELECT 1 FROM images LIMIT 1").fetchone()
+        return row is not None or os.path.exists(self.index_file)
+
+    # Import
+
+    def refresh(self):
+        """Imports the JSON data files that changed since the last import."""
+        importers = (
+            (self.index_file, self.import_index, apply_to_index),
+            (self.classification_file, self.import_classifications, apply_to_classifications),
+            (self.duplicates_file, self.import_duplicates, apply_to_duplicates),
+        )
+        changes = None
+        for path, importer, applier in importers:
+            if not os.path.exists(path):
+                continue
+            mtime_ns = os.stat(path).st_mtime_ns
+            row = self.connection.execute(
+                "SELECT mtime_ns FROM sources WHERE path = ?", (path,)
+            ).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                continue
+            if changes is None:
+                changes = self.journal.read()
+            try:
+                with open(path, "r") as f:
+                    data = applier(json.load(f), changes)
+            except Exception as e:
+                print(f"Error importing {path}: {e}")
+                continue
+            with self.connection:
+                importer(data)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO sources (path, mtime_ns) VALUES (?, ?)",
+                    (path, mtime_ns)
+                )
+
+    def import_index(self, images):
+        self.connection.execute("DELETE FROM images")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO images (thumbnail, original, year, month, day, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (tuple(image[column] for column in self.IMAGE_COLUMNS) for image in images)
+        )
+
+    def import_classifications(self, classifications):
+        self.connection.execute("DELETE FROM classifications")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO classifications (thumbnail, label, confidence) VALUES (?, ?, ?)",
+            (
+                (thumbnail, result["label"], result["confidence"])
+                for thumbnail, result in classifications.items()
+            )
+        )
+
+    def import_duplicates(self, duplicates):
+        self.connection.execute("DELETE FROM duplicates")
+        self.connection.executemany(
+            "INSERT INTO duplicates (method, original, duplicate, similarity) VALUES (?, ?, ?, ?)",
+            (
+                (method, dup["original"], dup["duplicate"], dup["similarity"])
+                for method, method_duplicates in duplicates.items()
+                for dup in method_duplicates
+            )
+        )
+
+    # Queries
+
+    def _image_rows(self, sql, params=()):
+        return [
+            dict(zip(self.IMAGE_COLUMNS, row))
+            for row in self.connection.execute(sql, params)
+        ]
+
+    def get_images(self):
+        return self._image_rows(
+            "SELECT thumbnail, original, year, month, day, timestamp FROM images "
+            "ORDER BY timestamp, rowid"
+        )
+
+    def get_classifications(self):
+        return {
+            thumbnail: {"label": label, "confidence": confidence}
+            for thumbnail, label, confidence in self.connection.execute(
+                "SELECT thumbnail, label, confidence FROM classifications"
+            )
+        }
+
+    def get_duplicates(self):
+        duplicates = {}
+        rows = self.connection.execute(
+            "SELECT method, original, duplicate, similarity FROM duplicates ORDER BY rowid"
+        )
+        for method, original, duplicate, similarity in rows:
+            duplicates.setdefault(method, []).append({
+                "original": original,
+                "duplicate": duplicate,
+                "similarity": similarity,
+                "method": method
+            })
+        return duplicates
+
+    def get_facets(self):
+        """Image counts by "years", "months", "year_months" ("YYYY/MM") and
+        "labels", grouped on the indexed columns."""
+        year_months = {}
+        years = {}
+        months = {}
+        rows = self.connection.execute(
+            "SELECT year, month, COUNT(*) FROM images GROUP BY year, month"
+        )
+        for year, month, count in rows:
+            year_months[year_month_key(year, month)] = count
+            years[year] = years.get(year, 0) + count
+            months[month] = months.get(month, 0) + count
+        labels = dict(self.connection.execute(
+            "SELECT label, COUNT(*) FROM classifications GROUP BY label"
+        ).fetchall())
+        return {"years": years, "months": months, "year_months": year_months, "labels": labels}
+
+    def get_shards(self):
+        return None
+
+    def images_of(self, originals):
+        """{original: image} of the given original paths in the catalog."""
+        images = {}
+        for start in range(0, len(originals), self.LOOKUP_SIZE):
+            chunk = list(originals[start:start + self.LOOKUP_SIZE])
+            for image in self._image_rows(
+                f"SELECT {self.SELECT_COLUMNS} FROM images i "
+                f"WHERE i.original IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ):
+                images[image["original"]] = image
+        return images
+
+    def _conditions(self, year=None, month=None, label=None, duplicates_only=False):
+        conditions = []
+        params = []
+        if year:
+            conditions.append("i.year = ?")
+            params.append(year)
+        if month:
+            conditions.append("i.month = ?")
+            params.append(month)
+        # Like the JSON catalog, the label filter is ignored until there are
+        # classification results at all.
+        if label and self.connection.execute("SELECT 1 FROM classifications LIMIT 1").fetchone():
+            conditions.append(
+                "EXISTS (SELECT 1 FROM classifications c "
+                "WHERE c.thumbnail = i.thumbnail AND c.label = ?)"
+            )
+            params.append(label)
+        if duplicates_only:
+            conditions.append(
+                "(EXISTS (SELECT 1 FROM duplicates d WHERE d.original = i.original) "
+                "OR EXISTS (SELECT 1 FROM duplicates d WHERE d.duplicate = i.original))"
+            )
+        return conditions, params
+
+    def query_images(self, year=None, month=None, label=None, duplicates_only=False,
+                     descending=False):
+        """Returns the matching images, sorted by timestamp, as a lazy view."""
+        conditions, params = self._conditions(year, month, label, duplicates_only)
+        return SqliteImages(self, conditions, params, descending)
+
+    def search_images(self, originals, year=None, month=None, label=None, duplicates_only=False):
+        """Returns the images of originals that match the filters, in the
+        order given, as a lazy view."""
+        conditions, params = self._conditions(year, month, label, duplicates_only)
+        matching = set()
+        for start in range(0, len(originals), self.LOOKUP_SIZE):
+            chunk = list(originals[start:start + self.LOOKUP_SIZE])
+            lookup = f"i.original IN ({', '.join('?' * len(chunk))})"
+            matching.update(row[0] for row in self.connection.execute(
+                "SELECT i.original FROM images i WHERE " + " AND ".join([lookup] + conditions),
+                chunk + params
+            ))
+        return SqliteRankedImages(self, [original for original in originals if original in matching])
+
+    def compact(self):
+        compacted = compact_journal(
+            self.journal, self.index_file, self.classification_file, self.duplicates_file
+        )
+        self.refresh()
+        return compacted
+
+    def remove_images(self, selected_images):
+        self.journal.append({
+            "op": "delete",
+            "originals": sorted({img['original'] for img in selected_images}),
+            "thumbnails": sorted({img['thumbnail'] for img in selected_images}),
+        })
+        deleted_originals = [(img['original'],) for img in selected_images]
+        deleted_thumbnails = [(img['thumbnail'],) for img in selected_images]
+        with self.connection:
+            self.connection.executemany("DELETE FROM images WHERE original = ?", deleted_originals)
+            self.connection.executemany(
+                "DELETE FROM classifications WHERE thumbnail = ?", deleted_thumbnails
+            )
+            self.connection.executemany(
+                "DELETE FROM duplicates WHERE original = ? OR duplicate = ?",
+                [(original, original) for (original,) in deleted_originals]
+            )
+
+        index_size = os.path.getsize(self.index_file) if os.path.exists(self.index_file) else 0
+        if self.journal.size() > index_size * self.compaction_ratio:
+            self.compact()
+
+
+def create_catalog(backend=CATALOG_BACKEND_JSON):
+    if backend == CATALOG_BACKEND_SQLITE:
+        return SqliteCatalog()
+    if backend == CATALOG_BACKEND_BINARY:
+        return BinaryCatalog()
+    return JsonCatalog()
@@ -0,0 +1,130 @@
+import os
+import json
+
+JOURNAL_FILE = "catalog_journal.jsonl"
+
+
+class CatalogJournal:
+    """Append-only log of catalog changes not yet folded into the data files.
+
+    Each line is one deletion:
+        {"op": "delete", "originals": [...], "thumbnails": [...]}
+
+    Additions and new labels come from the generation stages, which
+    compact the journal and then rewrite the data files themselves.
+
+    Readers apply the changes on top of index.json, the classification
+    results and duplicates.json. Replaying a change on data files that
+    already contain it has no effect, so a compaction interrupted after
+    rewriting the data files but before clearing the journal is harmless.
+    """
+
+    def __init__(self, journal_file=JOURNAL_FILE):
+        self.journal_file = journal_file
+
+    def stat_key(self):
+        try:
+            stat_result = os.stat(self.journal_file)
+        except OSError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    def size(self):
+        stat_key = self.stat_key()
+        return stat_key[1] if stat_key else 0
+
+    def read(self):
+        if not os.path.exists(self.journal_file):
+            return []
+        changes = []
+        with open(self.journal_file, "r") as f:
+            for line in f:
+                try:
+                    changes.append(json.loads(line))
+                except ValueError:
+                    # A crash while appending leaves at most a torn last line
+                    break
+        return changes
+
+    def append(self, change):
+        with open(self.journal_file, "a") as f:
+            f.write(json.dumps(change, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+
+
+def deleted_originals(changes):
+    return {
+        original
+        for change in changes if change["op"] == "delete"
+        for original in change["originals"]
+    }
+
+
+def apply_to_index(images, changes):
+    removed = deleted_originals(changes)
+    if not removed:
+        return images
+    return [image for image in images if image["original"] not in removed]
+
+
+def apply_to_classifications(classifications, changes):
+    removed = {
+        thumbnail
+        for change in changes if change["op"] == "delete"
+        for thumbnail in change["thumbnails"]
+    }
+    if not removed:
+        return classifications
+    return {
+        thumbnail: value for thumbnail, value in classifications.items()
+        if thumbnail not in removed
+    }
+
+
+def apply_to_duplicates(duplicates, changes):
+    deleted = deleted_originals(changes)
+    if not deleted:
+        return duplicates
+    return {
+        method: [
+            dup for dup in method_duplicates
+            if dup["original"] not in deleted and dup["duplicate"] not in deleted
+        ]
+        for method, method_duplicates in duplicates.items()
+    }
+
+
+def write_json_atomic(path, data):
+    temp_file = path + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_file, path)
+
+
+def compact_journal(journal, index_file, classification_file, duplicates_file):
+    """Folds the journal into the data files, each replaced with an atomic
+    rename, and clears it. Returns whether there was anything to fold."""
+    changes = journal.read()
+    if not changes:
+        journal.clear()
+        return False
+
+    appliers = (
+        (index_file, apply_to_index),
+        (classification_file, apply_to_classifications),
+        (duplicates_file, apply_to_duplicates),
+    )
+    for path, applier in appliers:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            data = json.load(f)
+        write_json_atomic(path, applier(data, changes))
+
+    journal.clear()
+    return True
@@ -0,0 +1,221 @@
+import os
+import re
+import copy
+import time
+import argparse
+
+import numpy as np
+import torch
+from torch import nn
+
+from constants.app_constants import CLIP_BACKEND_PYTORCH, CLIP_BACKEND_INT8, CLIP_BACKEND_ONNX
+
+CLIP_BACKENDS = (CLIP_BACKEND_PYTORCH, CLIP_BACKEND_INT8, CLIP_BACKEND_ONNX)
+ONNX_MODELS_DIR = "onnx_models"
+
+
+class VisionTower(nn.Module):
+    """The image half of a CLIPModel: pixel values in, projected (not yet
+    normalised) image features out, like CLIPModel.get_image_features."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values=pixel_values).pooler_output
+        return self.visual_projection(pooled_output)
+
+
+class TorchImageEncoder:
+    def __init__(self, module, backend):
+        self.module = module.eval()
+        self.backend = backend
+
+    def __call__(self, pixel_values):
+        with torch.inference_mode():
+            return self.module(pixel_values)
+
+
+class OnnxImageEncoder:
+    """Runs the vision tower exported to ONNX with onnxruntime on the CPU.
+
+    The export is kept in onnx_models/ per model name and reused by later
+    runs. Needs the optional onnx and onnxruntime packages.
+    """
+
+    backend = CLIP_BACKEND_ONNX
+
+    def __init__(self, model, model_name="", directory=ONNX_MODELS_DIR):
+        import onnxruntime
+
+        os.makedirs(directory, exist_ok=True)
+        file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name or "model") + "-vision.onnx"
+        self.path = os.path.join(directory, file_name)
+        # Unnamed models may differ between runs, so they are always exported
+        if not model_name or not os.path.exists(self.path):
+            self.export(model, self.path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            self.path, options, providers=["CPUExecutionProvider"]
+        )
+
+    @staticmethod
+    def export(model, path):
+        image_size = model.config.vision_config.image_size
+        temp_file = path + ".tmp"
+        torch.onnx.export(
+            VisionTower(model).eval(),
+            (torch.zeros(1, 3, image_size, image_size),),
+            temp_file,
+            input_names=["pixel_values"],
+            output_names=["image_features"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_features": {0: "batch"}},
+            opset_version=17,
+            dynamo=False,
+        )
+        os.replace(temp_file, path)
+
+    def __call__(self, pixel_values):
+        features = self.session.run(None, {"pixel_values": pixel_values.numpy()})[0]
+        return torch.from_numpy(features)
+
+
+def create_image_encoder(model, backend=CLIP_BACKEND_PYTORCH, model_name=""):
+    """Returns a callable mapping pixel values to projected image features.
+
+    Raises ImportError if the backend needs a package that is missing.
+    """
+    if backend == CLIP_BACKEND_INT8:
+        # Dynamic quantisation leaves the model itself untouched, so the
+        # text features keep coming from the fp32 weights
+        tower = torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(VisionTower(model)).eval(), {nn.Linear}, dtype=torch.qint8
+        )
+        return TorchImageEncoder(tower, CLIP_BACKEND_INT8)
+    if backend == CLIP_BACKEND_ONNX:
+        return OnnxImageEncoder(model, model_name)
+    return TorchImageEncoder(VisionTower(model), CLIP_BACKEND_PYTORCH)
+
+
+def benchmark_backends(model, pixel_values, text_features, backends=CLIP_BACKENDS,
+                       batch_size=32, model_name=""):
+    """Encodes pixel_values with every backend and compares it with fp32.
+
+    Returns {backend: {"images_per_second", "agreement", "cosine"}}, where
+    agreement is the share of images given the same label as by the fp32
+    backend and cosine the mean similarity of their embeddings. Backends
+    that cannot be created are reported with an "error" instead.
+    """
+    reference = None
+    report = {}
+    for backend in backends:
+        try:
+            encoder = create_image_encoder(model, backend, model_name)
+        except Exception as e:
+            report[backend] = {"error": str(e)}
+            continue
+
+        encoder(pixel_values[:batch_size])
+        features = []
+        start = time.perf_counter()
+        for offset in range(0, len(pixel_values), batch_size):
+            features.append(encoder(pixel_values[offset:offset + batch_size]))
+        elapsed = time.perf_counter() - start
+
+        features = torch.cat(features).float()
+        features = features / features.norm(dim=-1, keepdim=True)
+        labels = (features @ text_features.T).argmax(dim=1)
+        if reference is None:
+            reference = (features, labels)
+        report[backend] = {
+            "images_per_second": len(pixel_values) / elapsed,
+            "agreement": (labels == reference[1]).float().mean().item(),
+            "cosine": (features * reference[0]).sum(dim=1).mean().item(),
+        }
+    return report
+
+
+def tiny_clip_model():
+    """A randomly initialised CLIPModel small enough to benchmark and test
+    the backends offline."""
+    from transformers import CLIPConfig, CLIPModel
+
+    torch.manual_seed(0)
+    config = CLIPConfig(
+        text_config={
+            "hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+            "num_attention_heads": 2, "vocab_size": 1000, "max_position_embeddings": 77,
+        },
+        vision_config={
+            "hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+            "num_attention_heads": 2, "image_size": 224, "patch_size": 32,
+        },
+        projection_dim=64,
+    )
+    return CLIPModel(config).eval()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the throughput and labels of the CLIP backends."
+    )
+    parser.add_argument("--model", default="openai/clip-vit-base-patch32",
+                        help="model name or local path; only the local cache is used")
+    parser.add_argument("--tiny", action="store_true",
+                        help="use a small random model instead, with random label features")
+    parser.add_argument("--images", help="folder with photos; random images are used otherwise")
+    parser.add_argument("--count", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    from transformers import CLIPImageProcessor, CLIPModel, CLIPProcessor
+    from utils.image_classifier import CLIP_INPUT_SIZE, LABEL_PROMPTS, projected_features
+    from utils.image_loader import load_image
+    from utils.photo_scanner import PhotoScanner
+
+    if args.tiny:
+        model = tiny_clip_model()
+        processor = CLIPImageProcessor()
+        model_name = ""
+        text_features = torch.randn(len(LABEL_PROMPTS), model.config.projection_dim)
+    else:
+        model = CLIPModel.from_pretrained(args.model, local_files_only=True).eval()
+        processor = CLIPProcessor.from_pretrained(args.model, local_files_only=True)
+        model_name = args.model
+        text_inputs = processor(text=LABEL_PROMPTS, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            text_features = projected_features(model.get_text_features(**text_inputs))
+    text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+
+    if args.images:
+        paths = [scanned.path for scanned in PhotoScanner(args.images).scan()][:args.count]
+        images = [load_image(path, CLIP_INPUT_SIZE) for path in paths]
+    else:
+        rng = np.random.default_rng(0)
+        from PIL import Image
+        images = [
+            Image.fromarray(rng.integers(0, 256, (CLIP_INPUT_SIZE, CLIP_INPUT_SIZE, 3), dtype=np.uint8))
+            for _ in range(args.count)
+        ]
+    pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+
+    report = benchmark_backends(model, pixel_values, text_features,
+                                batch_size=args.batch_size, model_name=model_name)
+    print(f"{len(images)} images, batch size {args.batch_size}")
+    for backend, result in report.items():
+        if "error" in result:
+            print(f"{backend:>8}: unavailable ({result['error']})")
+            continue
+        print(
+            f"{backend:>8}: {result['images_per_second']:8.1f} images/s, "
+            f"same label as fp32 {result['agreement']:.1%}, "
+            f"embedding cosine {result['cosine']:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
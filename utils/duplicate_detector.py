@@ -6,12 +6,29 @@ from datetime import datetime
 from collections import defaultdict
 import imagehash
 
+from utils.file_cache import FILE_CACHE_DB, FileCache, file_identity
+from utils.image_loader import load_image
+
 class DuplicateDetector:
-    def __init__(self):
+    """Finds duplicate photos by average hash and EXIF date.
+
+    The fingerprint (hash and EXIF subset) of every photo checked lives in
+    the file cache, so it is recomputed only when the file changes. A meta
+    entry tells whether the cached fingerprints are those duplicates.json
+    was built from.
+    """
+
+    # Meta entry of the file cache, true once a run has saved its results
+    FINGERPRINTS_META = "duplicate_fingerprints_saved"
+
+    def __init__(self, file_cache_file=FILE_CACHE_DB):
         self.duplicates_file = "duplicates.json"
+        self.file_cache_file = file_cache_file
         self.hash_threshold = 5
         self.similarity_threshold = 0.85
         self.batch_size = 50
+        # The 8x8 average hash only needs a small grayscale decode
+        self.hash_decode_size = 64
 
     def get_exif_data(self, image_path):
         try:
@@ -46,10 +63,8 @@ class DuplicateDetector:
 
     def compute_image_hash(self, image_path):
         try:
-            with Image.open(image_path) as img:
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-                return str(imagehash.average_hash(img))
+            img = load_image(image_path, self.hash_decode_size, "L")
+            return str(imagehash.average_hash(img))
         except Exception:
             return None
 
@@ -69,10 +84,9 @@ class DuplicateDetector:
                     continue
         hash_dict[img_hash] = {"path": img_path}
 
-    def _process_exif_comparison(self, img_path, duplicates):
-        exif_data = self.get_exif_data(img_path)
+    def _process_exif_comparison(self, img_path, exif_data, duplicates):
         if not exif_data:
-            return
+            return exif_data
 
         if not hasattr(self, "_exif_data"):
             self._exif_data = {}
@@ -92,12 +106,55 @@ class DuplicateDetector:
                     break
 
         self._exif_data[img_path] = exif_data
+        return exif_data
+
+    def compute_fingerprint(self, img_path, file_cache=None):
+        """Returns the hash and EXIF subset of img_path, reusing the ones in
+        file_cache while the file is unchanged."""
+        identity = file_identity(img_path) if file_cache is not None else None
+        if identity is not None:
+            cached = file_cache.get(img_path, identity)
+            if cached is not None and cached["fingerprint"] is not None:
+                return cached["fingerprint"]
+
+        fingerprint = {
+            "hash": self.compute_image_hash(img_path),
+            "exif": self.get_exif_data(img_path),
+        }
+        if identity is not None:
+            file_cache.put(img_path, identity, fingerprint=fingerprint)
+        return fingerprint
+
+    def _process_image(self, img_path, hash_dict, duplicates, file_cache=None):
+        """Compares img_path with every image seen so far and returns its
+        fingerprint (hash and EXIF subset) for later incremental runs."""
+        fingerprint = self.compute_fingerprint(img_path, file_cache)
+        if fingerprint["hash"]:
+            self._process_hash_comparison(fingerprint["hash"], img_path, hash_dict, duplicates)
+
+        self._process_exif_comparison(img_path, fingerprint["exif"], duplicates)
+        return fingerprint
+
+    def set_fingerprints_saved(self, file_cache, saved):
+        file_cache.set_meta(self.FINGERPRINTS_META, saved)
+        file_cache.commit()
+
+    def save_duplicates(self, duplicates):
+        try:
+            with open(self.duplicates_file, "w") as f:
+                json.dump(dict(duplicates), f, indent=4)
+            return True
+        except Exception:
+            return False
 
     def find_duplicates(self, images_data, progress_callback=None):
         total_images = len(images_data)
         duplicates = defaultdict(list)
         processed = set()
         hash_dict = {}
+        self._exif_data = {}
+        file_cache = FileCache(self.file_cache_file)
+        self.set_fingerprints_saved(file_cache, False)
 
         for start_idx in range(0, total_images, self.batch_size):
             if progress_callback:
@@ -111,17 +168,76 @@ class DuplicateDetector:
                 if img_path in processed:
                     continue
 
-                img_hash = self.compute_image_hash(img_path)
-                if img_hash:
-                    self._process_hash_comparison(img_hash, img_path, hash_dict, duplicates)
-
-                self._process_exif_comparison(img_path, duplicates)
+                self._process_image(img_path, hash_dict, duplicates, file_cache)
                 processed.add(img_path)
 
+        # Photos no longer in the library are not compared with next time
+        for path in file_cache.fingerprints().keys() - processed:
+            file_cache.clear(path, "fingerprint")
+        if self.save_duplicates(duplicates):
+            self.set_fingerprints_saved(file_cache, True)
+        file_cache.close()
+
+        return duplicates
+
+    def update_duplicates(self, new_images, removed_paths=(), progress_callback=None):
+        """Brings duplicates.json up to date after images were added, changed
+        or removed, comparing only the new images with the fingerprints
+        cached by the previous run.
+
+        Returns None if there is no previous run to build on, in which case
+        find_duplicates has to be run over the whole library.
+        """
+        file_cache = FileCache(self.file_cache_file)
         try:
-            with open(self.duplicates_file, "w") as f:
-                json.dump(dict(duplicates), f, indent=4)
-        except Exception:
-            pass
+            if not file_cache.get_meta(self.FINGERPRINTS_META):
+                return None
+            try:
+                with open(self.duplicates_file, "r") as f:
+                    duplicates = defaultdict(list, json.load(f))
+            except Exception:
+                return None
+            return self._update_duplicates(
+                file_cache, duplicates, new_images, removed_paths, progress_callback
+            )
+        finally:
+            file_cache.close()
+
+    def _update_duplicates(self, file_cache, duplicates, new_images, removed_paths, progress_callback):
+        fingerprints = file_cache.fingerprints()
+
+        # Changed images are compared again from scratch
+        stale_paths = set(removed_paths) | {img_data["original"] for img_data in new_images}
+        for method in duplicates:
+            duplicates[method] = [
+                dup for dup in duplicates[method]
+                if dup["original"] not in stale_paths and dup["duplicate"] not in stale_paths
+            ]
+        for path in stale_paths:
+            fingerprints.pop(path, None)
+        for path in removed_paths:
+            file_cache.clear(path, "fingerprint")
 
+        hash_dict = {}
+        self._exif_data = {}
+        for path, fingerprint in fingerprints.items():
+            if fingerprint["hash"]:
+                hash_dict[fingerprint["hash"]] = {"path": path}
+            if fingerprint["exif"]:
+                self._exif_data[path] = fingerprint["exif"]
+
+        # Until duplicates.json is saved, it misses the pairs of the new images
+        self.set_fingerprints_saved(file_cache, False)
+        total_images = len(new_images)
+        for current, img_data in enumerate(new_images):
+            if progress_callback and current % self.batch_size == 0:
+                progress_callback(current, total_images)
+            img_path = img_data["original"]
+            if img_path not in fingerprints:
+                fingerprints[img_path] = self._process_image(
+                    img_path, hash_dict, duplicates, file_cache
+                )
+
+        if self.save_duplicates(duplicates):
+            self.set_fingerprints_saved(file_cache, True)
         return duplicates
\ No newline at end of file
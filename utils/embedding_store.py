@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+
+EMBEDDINGS_DIR = "embeddings"
+
+
+class EmbeddingStore:
+    """CLIP image embeddings of the library, one float16 row per photo, in a
+    file that is mapped into memory for reading.
+
+    The file cache is the path index: each photo's embedding_row points into
+    the array. The model, dimension, row count and generation of the array
+    are kept in file_cache.db too and written in the same transactions as
+    the rows, and vectors are on disk before any row refers to them, so the
+    two agree after a crash.
+    """
+
+    META_NAME = "embeddings"
+
+    def __init__(self, file_cache, directory=EMBEDDINGS_DIR):
+        self.file_cache = file_cache
+        self.directory = directory
+        self.meta = file_cache.get_meta(self.META_NAME)
+        self._file = None
+
+    def path(self, generation):
+        return os.path.join(self.directory, f"vectors-{generation}.f16")
+
+    @property
+    def count(self):
+        return self.meta["count"] if self.meta else 0
+
+    @property
+    def model(self):
+        return self.meta["model"] if self.meta else None
+
+    def _write_meta(self):
+        self.file_cache.set_meta(self.META_NAME, self.meta)
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        current = os.path.basename(self.path(self.meta["generation"]))
+        for name in os.listdir(self.directory):
+            if name != current:
+                os.remove(os.path.join(self.directory, name))
+        self._file = open(self.path(self.meta["generation"]), "a+b")
+        # Drop vectors written after the last committed count
+        self._file.truncate(self.count * self.meta["dim"] * 2)
+
+    def append(self, model_name, vectors):
+        """Adds vectors (one row each) and returns the row of the first.
+
+        Embeddings of another model or dimension are discarded first.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float16)
+        if self.meta is None or (self.meta["model"], self.meta["dim"]) != (model_name, vectors.shape[1]):
+            self.close()
+            generation = self.meta["generation"] + 1 if self.meta else 0
+            self.meta = {"model": model_name, "dim": vectors.shape[1], "count": 0, "generation": generation}
+            self._write_meta()
+            # Committed before _open removes the previous array
+            self.file_cache.commit()
+        if self._file is None:
+            self._open()
+
+        self._file.write(vectors.tobytes())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        start = self.meta["count"]
+        self.meta["count"] += len(vectors)
+        self._write_meta()
+        return start
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def vectors(self):
+        """The stored embeddings as a read-only (count, dim) float16 array,
+        or None if there are none."""
+        path = self.path(self.meta["generation"]) if self.count else None
+        if path is None or not os.path.exists(path):
+            return None
+        return np.memmap(
+            path, dtype=np.float16, mode="r",
+            shape=(self.count, self.meta["dim"])
+        )
+
+    def compact(self, min_rows=1000):
+        """Rewrites the array without the rows no photo refers to any more
+        (photos that changed or disappeared), once they are the majority.
+        Returns whether it was rewritten."""
+        if self.count < min_rows:
+            return False
+        rows = self.file_cache.embedding_rows(self.model)
+        if self.count <= 2 * len(rows):
+            return False
+
+        self.close()
+        paths = list(rows)
+        old_rows = np.array([rows[path] for path in paths], dtype=np.int64)
+        old_vectors = self.vectors()
+        generation = self.meta["generation"] + 1
+        with open(self.path(generation), "wb") as f:
+            for start in range(0, len(old_rows), 65536):
+                f.write(np.ascontiguousarray(old_vectors[old_rows[start:start + 65536]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del old_vectors
+
+        self.meta = dict(self.meta, count=len(paths), generation=generation)
+        self._write_meta()
+        self.file_cache.set_embedding_rows(zip(paths, range(len(paths))))
+        self.file_cache.commit()
+        self._open()
+        return True
@@ -0,0 +1,129 @@
+import os
+import json
+from collections import Counter
+
+FACETS_FILE = "facets.json"
+
+
+def count_index_facets(images):
+    years = Counter()
+    months = Counter()
+    year_months = Counter()
+    for image in images:
+        years[image["year"]] += 1
+        months[image["month"]] += 1
+        year_months[year_month_key(image["year"], image["month"])] += 1
+    return {"years": dict(years), "months": dict(months), "year_months": dict(year_months)}
+
+
+def count_label_facets(classifications):
+    return {"labels": dict(Counter(result["label"] for result in classifications.values()))}
+
+
+def year_month_key(year, month):
+    return f"{year}/{month}"
+
+
+class FacetSummary:
+    """Image counts per year, month, year/month and label, kept in facets.json.
+
+    Each section remembers the size and mtime of the data file it was
+    counted from. Sections whose data file has been rewritten since are
+    reported as missing, so the summary never goes stale silently; the
+    catalog then recounts them from its own data.
+    """
+
+    def __init__(self, index_file="index.json", classification_file="classification_results.json",
+                 facets_file=FACETS_FILE):
+        self.index_file = index_file
+        self.classification_file = classification_file
+        self.facets_file = facets_file
+
+    def _stat_key(self, path):
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return [stat_result.st_mtime_ns, stat_result.st_size]
+
+    def _read(self):
+        if not os.path.exists(self.facets_file):
+            return {}
+        try:
+            with open(self.facets_file, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _write(self, summary):
+        temp_file = self.facets_file + ".tmp"
+        try:
+            with open(temp_file, "w") as f:
+                json.dump(summary, f, separators=(",", ":"))
+            os.replace(temp_file, self.facets_file)
+        except Exception:
+            pass
+
+    def load(self):
+        """Returns {"index": ..., "labels": ...} with None for stale sections."""
+        summary = self._read()
+        sections = {}
+        for name, path in (("index", self.index_file), ("labels", self.classification_file)):
+            section = summary.get(name)
+            if section is not None and section.get("source") == self._stat_key(path):
+                sections[name] = section["counts"]
+            else:
+                sections[name] = None
+        return sections
+
+    def _record(self, name, path, counts):
+        summary = self._read()
+        summary[name] = {"source": self._stat_key(path), "counts": counts}
+        self._write(summary)
+        return counts
+
+    def record_index(self, images):
+        """Counts images, which must be what index.json was just written with."""
+        return self._record("index", self.index_file, count_index_facets(images))
+
+    def record_labels(self, classifications):
+        """Counts classifications, which must be what the classification
+        results file was just written with."""
+        return self._record("labels", self.classification_file, count_label_facets(classifications))
+
+    def subtract_removed(self, previous, removed_images, removed_labels):
+        """The counts loaded before a deletion without the deleted images.
+
+        previous is the result of load() and removed_images are full index
+        entries. Returns {"index": ..., "labels": ...} like load(), to be
+        passed to record_removed once the deletion has been applied.
+        """
+        counts = {"index": None, "labels": None}
+        if previous["index"] is not None:
+            counts["index"] = {facet: dict(values) for facet, values in previous["index"].items()}
+            for image in removed_images:
+                for facet, key in (
+                    ("years", image["year"]),
+                    ("months", image["month"]),
+                    ("year_months", year_month_key(image["year"], image["month"]))
+                ):
+                    self._decrement(counts["index"][facet], key)
+
+        if previous["labels"] is not None:
+            counts["labels"] = {"labels": dict(previous["labels"]["labels"])}
+            for label in removed_labels:
+                self._decrement(counts["labels"]["labels"], label)
+        return counts
+
+    def record_removed(self, counts):
+        """Records the result of subtract_removed."""
+        if counts["index"] is not None:
+            self._record("index", self.index_file, counts["index"])
+        if counts["labels"] is not None:
+            self._record("labels", self.classification_file, counts["labels"])
+
+    def _decrement(self, counts, key):
+        if key in counts:
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
@@ -0,0 +1,208 @@
+import os
+import json
+import sqlite3
+
+FILE_CACHE_DB = "file_cache.db"
+
+# Everything derived from a photo that is worth keeping between runs
+ARTEFACTS = (
+    "thumbnail", "thumbnail_source",
+    "fingerprint",
+    "label", "confidence", "label_key",
+    "embedding_row", "embedding_model",
+)
+JSON_ARTEFACTS = ("fingerprint",)
+
+
+def file_identity(path_or_stat):
+    """(size, mtime_ns, inode) of a file, from its path or a stat result.
+
+    Returns None if the file cannot be stat'ed.
+    """
+    stat_result = path_or_stat
+    if isinstance(path_or_stat, str):
+        try:
+            stat_result = os.stat(path_or_stat)
+        except OSError:
+            return None
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+class FileCache:
+    """Per-photo artefacts of every processing stage, kept in file_cache.db.
+
+    Rows are keyed by path and remember the identity (see file_identity) of
+    the file they were derived from. get() only returns a row while the
+    identity still matches, and storing anything for a new identity drops
+    whatever was cached for the old one, so a stage only has to process
+    files that changed since it last saw them.
+
+    Each stage opens its own FileCache; several can write at once, as
+    writes are committed in small batches.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            thumbnail TEXT,
+            thumbnail_source TEXT,
+            fingerprint TEXT,
+            label TEXT,
+            confidence REAL,
+            label_key TEXT,
+            embedding_row INTEGER,
+            embedding_model TEXT
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_file=FILE_CACHE_DB, commit_every=500):
+        self.db_file = db_file
+        self.commit_every = commit_every
+        self._pending = 0
+        # A stage may open the cache before handing it to its worker thread
+        self.connection = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def commit(self):
+        self.connection.commit()
+        self._pending = 0
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def get(self, path, identity):
+        """Returns the artefacts cached for path as a dict, or None if
+        nothing is cached for this identity of the file."""
+        if identity is None:
+            return None
+        row = self.connection.execute(
+            f"SELECT size, mtime_ns, inode, {', '.join(ARTEFACTS)} FROM files WHERE path = ?",
+            (path,)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != tuple(identity):
+            return None
+        artefacts = dict(zip(ARTEFACTS, row[3:]))
+        for name in JSON_ARTEFACTS:
+            if artefacts[name] is not None:
+                artefacts[name] = json.loads(artefacts[name])
+        return artefacts
+
+    def contains(self, path, artefact=None):
+        """Whether anything, or the given artefact, is cached for path,
+        whatever its identity."""
+        condition = "" if artefact is None else f" AND {artefact} IS NOT NULL"
+        row = self.connection.execute(
+            f"SELECT 1 FROM files WHERE path = ?{condition}", (path,)
+        ).fetchone()
+        return row is not None
+
+    def put(self, path, identity, **artefacts):
+        """Stores artefacts of path. Artefacts cached for another identity
+        of the file are discarded."""
+        unknown = set(artefacts) - set(ARTEFACTS)
+        if unknown:
+            raise ValueError(f"Unknown artefacts: {', '.join(sorted(unknown))}")
+        values = {
+            name: json.dumps(value, separators=(",", ":"))
+            if name in JSON_ARTEFACTS and value is not None else value
+            for name, value in artefacts.items()
+        }
+        names = list(values)
+        size, mtime_ns, inode = identity
+
+        updated = 0
+        if names:
+            updated = self.connection.execute(
+                f"UPDATE files SET {', '.join(f'{name} = ?' for name in names)} "
+                "WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                [values[name] for name in names] + [path, size, mtime_ns, inode]
+            ).rowcount
+        if not updated:
+            columns = ["path", "size", "mtime_ns", "inode"] + names
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO files ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                [path, size, mtime_ns, inode] + [values[name] for name in names]
+            )
+        self._written()
+
+    def clear(self, path, *artefacts):
+        """Forgets some artefacts of path, keeping the rest."""
+        self.connection.execute(
+            f"UPDATE files SET {', '.join(f'{name} = NULL' for name in artefacts)} WHERE path = ?",
+            (path,)
+        )
+        self._written()
+
+    def get_meta(self, name):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = ?", (name,)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_meta(self, name, value):
+        """Stores value under name. Like put(), the change is committed with
+        the next batch of writes."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, json.dumps(value))
+        )
+
+    def fingerprints(self):
+        """{path: fingerprint} of every file with a duplicate fingerprint."""
+        return {
+            path: json.loads(fingerprint)
+            for path, fingerprint in self.connection.execute(
+                "SELECT path, fingerprint FROM files WHERE fingerprint IS NOT NULL"
+            )
+        }
+
+    def embedding_rows(self, model_name):
+        """{path: embedding_row} of every file with an embedding from model_name."""
+        return dict(self.connection.execute(
+            "SELECT path, embedding_row FROM files "
+            "WHERE embedding_row IS NOT NULL AND embedding_model = ?",
+            (model_name,)
+        ))
+
+    def set_embedding_rows(self, rows):
+        """Moves embeddings to new rows; rows is an iterable of (path, row).
+        Like set_meta, the change is committed with the next batch."""
+        self.connection.executemany(
+            "UPDATE files SET embedding_row = ? WHERE path = ?",
+            ((row, path) for path, row in rows)
+        )
+
+    def paths(self, directories=None):
+        """Yields (path, thumbnail) for every cached file, or only for those
+        inside directories."""
+        if directories is None:
+            yield from self.connection.execute("SELECT path, thumbnail FROM files")
+            return
+        for directory in directories:
+            prefix = os.path.join(directory, "")
+            # Paths under prefix sort between it and prefix + U+10FFFF
+            yield from self.connection.execute(
+                "SELECT path, thumbnail FROM files WHERE path >= ? AND path < ?",
+                (prefix, prefix + "\U0010ffff")
+            )
+
+    def remove(self, paths):
+        self.connection.executemany(
+            "DELETE FROM files WHERE path = ?", ((path,) for path in paths)
+        )
+        self.commit()
@@ -0,0 +1,169 @@
+import numpy as np
+
+
+class FilteredImages:
+    """Read-only view of the images selected by a FilterEngine query.
+
+    Only the positions are stored; image dicts are looked up when a page
+    is sliced out of the view.
+    """
+
+    def __init__(self, images, positions):
+        self.images = images
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.images[position] for position in self.positions[key].tolist()]
+        return self.images[int(self.positions[key])]
+
+    def __iter__(self):
+        for position in self.positions.tolist():
+            yield self.images[position]
+
+
+class FilterEngine:
+    """Answers gallery filter queries with precomputed bitmaps.
+
+    One boolean array per year, month and label, and one for the images
+    taking part in a duplicate pair, are built once. The ascending and
+    descending timestamp orders are kept as permutations, so a query is a
+    few vectorised ANDs plus one take over the chosen permutation.
+
+    The ordering matches a stable sort of the images on their timestamp,
+    in both directions, like the catalogs always returned.
+    """
+
+    def __init__(self, images, classifications=None, duplicate_paths=None):
+        self.images = images
+        self.excluded = None
+        self._position_source = None
+        self._original_positions = None
+        size = len(images)
+
+        self.year_bitmaps = self._value_bitmaps([image["year"] for image in images])
+        self.month_bitmaps = self._value_bitmaps([image["month"] for image in images])
+
+        # Like the catalogs, the label filter is ignored while there are no
+        # classifications and the duplicate filter while there is no
+        # duplicates file at all.
+        self.label_bitmaps = None
+        if classifications:
+            labels = [
+                classifications[image["thumbnail"]]["label"]
+                if image["thumbnail"] in classifications else None
+                for image in images
+            ]
+            self.label_bitmaps = self._value_bitmaps(labels)
+
+        self.duplicate_bitmap = None
+        if duplicate_paths is not None:
+            self.duplicate_bitmap = np.fromiter(
+                (image["original"] in duplicate_paths for image in images), dtype=bool, count=size
+            )
+
+        timestamps = np.array([image["timestamp"] for image in images], dtype=str)
+        _, ranks = np.unique(timestamps, return_inverse=True)
+        ranks = ranks.reshape(-1).astype(np.int64)
+        self.ascending = np.argsort(ranks, kind="stable")
+        self.descending = np.argsort(-ranks, kind="stable")
+
+    @classmethod
+    def from_columns(cls, images, year_codes, years, month_codes, months, label_codes, labels,
+                     duplicate_bitmap, ascending, descending, excluded=None,
+                     original_positions=None):
+        """Builds the engine from already encoded columns, e.g. the arrays of
+        a BinaryIndex. Codes index into the value lists; a label code of -1
+        means unclassified, and labels=None means there are no results.
+        Rows set in the excluded mask never appear in results.
+        original_positions, if given, returns {original path: position}
+        without going through the image dicts."""
+        engine = cls.__new__(cls)
+        engine.images = images
+        engine.excluded = excluded
+        engine._position_source = original_positions
+        engine._original_positions = None
+        engine.year_bitmaps = cls._code_bitmaps(year_codes, years)
+        engine.month_bitmaps = cls._code_bitmaps(month_codes, months)
+        engine.label_bitmaps = None if labels is None else cls._code_bitmaps(label_codes, labels)
+        engine.duplicate_bitmap = duplicate_bitmap
+        if excluded is not None:
+            ascending = ascending[~excluded[ascending]]
+            descending = descending[~excluded[descending]]
+        engine.ascending = ascending
+        engine.descending = descending
+        return engine
+
+    @staticmethod
+    def _code_bitmaps(codes, values):
+        return {value: codes == code for code, value in enumerate(values)}
+
+    def _value_bitmaps(self, values):
+        value_codes = {}
+        codes = np.fromiter(
+            (value_codes.setdefault(value, len(value_codes)) for value in values),
+            dtype=np.int32, count=len(values)
+        )
+        return {
+            value: codes == code
+            for value, code in value_codes.items()
+            if value is not None
+        }
+
+    def _missing(self):
+        return np.zeros(len(self.images), dtype=bool)
+
+    def original_positions(self):
+        """{original path: position}, built on first use."""
+        if self._original_positions is None:
+            if self._position_source is not None:
+                self._original_positions = self._position_source()
+            else:
+                self._original_positions = {
+                    image["original"]: position for position, image in enumerate(self.images)
+                }
+        return self._original_positions
+
+    def _mask(self, year=None, month=None, label=None, duplicates_only=False):
+        """The rows matching the filters, or None if there are none."""
+        mask = None
+        bitmaps = []
+        if year:
+            bitmaps.append(self.year_bitmaps.get(year))
+        if month:
+            bitmaps.append(self.month_bitmaps.get(month))
+        if label and self.label_bitmaps is not None:
+            bitmaps.append(self.label_bitmaps.get(label))
+        if duplicates_only and self.duplicate_bitmap is not None:
+            bitmaps.append(self.duplicate_bitmap)
+
+        for bitmap in bitmaps:
+            if bitmap is None:
+                bitmap = self._missing()
+            mask = bitmap.copy() if mask is None else np.logical_and(mask, bitmap, out=mask)
+        return mask
+
+    def query(self, year=None, month=None, label=None, duplicates_only=False, descending=False):
+        mask = self._mask(year, month, label, duplicates_only)
+        order = self.descending if descending else self.ascending
+        if mask is None:
+            return FilteredImages(self.images, order)
+        return FilteredImages(self.images, order[mask[order]])
+
+    def rank(self, originals, year=None, month=None, label=None, duplicates_only=False):
+        """The images of originals, in the order given, that match the
+        filters. Paths that are not in the catalog are left out."""
+        lookup = self.original_positions()
+        positions = np.fromiter(
+            (lookup.get(original, -1) for original in originals), dtype=np.int64, count=len(originals)
+        )
+        positions = positions[positions >= 0]
+        if self.excluded is not None:
+            positions = positions[~self.excluded[positions]]
+        mask = self._mask(year, month, label, duplicates_only)
+        if mask is not None:
+            positions = positions[mask[positions]]
+        return FilteredImages(self.images, positions)
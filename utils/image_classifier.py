@@ -1,24 +1,164 @@
+import io
+import os
 import json
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import torch
 from PIL import Image
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from constants.app_constants import CLIP_BACKEND_PYTORCH, CLASSIFICATION_CHECKPOINT_FILE
+from utils.catalog_journal import write_json_atomic
+from utils.clip_backends import create_image_encoder
+from utils.facets import FacetSummary
+from utils.embedding_store import EmbeddingStore
+from utils.file_cache import FileCache, file_identity
+from utils.image_loader import load_image
+
+# CLIP resizes the shorter side to this size before center cropping
+CLIP_INPUT_SIZE = 224
+CLASSIFICATION_RESULTS_FILE = "classification_results.json"
+TEXT_FEATURES_FILE = "clip_text_features.json"
+# Seconds between checkpoints of the results
+CHECKPOINT_INTERVAL = 120
+# Stored embeddings scored at once when relabelling
+RELABEL_CHUNK_SIZE = 65536
+# Batches decoded ahead of the one being classified
+PREFETCH_BATCHES = 2
+
+
+LABEL_PROMPTS = [
+    "a real photograph taken with a camera, showing natural lighting and perspective, with no digital elements or text overlays",
+    "a digital screenshot that must show computer interface elements like windows, menus, toolbars, or mobile UI elements with perfect pixel edges",
+    "a scanned paper document that must show scanner artifacts, paper texture, and printed text or forms with typical scanning imperfections",
+    "an internet meme that must have text overlaid at top or bottom using meme fonts, edited for humor with added digital text",
+]
+
+
+def projected_features(output):
+    """The projected features returned by CLIPModel.get_text_features and
+    get_image_features, which newer transformers wrap in a model output."""
+    if isinstance(output, torch.Tensor):
+        return output
+    return output.pooler_output
+
+
+def normalised_features(image_encoder, pixel_values):
+    with torch.inference_mode():
+        image_features = image_encoder(pixel_values).float()
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+
+
+def decode_image(original, thumbnail=None):
+    """Decodes an image for CLIP from its thumbnail, given as the data of a
+    packed thumbnail or as a file path, or from the original if there is
+    no usable thumbnail."""
+    image = None
+    try:
+        if isinstance(thumbnail, bytes):
+            with Image.open(io.BytesIO(thumbnail)) as img:
+                image = img.convert("RGB")
+        elif thumbnail is not None:
+            image = load_image(thumbnail, CLIP_INPUT_SIZE)
+    except Exception:
+        image = None
+    if image is None:
+        image = load_image(original, CLIP_INPUT_SIZE)
+    return image
+
+
+# Model of a classification worker process, set up by init_encode_worker
+_worker = {}
+
+
+def init_encode_worker(model_name, backend, threads):
+    """Loads model_name into a worker process, running its operators on
+    threads threads so the processes do not compete for the cores."""
+    from transformers import CLIPImageProcessor, CLIPModel
+
+    torch.set_num_threads(threads)
+    model = CLIPModel.from_pretrained(model_name).eval()
+    _worker["processor"] = CLIPImageProcessor.from_pretrained(model_name)
+    _worker["image_encoder"] = create_image_encoder(model, backend, model_name)
+
+
+def encode_images(sources):
+    """Normalised image features (float32 arrays) of the images in sources,
+    a list of (original, thumbnail) as decode_image takes them, with None
+    for images that fail. Module-level so it can run in a worker process.
+    """
+    processor = _worker["processor"]
+    image_encoder = _worker["image_encoder"]
+    features = [None] * len(sources)
+    decoded = []
+    for index, (original, thumbnail) in enumerate(sources):
+        try:
+            image = decode_image(original, thumbnail)
+            decoded.append((index, processor(images=image, return_tensors="pt")["pixel_values"][0]))
+        except Exception:
+            pass
+    if not decoded:
+        return features
+
+    pixel_values = torch.stack([image_values for _, image_values in decoded])
+    try:
+        rows = list(normalised_features(image_encoder, pixel_values).numpy())
+    except Exception:
+        # One at a time, so a failure only costs the image that caused it
+        rows = []
+        for image_values in pixel_values:
+            try:
+                rows.append(normalised_features(image_encoder, image_values.unsqueeze(0)).numpy()[0])
+            except Exception:
+                rows.append(None)
+    for (index, _), row in zip(decoded, rows):
+        features[index] = row
+    return features
+
+
 class ImageClassifierThread(QThread):
     progress = pyqtSignal(str, str, float)
+    # Number of images relabelled from stored embeddings, emitted once
+    relabelled = pyqtSignal(int)
     finished = pyqtSignal()
 
-    def __init__(self, model, processor, images_data, config_manager=None):
+    def __init__(self, model, processor, images_data, config_manager=None, base_results=None,
+                 relabel=False, thumbnail_store=None, image_encoder=None, resumable=False):
         super().__init__()
         self.model = model
         self.processor = processor
         self.images_data = images_data
+        # Results of images that are not being classified again, kept in
+        # classification_results.json alongside the new ones
+        self.base_results = base_results or {}
+        # Label images from their stored embeddings where possible
+        self.relabel = relabel
+        # Runs the user started leave a checkpoint file, so they can be
+        # offered for resuming if interrupted; quiet library updates do not
+        self.resumable = resumable
         self.confidence_threshold = config_manager.get_value("clip", "confidence_threshold") if config_manager else 90.0
+        self.batch_size = max(1, config_manager.get_value("clip", "batch_size") if config_manager else 32)
+        self.decode_workers = config_manager.get_decode_workers() if config_manager else 1
+        # With more than one, decoding and inference run in worker
+        # processes, each with its own copy of the model
+        self.processes = config_manager.get_classification_processes() if config_manager else 1
+        # Thumbnails are already cropped to a square of CLIP_INPUT_SIZE or
+        # more, so they can stand in for the much larger originals
+        self.decode_from_thumbnails = (
+            bool(config_manager.get_value("clip", "decode_from_thumbnails")) if config_manager else False
+        )
+        self.thumbnail_store = thumbnail_store
+        # See utils.clip_backends; the fp32 model by default
+        self.image_encoder = image_encoder
+        if image_encoder is None and model is not None:
+            self.image_encoder = create_image_encoder(model)
 
-        self.labels = [
-            "a real photograph taken with a camera, showing natural lighting and perspective, with no digital elements or text overlays",
-            "a digital screenshot that must show computer interface elements like windows, menus, toolbars, or mobile UI elements with perfect pixel edges",
-            "a scanned paper document that must show scanner artifacts, paper texture, and printed text or forms with typical scanning imperfections",
-            "an internet meme that must have text overlaid at top or bottom using meme fonts, edited for humor with added digital text",
-        ]
+        self.labels = list(LABEL_PROMPTS)
 
         self.label_mapping = {
             self.labels[0]: "photo",
@@ -27,40 +167,419 @@ class ImageClassifierThread(QThread):
             self.labels[3]: "meme",
         }
 
-    def classify_image(self, image_path):
+        # Cached labels are only reused if they came from the same model,
+        # backend and prompts; the threshold is applied afresh on every run.
+        # Name the worker processes load the model from
+        self.pretrained_name = getattr(getattr(model, "config", None), "_name_or_path", "")
+        self.model_name = self.pretrained_name
+        if self.model_name and self.image_encoder and self.image_encoder.backend != CLIP_BACKEND_PYTORCH:
+            self.model_name += f"+{self.image_encoder.backend}"
+        self.label_key = hashlib.sha1(
+            json.dumps([self.model_name, self.labels]).encode("utf-8")
+        ).hexdigest()
+        self.file_cache = None
+        self.embedding_store = None
+        self._text_features = None
+        self.cancelled = False
+        self.done = 0
+        self.last_checkpoint = time.monotonic()
+
+    def text_features(self):
+        """Normalised text features of the prompts.
+
+        They only depend on the model and the prompts, so they are computed
+        once and kept in clip_text_features.json under label_key.
+        """
+        if self._text_features is not None:
+            return self._text_features
+
+        stored = self.load_text_features()
+        features = stored.get(self.label_key) if self.model_name else None
+        if features is not None:
+            self._text_features = torch.tensor(features, dtype=torch.float32)
+            return self._text_features
+
+        text_inputs = self.processor(text=self.labels, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            text_features = projected_features(self.model.get_text_features(**text_inputs))
+            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        self._text_features = text_features.float()
+
+        if self.model_name:
+            stored[self.label_key] = self._text_features.tolist()
+            self.save_text_features(stored)
+        return self._text_features
+
+    def load_text_features(self):
+        if not os.path.exists(TEXT_FEATURES_FILE):
+            return {}
         try:
-            image = Image.open(image_path).convert("RGB")
-            inputs = self.processor(
-                text=self.labels, images=image, return_tensors="pt", padding=True
-            )
-            outputs = self.model(**inputs)
-            logits_per_image = outputs.logits_per_image
+            with open(TEXT_FEATURES_FILE, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save_text_features(self, stored):
+        try:
+            with open(TEXT_FEATURES_FILE, "w") as f:
+                json.dump(stored, f)
+        except Exception:
+            pass
+
+    def score(self, image_features):
+        """Best matching label and its confidence (before the confidence
+        threshold is applied) for each row of normalised image features.
+
+        The labels are scored against the cached text features, as
+        CLIPModel itself would.
+        """
+        text_features = self.text_features()
+        with torch.inference_mode():
+            logits_per_image = self.model.logit_scale.exp() * image_features @ text_features.T
             probs = logits_per_image.softmax(dim=1)
-            best_idx = probs.argmax()
-            confidence = probs[0][best_idx].item() * 100
+            confidences, best_indices = probs.max(dim=1)
+
+        return [
+            (self.label_mapping[self.labels[best_idx]], confidence * 100)
+            for best_idx, confidence in zip(best_indices.tolist(), confidences.tolist())
+        ]
+
+    def predict_batch(self, pixel_values):
+        """Runs the image encoder once over a batch of preprocessed images
+        and returns the label, confidence (see score) and embedding of each."""
+        image_features = normalised_features(self.image_encoder, pixel_values)
+        embeddings = image_features.cpu().numpy().astype(np.float32)
+
+        return [
+            (simple_label, confidence, embedding)
+            for (simple_label, confidence), embedding in zip(self.score(image_features), embeddings)
+        ]
+
+    def predict_each(self, pixel_values):
+        """Like predict_batch, but one image at a time, so a failure only
+        costs the image that caused it. None stands for a failed image."""
+        predictions = []
+        for image_values in pixel_values:
+            try:
+                predictions.extend(self.predict_batch(image_values.unsqueeze(0)))
+            except Exception:
+                predictions.append(None)
+        return predictions
+
+    def stored_vectors(self):
+        """The embedding store's array if it holds this model's embeddings."""
+        if self.embedding_store is None or self.embedding_store.model != self.model_name:
+            return None
+        return self.embedding_store.vectors()
+
+    def thumbnail_source(self, image_data):
+        """The thumbnail of image_data as decode_image takes it, or None if
+        the original is to be decoded."""
+        if not self.decode_from_thumbnails:
+            return None
+        if self.thumbnail_store is None:
+            return image_data["thumbnail"]
+        try:
+            return self.thumbnail_store.get(image_data["thumbnail"])
+        except Exception:
+            return None
 
-            full_label = self.labels[best_idx]
-            simple_label = self.label_mapping[full_label]
+    def prepare_image(self, image_data):
+        """Decodes an image and returns its pixel values, ready for the
+        model. Runs in the decode workers."""
+        image = decode_image(image_data["original"], self.thumbnail_source(image_data))
+        return self.processor(images=image, return_tensors="pt")["pixel_values"][0]
 
-            if simple_label != "photo" and confidence < self.confidence_threshold:
-                return "photo", confidence
+    def prepare_batch(self, batch, decode_pool=None, encode_pool=None):
+        """First half of classify_batch: looks up the file cache and starts
+        decoding, in decode_pool if given, whatever has to go through the
+        model. With encode_pool, the worker processes decode and encode
+        those images instead. finish_batch completes it."""
+        results = [None] * len(batch)
+        stored = []
+        pending = []
+        sources = []
+        vectors = self.stored_vectors()
+        for position, image_data in enumerate(batch):
+            image_path = image_data["original"]
+            identity = file_identity(image_path) if self.file_cache is not None else None
+            cached = self.file_cache.get(image_path, identity) if identity is not None else None
+            if cached is not None and cached["label_key"] == self.label_key:
+                results[position] = (cached["label"], cached["confidence"])
+                continue
+            if (cached is not None and vectors is not None
+                    and cached["embedding_model"] == self.model_name
+                    and cached["embedding_row"] is not None
+                    and cached["embedding_row"] < len(vectors)):
+                stored.append((position, image_path, identity, cached["embedding_row"]))
+                continue
 
-            return simple_label, confidence
+            if encode_pool is not None:
+                decoded = None
+                sources.append((image_path, self.thumbnail_source(image_data)))
+            elif decode_pool is not None:
+                decoded = decode_pool.submit(self.prepare_image, image_data)
+            else:
+                decoded = Future()
+                try:
+                    decoded.set_result(self.prepare_image(image_data))
+                except Exception as e:
+                    decoded.set_exception(e)
+            pending.append((position, image_path, identity, decoded))
+        encoded = encode_pool.submit(encode_images, sources) if sources else None
+        return results, vectors, stored, pending, encoded
 
+    def predict_decoded(self, pending):
+        """Runs the model over the images of pending decoded by the decode
+        workers. Returns a prediction (see predict_batch) for each, or None
+        if it failed."""
+        predictions = [None] * len(pending)
+        decoded = []
+        for index, (*_, future) in enumerate(pending):
+            try:
+                decoded.append((index, future.result()))
+            except Exception:
+                pass
+        if not decoded:
+            return predictions
+
+        pixel_values = torch.stack([image_values for _, image_values in decoded])
+        try:
+            batch_predictions = self.predict_batch(pixel_values)
         except Exception:
-            return "error", 0.0
+            batch_predictions = self.predict_each(pixel_values) if len(decoded) > 1 else [None]
+        for (index, _), prediction in zip(decoded, batch_predictions):
+            predictions[index] = prediction
+        return predictions
 
-    def run(self):
-        classification_results = {}
-        for image_data in self.images_data:
-            label, confidence = self.classify_image(image_data["original"])
+    def predict_encoded(self, encoded, count):
+        """Like predict_decoded, for the count images a worker process
+        encoded; only the labels are scored here."""
+        try:
+            features = encoded.result()
+        except Exception as e:
+            print(f"Error in a classification process: {e}")
+            return [None] * count
+
+        predictions = [None] * count
+        valid = [index for index, row in enumerate(features) if row is not None]
+        if valid:
+            image_features = torch.from_numpy(np.stack([features[index] for index in valid]))
+            for index, (simple_label, confidence) in zip(valid, self.score(image_features)):
+                predictions[index] = (simple_label, confidence, features[index])
+        return predictions
+
+    def finish_batch(self, prepared):
+        """Second half of classify_batch: waits for the decoded images, runs
+        the model over them and returns (label, confidence) for each image."""
+        results, vectors, stored, pending, encoded = prepared
+
+        if stored:
+            rows = [row for _, _, _, row in stored]
+            image_features = torch.from_numpy(vectors[rows].astype(np.float32))
+            for (position, image_path, identity, _), (simple_label, confidence) in zip(
+                    stored, self.score(image_features)):
+                results[position] = (simple_label, confidence)
+                self.file_cache.put(
+                    image_path, identity,
+                    label=simple_label, confidence=confidence, label_key=self.label_key
+                )
+
+        if pending:
+            if encoded is not None:
+                predictions = self.predict_encoded(encoded, len(pending))
+            else:
+                predictions = self.predict_decoded(pending)
+
+            to_store = []
+            for (position, image_path, identity, _), prediction in zip(pending, predictions):
+                if prediction is None:
+                    results[position] = ("error", 0.0)
+                    continue
+                simple_label, confidence, embedding = prediction
+                results[position] = (simple_label, confidence)
+                if identity is not None:
+                    to_store.append((image_path, identity, simple_label, confidence, embedding))
+
+            if to_store:
+                first_row = self.embedding_store.append(
+                    self.model_name, np.stack([embedding for *_, embedding in to_store])
+                )
+                for offset, (image_path, identity, simple_label, confidence, _) in enumerate(to_store):
+                    self.file_cache.put(
+                        image_path, identity,
+                        label=simple_label, confidence=confidence, label_key=self.label_key,
+                        embedding_row=first_row + offset, embedding_model=self.model_name
+                    )
+
+        return [self.apply_threshold(label, confidence) for label, confidence in results]
+
+    def classify_batch(self, batch):
+        """Returns (label, confidence) for each image of batch.
+
+        Results cached for unchanged files are reused, and stored embeddings
+        are scored again if the prompts changed; the remaining images go
+        through the model together.
+        """
+        return self.finish_batch(self.prepare_batch(batch))
+
+    def apply_threshold(self, simple_label, confidence):
+        if simple_label not in ("photo", "error") and confidence < self.confidence_threshold:
+            return "photo", confidence
+        return simple_label, confidence
+
+    def classify_image(self, image_path):
+        return self.classify_batch([{"original": image_path, "thumbnail": None}])[0]
+
+    def relabel_stored(self, images_data):
+        """Labels every image whose embedding is stored from the embeddings
+        alone, a chunk of the array at a time.
+
+        Returns {thumbnail: (label, confidence)} and the images that still
+        have to go through the model. Stored embeddings are used as they
+        are; photos changed since are picked up by the next library update.
+        """
+        vectors = self.stored_vectors()
+        if vectors is None:
+            return {}, list(images_data)
+
+        rows = self.file_cache.embedding_rows(self.model_name)
+        labelled = []
+        positions = []
+        remaining = []
+        for image_data in images_data:
+            row = rows.get(image_data["original"])
+            if row is None or row >= len(vectors):
+                remaining.append(image_data)
+            else:
+                labelled.append(image_data)
+                positions.append(row)
+
+        positions = np.array(positions, dtype=np.int64)
+        results = {}
+        for start in range(0, len(labelled), RELABEL_CHUNK_SIZE):
+            image_features = torch.from_numpy(
+                vectors[positions[start:start + RELABEL_CHUNK_SIZE]].astype(np.float32)
+            )
+            chunk = labelled[start:start + RELABEL_CHUNK_SIZE]
+            for image_data, (simple_label, confidence) in zip(chunk, self.score(image_features)):
+                results[image_data["thumbnail"]] = self.apply_threshold(simple_label, confidence)
+        return results, remaining
+
+    def cancel(self):
+        self.cancelled = True
+
+    def write_results(self, classification_results):
+        write_json_atomic(CLASSIFICATION_RESULTS_FILE, classification_results)
+        FacetSummary().record_labels(classification_results)
+
+    def write_checkpoint_file(self, done):
+        write_json_atomic(CLASSIFICATION_CHECKPOINT_FILE, {
+            "done": done,
+            "total": len(self.images_data),
+            "relabel": self.relabel,
+        })
+
+    def checkpoint(self, classification_results, done):
+        """Makes the results so far durable: the file cache holds every
+        image classified up to now, and classification_results.json the
+        labels, with the images not reached yet keeping their old ones.
+
+        The checkpoint file of a resumable run stays until the run ends, so
+        an interrupted run can be offered for resuming; resuming reuses the
+        cached results."""
+        self.file_cache.commit()
+        self.write_results(classification_results)
+        if self.resumable:
+            self.write_checkpoint_file(done)
+        self.last_checkpoint = time.monotonic()
+
+    def record_batch(self, classification_results, batch, prepared):
+        for image_data, (label, confidence) in zip(batch, self.finish_batch(prepared)):
             classification_results[image_data["thumbnail"]] = {
                 "label": label,
                 "confidence": confidence,
             }
             self.progress.emit(image_data["thumbnail"], label, confidence)
+        self.done += len(batch)
+        if time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.checkpoint(classification_results, self.done)
+
+    def start_encode_pool(self):
+        """Starts the worker processes of a multi-process run. Returns None
+        if the run uses a single process or the workers cannot load the
+        model, so the images are classified in this one."""
+        if self.processes <= 1 or not self.pretrained_name:
+            return None
+        threads = max(1, (os.cpu_count() or 1) // self.processes)
+        # Like the thumbnail workers, spawned fresh rather than forked from
+        # a process running Qt and torch threads
+        context = multiprocessing.get_context("spawn")
+        encode_pool = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=context, initializer=init_encode_worker,
+            initargs=(self.pretrained_name, self.image_encoder.backend, threads)
+        )
+        try:
+            encode_pool.submit(encode_images, []).result()
+        except Exception as e:
+            print(f"Error starting the classification processes: {e}")
+            encode_pool.shutdown(cancel_futures=True)
+            return None
+        return encode_pool
+
+    def run(self):
+        classification_results = dict(self.base_results)
+        self.file_cache = FileCache()
+        self.embedding_store = EmbeddingStore(self.file_cache)
+        self.done = 0
+        if self.resumable:
+            self.write_checkpoint_file(0)
+        self.last_checkpoint = time.monotonic()
+
+        images_data = self.images_data
+        if self.relabel:
+            relabelled, images_data = self.relabel_stored(images_data)
+            for thumbnail, (label, confidence) in relabelled.items():
+                classification_results[thumbnail] = {
+                    "label": label,
+                    "confidence": confidence,
+                }
+            self.done = len(relabelled)
+            self.relabelled.emit(len(relabelled))
+
+        # Decoding runs PREFETCH_BATCHES ahead of the model, so the decode
+        # workers and inference overlap without holding the whole library.
+        # Worker processes get as many batches each, and results are still
+        # recorded (and written to the caches) by this thread alone.
+        encode_pool = self.start_encode_pool() if images_data else None
+        decode_pool = ThreadPoolExecutor(self.decode_workers) if encode_pool is None else None
+        ahead = PREFETCH_BATCHES * (self.processes if encode_pool is not None else 1)
+        in_flight = deque()
+        with encode_pool or decode_pool as pool:
+            for start in range(0, len(images_data), self.batch_size):
+                if self.cancelled:
+                    break
+                batch = images_data[start:start + self.batch_size]
+                in_flight.append((batch, self.prepare_batch(batch, decode_pool, encode_pool)))
+                if len(in_flight) > ahead:
+                    self.record_batch(classification_results, *in_flight.popleft())
+
+            if self.cancelled:
+                # Batches already being decoded are dropped
+                pool.shutdown(cancel_futures=True)
+                in_flight.clear()
+            while in_flight:
+                self.record_batch(classification_results, *in_flight.popleft())
+
+        self.embedding_store.compact()
+        self.embedding_store.close()
+        self.embedding_store = None
+        self.file_cache.close()
+        self.file_cache = None
 
-        with open("classification_results.json", "w") as f:
-            json.dump(classification_results, f, indent=4)
+        # A cancelled run keeps what it classified, like a checkpoint
+        self.write_results(classification_results)
+        if self.resumable and os.path.exists(CLASSIFICATION_CHECKPOINT_FILE):
+            os.remove(CLASSIFICATION_CHECKPOINT_FILE)
 
-        self.finished.emit()
\ No newline at end of file
+        self.finished.emit()
@@ -0,0 +1,87 @@
+import io
+import math
+from PIL import Image, ExifTags
+
+# Same mapping ImageOps.exif_transpose uses for the Orientation tag
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+EXIF_HEADER = b"Exif\x00\x00"
+EXIF_ORIENTATION = 0x0112
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+
+
+def load_image(image_path, min_side=None, mode="RGB"):
+    """Decodes image_path at the smallest resolution whose shorter side is
+    still at least min_side pixels, converted to mode.
+
+    JPEGs are decoded with DCT scaling (1/2, 1/4 or 1/8) through draft mode,
+    and whatever integer factor is left over is removed with a cheap box
+    reduction, so callers that only need a small image never hold the full
+    resolution original in memory. Without min_side the image is decoded at
+    full size. EXIF data is kept in the returned image's info.
+    """
+    with Image.open(image_path) as img:
+        if min_side:
+            shorter_side = min(img.size)
+            if shorter_side > min_side:
+                scale = shorter_side / min_side
+                img.draft(
+                    mode,
+                    (math.ceil(img.width / scale), math.ceil(img.height / scale))
+                )
+
+        img.load()
+        if img.mode != mode:
+            img = img.convert(mode)
+
+        if min_side:
+            factor = min(img.size) // min_side
+            if factor >= 2:
+                img = img.reduce(factor)
+        return img
+
+
+def load_exif_preview(image_path, mode="RGB"):
+    """Returns the preview JPEG embedded in the EXIF data of image_path,
+    rotated according to the Orientation of the main image, or None if the
+    file carries no usable preview.
+    """
+    try:
+        with Image.open(image_path) as img:
+            raw_exif = img.info.get("exif")
+            if img.format != "JPEG" or not raw_exif:
+                return None
+            exif = img.getexif()
+            orientation = exif.get(EXIF_ORIENTATION)
+            thumbnail_ifd = exif.get_ifd(ExifTags.IFD.IFD1)
+
+        offset = thumbnail_ifd.get(EXIF_THUMBNAIL_OFFSET)
+        length = thumbnail_ifd.get(EXIF_THUMBNAIL_LENGTH)
+        if not offset or not length:
+            return None
+
+        # Offsets inside the EXIF block are relative to the TIFF header
+        tiff_data = raw_exif[len(EXIF_HEADER):] if raw_exif.startswith(EXIF_HEADER) else raw_exif
+        preview_data = tiff_data[offset:offset + length]
+        if len(preview_data) != length:
+            return None
+
+        with Image.open(io.BytesIO(preview_data)) as preview:
+            preview.load()
+            if preview.mode != mode:
+                preview = preview.convert(mode)
+    except Exception:
+        return None
+
+    if orientation in ORIENTATION_TRANSPOSE:
+        preview = preview.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return preview
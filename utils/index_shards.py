@@ -0,0 +1,135 @@
+import os
+import json
+import heapq
+from PyQt5.QtCore import QThread, pyqtSignal
+
+INDEX_SHARDS_DIR = "index_shards"
+
+
+def index_source(index_file):
+    """Identifies a version of index.json by its mtime and size."""
+    try:
+        stat_result = os.stat(index_file)
+    except OSError:
+        return None
+    return [stat_result.st_mtime_ns, stat_result.st_size]
+
+
+def write_index_shards(images, source, directory=INDEX_SHARDS_DIR):
+    """Splits the entries of index.json into one file per year.
+
+    Each shard keeps the positions its entries have in index.json, so the
+    full order can be rebuilt from any subset of shards. source identifies
+    the index.json the shards were cut from (see index_source); the
+    manifest is written last and names it, so shards are only used while
+    they match index.json.
+    """
+    os.makedirs(directory, exist_ok=True)
+    shards = {}
+    for position, image in enumerate(images):
+        shard = shards.setdefault(image["year"], {"positions": [], "images": []})
+        shard["positions"].append(position)
+        shard["images"].append(image)
+
+    years = {}
+    for year, shard in shards.items():
+        file_name = f"{year}.json"
+        temp_file = os.path.join(directory, file_name + ".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(shard, f, separators=(",", ":"))
+        os.replace(temp_file, os.path.join(directory, file_name))
+        years[year] = {"file": file_name, "count": len(shard["images"])}
+
+    manifest_file = os.path.join(directory, "manifest.json")
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump({"source": source, "years": years}, f, indent=4)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+    current_files = {shard["file"] for shard in years.values()} | {"manifest.json"}
+    for name in os.listdir(directory):
+        if name not in current_files:
+            os.remove(os.path.join(directory, name))
+
+
+def remove_index_shards(directory=INDEX_SHARDS_DIR):
+    manifest_file = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+
+def load_index_shards(source, directory=INDEX_SHARDS_DIR):
+    """Returns a ShardedIndex for the shards cut from source, or None."""
+    manifest_file = os.path.join(directory, "manifest.json")
+    if source is None or not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+    except Exception:
+        return None
+    if manifest.get("source") != source:
+        return None
+    return ShardedIndex(directory, manifest)
+
+
+class ShardedIndex:
+    """Year shards of index.json, each read only when first needed."""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.source = manifest["source"]
+        self.counts = {year: shard["count"] for year, shard in manifest["years"].items()}
+        self.files = {year: shard["file"] for year, shard in manifest["years"].items()}
+        self.years = sorted(self.counts)
+        self.shards = {}
+
+    def load(self, year):
+        """Returns the entries of one year, reading its shard if needed."""
+        if year not in self.files:
+            return []
+        shard = self.shards.get(year)
+        if shard is None:
+            with open(os.path.join(self.directory, self.files[year]), "r") as f:
+                shard = json.load(f)
+            self.shards[year] = shard
+        return shard["images"]
+
+    def loaded_years(self):
+        return sorted(self.shards)
+
+    def pending_years(self):
+        return [year for year in self.years if year not in self.shards]
+
+    def loaded_images(self):
+        """Entries of every loaded shard, in index.json order."""
+        shards = [self.shards[year] for year in self.loaded_years()]
+        merged = heapq.merge(
+            *(zip(shard["positions"], shard["images"]) for shard in shards),
+            key=lambda item: item[0]
+        )
+        return [image for _, image in merged]
+
+
+class ShardLoaderThread(QThread):
+    """Reads the remaining shards of a ShardedIndex in the background."""
+
+    finished = pyqtSignal()
+
+    def __init__(self, sharded_index):
+        super().__init__()
+        self.sharded_index = sharded_index
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        for year in self.sharded_index.pending_years():
+            if self.cancelled:
+                break
+            try:
+                self.sharded_index.load(year)
+            except Exception as e:
+                print(f"Error loading index shard {year}: {e}")
+                break
+        self.finished.emit()
@@ -0,0 +1,167 @@
+import os
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QThread, QTimer, pyqtSignal
+
+from utils.duplicate_detector import DuplicateDetector
+
+
+class DirectoryWalkThread(QThread):
+    """Lists a directory and every directory below it that is not in
+    watched, in chunks, so large trees are walked without blocking the
+    interface.
+
+    Several walks can run at once, so the signals carry the walker.
+    """
+
+    found = pyqtSignal(object, list)
+    walked = pyqtSignal(object)
+
+    def __init__(self, directory, watched=frozenset(), chunk_size=500):
+        super().__init__()
+        self.directory = directory
+        self.watched = watched
+        self.chunk_size = chunk_size
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        chunk = [self.directory] if self.directory not in self.watched else []
+        for root, dirs, _ in os.walk(self.directory):
+            if self.cancelled:
+                break
+            chunk.extend(
+                path for path in (os.path.join(root, name) for name in dirs)
+                if path not in self.watched
+            )
+            if len(chunk) >= self.chunk_size:
+                self.found.emit(self, chunk)
+                chunk = []
+        if chunk and not self.cancelled:
+            self.found.emit(self, chunk)
+        self.walked.emit(self)
+
+
+class LibraryWatcher(QObject):
+    """Watches every directory below the photos root and reports changes in
+    batches.
+
+    QFileSystemWatcher is backed by inotify on Linux. Events are coalesced:
+    a batch is emitted once no directory has changed for debounce_ms, or at
+    the latest max_delay_ms after the first change of the batch, so a large
+    import arrives as a handful of batches rather than one event per photo.
+    Batches hold directories relative to the photos root, reduced so that
+    no directory appears together with one of its ancestors.
+
+    The tree is listed by a DirectoryWalkThread and its directories are
+    watched chunk by chunk as they arrive.
+    """
+
+    changes_ready = pyqtSignal(list)
+
+    def __init__(self, photos_path, debounce_ms=2000, max_delay_ms=30000, parent=None):
+        super().__init__(parent)
+        self.photos_path = photos_path
+        self.pending_dirs = set()
+        self.walkers = []
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(debounce_ms)
+        self.debounce_timer.timeout.connect(self.flush)
+
+        self.max_delay_timer = QTimer(self)
+        self.max_delay_timer.setSingleShot(True)
+        self.max_delay_timer.setInterval(max_delay_ms)
+        self.max_delay_timer.timeout.connect(self.flush)
+
+    def start(self):
+        self.watch_tree(self.photos_path)
+
+    def stop(self):
+        self.debounce_timer.stop()
+        self.max_delay_timer.stop()
+        self.pending_dirs.clear()
+        walkers, self.walkers = self.walkers, []
+        for walker in walkers:
+            walker.cancel()
+        for walker in walkers:
+            walker.wait()
+        directories = self.watcher.directories()
+        if directories:
+            self.watcher.removePaths(directories)
+
+    def watch_tree(self, directory):
+        walker = DirectoryWalkThread(directory, set(self.watcher.directories()))
+        walker.found.connect(self.add_directories)
+        walker.walked.connect(self.walk_finished)
+        self.walkers.append(walker)
+        walker.start()
+
+    def add_directories(self, walker, paths):
+        # Chunks still queued when the watcher was stopped are dropped
+        if walker in self.walkers:
+            self.watcher.addPaths(paths)
+
+    def walk_finished(self, walker):
+        if walker in self.walkers:
+            walker.wait()
+            self.walkers.remove(walker)
+
+    def on_directory_changed(self, path):
+        self.pending_dirs.add(path)
+        self.debounce_timer.start()
+        if not self.max_delay_timer.isActive():
+            self.max_delay_timer.start()
+
+    def flush(self):
+        self.debounce_timer.stop()
+        self.max_delay_timer.stop()
+        if not self.pending_dirs:
+            return
+
+        changed = self.pending_dirs
+        self.pending_dirs = set()
+
+        # New subdirectories (e.g. a new month) have to be watched too.
+        # Removed directories drop out of QFileSystemWatcher by themselves.
+        for path in changed:
+            if os.path.isdir(path):
+                self.watch_tree(path)
+
+        self.changes_ready.emit(self.relative_dirs(changed))
+
+    def relative_dirs(self, paths):
+        relative = {os.path.relpath(path, self.photos_path) for path in paths}
+        if "." in relative:
+            return ["."]
+
+        reduced = []
+        for path in sorted(relative):
+            parent = os.path.dirname(path)
+            while parent and parent not in relative:
+                parent = os.path.dirname(parent)
+            if not parent:
+                reduced.append(path)
+        return reduced
+
+
+class DuplicateUpdateThread(QThread):
+    """Updates duplicates.json for the photos the watcher found changed."""
+
+    finished = pyqtSignal()
+
+    def __init__(self, new_images, removed_paths):
+        super().__init__()
+        self.new_images = new_images
+        self.removed_paths = removed_paths
+
+    def run(self):
+        try:
+            DuplicateDetector().update_duplicates(self.new_images, self.removed_paths)
+        except Exception as e:
+            print(f"Error updating duplicates: {e}")
+        self.finished.emit()
@@ -0,0 +1,21 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class MLPreloadThread(QThread):
+    """Imports torch, transformers and the classifier in the background.
+
+    The window starts without them; importing them ahead of time means the
+    first classification does not have to wait for it either.
+    """
+
+    finished = pyqtSignal()
+
+    def run(self):
+        try:
+            import torch
+            import transformers
+            from transformers import CLIPModel, CLIPProcessor
+            import utils.image_classifier
+        except Exception as e:
+            print(f"Error preloading the classification libraries: {e}")
+        self.finished.emit()
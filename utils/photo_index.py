@@ -0,0 +1,92 @@
+import os
+import json
+import heapq
+
+INDEX_SNAPSHOT_FILE = "index_snapshot.json"
+
+
+def index_entry(scanned, thumbnails_path):
+    """Builds the index.json entry of a scanned photo.
+
+    Photos must live in <year>/<month>/ below the photos root; anything else
+    is not indexed and None is returned.
+    """
+    path_parts = scanned.relative_dir.split(os.sep)
+    if len(path_parts) < 2:
+        return None
+
+    year, month = path_parts[:2]
+    filename_base = os.path.splitext(scanned.name)[0]
+    filename_parts = filename_base.split("_")
+
+    if len(filename_parts) >= 6:
+        day = filename_parts[2]
+        timestamp = "_".join(filename_parts[:6])
+    else:
+        day = "01"
+        timestamp = f"{year}_{month}_{day}_00_00_00"
+
+    return {
+        "thumbnail": os.path.join(thumbnails_path, scanned.relative_dir, scanned.name),
+        "original": scanned.path,
+        "year": year,
+        "month": month,
+        "day": day,
+        "timestamp": timestamp
+    }
+
+
+def index_sort_key(entry):
+    return entry["timestamp"]
+
+
+def load_index_snapshot(photos_path, thumbnails_path, snapshot_file=INDEX_SNAPSHOT_FILE):
+    """Returns the directory snapshot taken when index.json was last written,
+    or None if there is none or it was taken for other paths.
+    """
+    if not os.path.exists(snapshot_file):
+        return None
+    try:
+        with open(snapshot_file, "r") as f:
+            snapshot = json.load(f)
+    except Exception:
+        return None
+    if snapshot.get("photos_path") != photos_path or snapshot.get("thumbnails_path") != thumbnails_path:
+        return None
+    return snapshot["directories"]
+
+
+def save_index_snapshot(directories, photos_path, thumbnails_path, snapshot_file=INDEX_SNAPSHOT_FILE):
+    temp_file = snapshot_file + ".tmp"
+    try:
+        with open(temp_file, "w") as f:
+            json.dump({
+                "photos_path": photos_path,
+                "thumbnails_path": thumbnails_path,
+                "directories": directories
+            }, f, separators=(",", ":"))
+        os.replace(temp_file, snapshot_file)
+        return True
+    except Exception:
+        return False
+
+
+def remove_index_snapshot(snapshot_file=INDEX_SNAPSHOT_FILE):
+    if os.path.exists(snapshot_file):
+        os.remove(snapshot_file)
+
+
+def merge_index(index, new_entries, changed_dirs, photos_path):
+    """Replaces the entries of changed_dirs in the sorted index with
+    new_entries without re-sorting the entries that did not change.
+    """
+    changed_paths = {
+        photos_path if relative_dir == "." else os.path.join(photos_path, relative_dir)
+        for relative_dir in changed_dirs
+    }
+    kept = [
+        entry for entry in index
+        if os.path.dirname(entry["original"]) not in changed_paths
+    ]
+    new_entries.sort(key=index_sort_key)
+    return list(heapq.merge(kept, new_entries, key=index_sort_key))
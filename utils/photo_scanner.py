@@ -0,0 +1,123 @@
+import os
+from collections import namedtuple
+
+from constants.app_constants import IMAGE_EXTENSIONS
+
+# relative_dir is relative to the photos root, "." for the root itself
+ScannedFile = namedtuple("ScannedFile", ["path", "name", "relative_dir", "stat"])
+
+
+class PhotoScanner:
+    """Streams the photos below photos_path in a single os.scandir pass.
+
+    Files are yielded as soon as their directory has been listed, together
+    with their stat data, so callers can start working and report progress
+    without walking the tree a second time just to count it.
+
+    The mtime and subdirectories of every visited directory are recorded in
+    directories. Given such a snapshot from an earlier scan, directories
+    whose mtime has not changed are not listed again: their files are not
+    yielded and only their subdirectories are visited. The directories that
+    were listed, appeared or disappeared end up in changed_dirs.
+
+    start_dirs limits the scan to those directories (relative to the root)
+    and everything below them. Snapshot entries outside of them are carried
+    over into directories unchanged.
+    """
+
+    def __init__(self, photos_path, extensions=IMAGE_EXTENSIONS, snapshot=None, start_dirs=None):
+        self.photos_path = photos_path
+        self.extensions = extensions
+        self.snapshot = snapshot
+        self.start_dirs = start_dirs
+        self.directories = {}
+        self.changed_dirs = set()
+        self.scanned = 0
+        self.directories_done = 0
+        self.directories_pending = 0
+        self.finished = False
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def estimated_total(self):
+        """Photos found so far plus an estimate for the unvisited directories."""
+        if self.finished or not self.directories_done:
+            return self.scanned
+        per_directory = self.scanned / self.directories_done
+        return self.scanned + round(per_directory * self.directories_pending)
+
+    def scan(self):
+        stack = sorted(self.start_dirs, reverse=True) if self.start_dirs else ["."]
+        self.directories_pending = len(stack)
+        while stack and not self.cancelled:
+            relative_dir = stack.pop()
+            self.directories_pending -= 1
+            directory = (
+                self.photos_path if relative_dir == "."
+                else os.path.join(self.photos_path, relative_dir)
+            )
+
+            # The directory is stat'ed before it is listed so that anything
+            # added while listing shows up as a newer mtime next time.
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+
+            known = self.snapshot.get(relative_dir) if self.snapshot is not None else None
+            if known is not None and known["mtime"] == mtime_ns:
+                files = []
+                subdirs = known["subdirs"]
+            else:
+                files, subdirs = self.list_directory(directory)
+                if self.snapshot is not None:
+                    self.changed_dirs.add(relative_dir)
+            self.directories[relative_dir] = {"mtime": mtime_ns, "subdirs": sorted(subdirs)}
+
+            for name in sorted(subdirs, reverse=True):
+                stack.append(name if relative_dir == "." else os.path.join(relative_dir, name))
+            self.directories_pending += len(subdirs)
+            self.directories_done += 1
+
+            for path, name, stat_result in sorted(files, key=lambda f: f[1]):
+                if self.cancelled:
+                    return
+                self.scanned += 1
+                yield ScannedFile(path, name, relative_dir, stat_result)
+
+        self.finished = not self.cancelled
+        if self.finished and self.snapshot is not None:
+            for relative_dir, known in self.snapshot.items():
+                if relative_dir in self.directories:
+                    continue
+                if self.in_scope(relative_dir):
+                    self.changed_dirs.add(relative_dir)
+                else:
+                    self.directories[relative_dir] = known
+
+    def in_scope(self, relative_dir):
+        if not self.start_dirs or "." in self.start_dirs:
+            return True
+        return any(
+            relative_dir == start_dir or relative_dir.startswith(start_dir + os.sep)
+            for start_dir in self.start_dirs
+        )
+
+    def list_directory(self, directory):
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file() and entry.name.lower().endswith(self.extensions):
+                            files.append((entry.path, entry.name, entry.stat()))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return files, subdirs
@@ -0,0 +1,244 @@
+import os
+import json
+
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from utils.embedding_store import EmbeddingStore
+from utils.file_cache import FILE_CACHE_DB, FileCache
+
+SEARCH_INDEX_FLAT = "flat"
+SEARCH_INDEX_CLUSTERED = "clustered"
+CLUSTERED_INDEX_FILE = "search_index.npz"
+# Smaller libraries are always searched exhaustively
+CLUSTERED_MIN_SIZE = 20000
+# Embeddings converted, scored or assigned to clusters at once (32 MB as
+# float32 for CLIP ViT-B/32)
+CHUNK_SIZE = 16384
+KMEANS_ITERATIONS = 10
+
+
+def normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_positions(scores, limit):
+    """Positions of the limit highest scores, best first."""
+    if limit < len(scores):
+        best = np.argpartition(-scores, limit)[:limit]
+    else:
+        best = np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def stored_embeddings(file_cache, store):
+    """Paths and rows, in row order, of every photo whose embedding is in
+    the store. Rows of photos changed or removed since are left out."""
+    rows = file_cache.embedding_rows(store.model)
+    paths = [path for path, row in rows.items() if row < store.count]
+    positions = np.fromiter((rows[path] for path in paths), dtype=np.int64, count=len(paths))
+    order = np.argsort(positions, kind="stable")
+    return [paths[position] for position in order.tolist()], positions[order]
+
+
+def scores_of(vectors, rows, query):
+    """Cosine similarity of query with the given rows of the float16
+    vectors, converting a chunk of rows at a time."""
+    return np.concatenate([
+        vectors[rows[start:start + CHUNK_SIZE]].astype(np.float32) @ query
+        for start in range(0, len(rows), CHUNK_SIZE)
+    ]) if len(rows) else np.zeros(0, dtype=np.float32)
+
+
+def as_float32(vectors, rows):
+    return np.concatenate([
+        vectors[rows[start:start + CHUNK_SIZE]].astype(np.float32)
+        for start in range(0, len(rows), CHUNK_SIZE)
+    ]) if len(rows) else np.zeros((0, vectors.shape[1]), dtype=np.float32)
+
+
+class FlatSearchIndex:
+    """Scores the query against every stored embedding. Exact; the
+    embeddings stay in the store's memory-mapped float16 array and are
+    scored a chunk at a time, so only the scores are held in memory."""
+
+    def __init__(self, model_name, paths, rows, vectors):
+        self.model_name = model_name
+        self.paths = paths
+        self.rows = rows
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, store, paths, rows):
+        return cls(store.model, paths, rows, store.vectors())
+
+    def search(self, query, limit):
+        """The paths of the limit photos closest to the normalised query
+        vector, best first, with their cosine similarity."""
+        scores = scores_of(self.vectors, self.rows, query)
+        best = top_positions(scores, limit)
+        return [self.paths[position] for position in best.tolist()], scores[best]
+
+
+class ClusteredSearchIndex:
+    """An inverted file index: the embeddings are grouped around centroids
+    found with spherical k-means, and a query only scores the groups whose
+    centroids are closest to it, a few percent of the library.
+
+    The embeddings stay in the store's memory-mapped array. The centroids
+    and the group of every row are kept in search_index.npz until the
+    store is rewritten; rows added since are assigned when loading.
+    """
+
+    def __init__(self, model_name, paths, rows, vectors, centroids, assignments):
+        self.model_name = model_name
+        self.paths = paths
+        self.rows = rows
+        self.vectors = vectors
+        self.centroids = centroids
+        groups = assignments[rows]
+        # Positions into paths, grouped by centroid
+        self.order = np.argsort(groups, kind="stable")
+        self.offsets = np.concatenate((
+            [0], np.cumsum(np.bincount(groups, minlength=len(centroids)))
+        ))
+        self.probes = max(8, len(centroids) // 16)
+
+    @staticmethod
+    def train(vectors, rows, seed=0):
+        """Spherical k-means over a sample of rows; about the square root
+        of the library in centroids."""
+        count = max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(rows, min(len(rows), 64 * count), replace=False))
+        points = normalise(as_float32(vectors, sample))
+        centroids = points[rng.choice(len(points), count, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            nearest = np.argmax(points @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, points)
+            # Empty groups keep their centroid
+            filled = np.bincount(nearest, minlength=count) > 0
+            centroids[filled] = normalise(sums[filled])
+        return centroids
+
+    @staticmethod
+    def assign(vectors, centroids, start, stop):
+        """Nearest centroid of rows start to stop."""
+        return np.concatenate([
+            np.argmax(vectors[offset:min(offset + CHUNK_SIZE, stop)].astype(np.float32) @ centroids.T, axis=1)
+            for offset in range(start, stop, CHUNK_SIZE)
+        ]).astype(np.int32) if stop > start else np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def build(cls, store, paths, rows, index_file=CLUSTERED_INDEX_FILE):
+        vectors = store.vectors()
+        key = {"model": store.model, "generation": store.meta["generation"]}
+        centroids = assignments = None
+        try:
+            with np.load(index_file) as saved:
+                if json.loads(str(saved["key"])) == key:
+                    centroids = saved["centroids"]
+                    assignments = saved["assignments"]
+        except Exception:
+            pass
+
+        if centroids is None:
+            centroids = cls.train(vectors, rows)
+            assignments = np.zeros(0, dtype=np.int32)
+        if len(assignments) < store.count:
+            assignments = np.concatenate((
+                assignments, cls.assign(vectors, centroids, len(assignments), store.count)
+            ))
+            cls.save(index_file, key, centroids, assignments)
+        return cls(store.model, paths, rows, vectors, centroids, assignments)
+
+    @staticmethod
+    def save(index_file, key, centroids, assignments):
+        temp_file = index_file + ".tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                np.savez(f, key=json.dumps(key), centroids=centroids, assignments=assignments)
+            os.replace(temp_file, index_file)
+        except Exception as e:
+            print(f"Error saving {index_file}: {e}")
+
+    def search(self, query, limit):
+        """Like FlatSearchIndex.search, among the groups nearest to query."""
+        groups = top_positions(self.centroids @ query, self.probes)
+        candidates = np.concatenate([
+            self.order[self.offsets[group]:self.offsets[group + 1]] for group in groups.tolist()
+        ])
+        # Read the memory-mapped rows in file order
+        candidates.sort()
+        scores = scores_of(self.vectors, self.rows[candidates], query)
+        best = top_positions(scores, limit)
+        return [self.paths[position] for position in candidates[best].tolist()], scores[best]
+
+
+def load_search_index(kind=SEARCH_INDEX_FLAT, file_cache_file=FILE_CACHE_DB):
+    """Builds the search index over the stored image embeddings, or returns
+    None if there are none."""
+    file_cache = FileCache(file_cache_file)
+    try:
+        store = EmbeddingStore(file_cache)
+        if store.vectors() is None:
+            return None
+        paths, rows = stored_embeddings(file_cache, store)
+    finally:
+        file_cache.close()
+    if not paths:
+        return None
+    if kind == SEARCH_INDEX_CLUSTERED and len(paths) >= CLUSTERED_MIN_SIZE:
+        return ClusteredSearchIndex.build(store, paths, rows)
+    return FlatSearchIndex.build(store, paths, rows)
+
+
+def encode_query(model, processor, query):
+    """Normalised CLIP text features of query, as a float32 vector."""
+    import torch
+    from utils.image_classifier import projected_features
+
+    text_inputs = processor(text=[query], return_tensors="pt", padding=True, truncation=True)
+    with torch.inference_mode():
+        features = projected_features(model.get_text_features(**text_inputs))
+    return normalise(features[0].float().numpy())
+
+
+class SemanticSearchThread(QThread):
+    """Finds the photos that best match a text query.
+
+    The index is built first if none is given, and kept in self.index for
+    the next query. The ranked paths end up in self.results, or the reason
+    there are none in self.error.
+    """
+
+    finished = pyqtSignal()
+
+    def __init__(self, model, processor, query, index=None, kind=SEARCH_INDEX_FLAT, limit=500):
+        super().__init__()
+        self.model = model
+        self.processor = processor
+        self.query = query
+        self.index = index
+        self.kind = kind
+        self.limit = limit
+        self.results = []
+        self.error = None
+
+    def run(self):
+        try:
+            if self.index is None:
+                self.index = load_search_index(self.kind)
+            # Embeddings of another backend of the same model (see
+            # ImageClassifierThread.model_name) share its text features
+            model_name = self.model.config._name_or_path
+            if self.index is None or self.index.model_name.split("+")[0] != model_name:
+                self.error = "There are no image embeddings of the current model yet. Generate labels first."
+            else:
+                query = encode_query(self.model, self.processor, self.query)
+                self.results, _ = self.index.search(query, self.limit)
+        except Exception as e:
+            self.error = f"Error searching: {e}"
+        self.finished.emit()
@@ -0,0 +1,290 @@
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from PIL import ImageOps
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from constants.app_constants import (
+    THUMBNAIL_SIZE, THUMBNAIL_QUALITY,
+    EXIF_PREVIEW_NEVER, EXIF_PREVIEW_IF_LARGE_ENOUGH, EXIF_PREVIEW_MIN_SIZE
+)
+from utils.image_loader import load_image, load_exif_preview
+from utils.photo_scanner import PhotoScanner
+
+THUMBNAIL_FROM_ORIGINAL = "original"
+THUMBNAIL_FROM_PREVIEW = "preview"
+
+
+def crop_to_square(img):
+    min_dimension = min(img.size)
+    crop_box = (
+        (img.width - min_dimension) // 2,
+        (img.height - min_dimension) // 2,
+        (img.width + min_dimension) // 2,
+        (img.height + min_dimension) // 2,
+    )
+    return img.crop(crop_box)
+
+
+def load_preview_thumbnail(file_path, exif_preview):
+    """Returns the square EXIF preview of file_path if the policy allows it."""
+    if exif_preview == EXIF_PREVIEW_NEVER:
+        return None
+    preview = load_exif_preview(file_path)
+    if preview is None:
+        return None
+    preview = crop_to_square(preview)
+    if exif_preview == EXIF_PREVIEW_IF_LARGE_ENOUGH and preview.width < EXIF_PREVIEW_MIN_SIZE:
+        return None
+    return preview
+
+
+def render_thumbnail(file_path, exif_preview=EXIF_PREVIEW_NEVER):
+    """Returns the square thumbnail image of file_path and where it came
+    from (THUMBNAIL_FROM_PREVIEW or THUMBNAIL_FROM_ORIGINAL).
+    """
+    img = load_preview_thumbnail(file_path, exif_preview)
+    if img is not None:
+        return img, THUMBNAIL_FROM_PREVIEW
+
+    img = crop_to_square(load_image(file_path, THUMBNAIL_SIZE))
+    img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    img = ImageOps.exif_transpose(img)
+    return img, THUMBNAIL_FROM_ORIGINAL
+
+
+def generate_thumbnail(file_path, thumb_dir, exif_preview=EXIF_PREVIEW_NEVER):
+    """Creates a square JPEG thumbnail of file_path inside thumb_dir.
+
+    Returns where the thumbnail came from, or None if it could not be
+    generated. Module-level so it can be pickled and run in a worker process.
+    """
+    try:
+        img, source = render_thumbnail(file_path, exif_preview)
+        img.save(
+            os.path.join(thumb_dir, os.path.basename(file_path)),
+            "JPEG",
+            quality=THUMBNAIL_QUALITY,
+        )
+        return source
+    except Exception:
+        return None
+
+
+def generate_thumbnail_data(file_path, exif_preview=EXIF_PREVIEW_NEVER):
+    """Like generate_thumbnail, but returns the encoded JPEG instead of
+    writing it, as a (source, data) tuple, for the packed thumbnail store.
+    """
+    try:
+        img, source = render_thumbnail(file_path, exif_preview)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=THUMBNAIL_QUALITY)
+        return source, buffer.getvalue()
+    except Exception:
+        return None, None
+
+
+class ThumbnailGeneratorThread(QThread):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+
+    def __init__(self, photos_path, thumbnails_path, workers=1, manifest=None,
+                 exif_preview=EXIF_PREVIEW_NEVER, store=None, start_dirs=None):
+        super().__init__()
+        self.photos_path = photos_path
+        self.thumbnails_path = thumbnails_path
+        self.workers = max(1, workers)
+        self.manifest = manifest
+        self.exif_preview = exif_preview
+        self.store = store
+        self.signatures = {}
+        self.generated = 0
+        self.from_preview = 0
+        self.failed = 0
+        self.skipped = 0
+        self.removed = 0
+        self.queued = 0
+        self.cancelled = False
+        # start_dirs restricts generation to those directories (relative to
+        # photos_path), e.g. the ones the library watcher saw change.
+        self.start_dirs = start_dirs
+        self.scanner = PhotoScanner(photos_path, start_dirs=start_dirs)
+        # Kept so later stages of Update All can reuse this scan
+        self.scanned_files = []
+        self.generated_files = []
+        self.created_dirs = set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.scanner.cancel()
+
+    def iter_tasks(self):
+        """Yields the thumbnails to generate while the photo tree is scanned."""
+        for scanned in self.scanner.scan():
+            self.scanned_files.append(scanned)
+            thumb_dir = os.path.join(self.thumbnails_path, scanned.relative_dir)
+            if self.manifest is not None and not self.check_manifest(scanned, thumb_dir):
+                continue
+            if self.store is None and thumb_dir not in self.created_dirs:
+                os.makedirs(thumb_dir, exist_ok=True)
+                self.created_dirs.add(thumb_dir)
+            self.queued += 1
+            yield scanned.path, thumb_dir
+
+    def estimated_total(self):
+        if self.scanner.finished or not self.scanner.scanned:
+            return self.queued
+        # Assume the unscanned part of the tree needs work in the same
+        # proportion as the part scanned so far.
+        ratio = self.queued / self.scanner.scanned
+        return max(self.queued, round(ratio * self.scanner.estimated_total()))
+
+    def check_manifest(self, scanned, thumb_dir):
+        """Returns True if the thumbnail of scanned has to be (re)generated."""
+        file_path = scanned.path
+        stat_result = scanned.stat
+        signature = self.manifest.signature(stat_result)
+        thumbnail_path = os.path.join(thumb_dir, scanned.name)
+
+        # Thumbnails made from EXIF previews are upgraded once previews are
+        # no longer wanted.
+        accept_preview = self.exif_preview != EXIF_PREVIEW_NEVER
+        if (self.manifest.is_current(file_path, signature, accept_preview)
+                and self.thumbnail_exists(thumbnail_path)):
+            self.skipped += 1
+            return False
+
+        # Thumbnails generated before the manifest existed are adopted as
+        # long as they are newer than their source.
+        if self.store is None and not self.manifest.contains(file_path):
+            try:
+                if os.stat(thumbnail_path).st_mtime_ns >= stat_result.st_mtime_ns:
+                    self.manifest.update(file_path, signature, thumbnail_path)
+                    self.skipped += 1
+                    return False
+            except OSError:
+                pass
+
+        self.signatures[file_path] = signature
+        return True
+
+    def thumbnail_exists(self, thumbnail_path):
+        if self.store is not None:
+            return thumbnail_path in self.store
+        return os.path.exists(thumbnail_path)
+
+    def delete_thumbnails(self, thumbnail_paths):
+        if self.store is not None:
+            self.store.remove(thumbnail_paths)
+            return
+        for thumbnail_path in thumbnail_paths:
+            try:
+                if os.path.exists(thumbnail_path):
+                    os.remove(thumbnail_path)
+            except OSError:
+                pass
+
+    def job(self, task):
+        """Returns the worker function and arguments that generate task."""
+        file_path, thumb_dir = task
+        if self.store is not None:
+            return generate_thumbnail_data, (file_path, self.exif_preview)
+        return generate_thumbnail, (file_path, thumb_dir, self.exif_preview)
+
+    def record_result(self, task, result, processed):
+        file_path, thumb_dir = task
+        if self.store is not None:
+            source, data = result if result else (None, None)
+            if source:
+                self.store.put(os.path.join(thumb_dir, os.path.basename(file_path)), data)
+        else:
+            source = result
+
+        if source:
+            self.generated += 1
+            self.generated_files.append(file_path)
+            if source == THUMBNAIL_FROM_PREVIEW:
+                self.from_preview += 1
+            if self.manifest is not None and file_path in self.signatures:
+                self.manifest.update(
+                    file_path,
+                    self.signatures[file_path],
+                    os.path.join(thumb_dir, os.path.basename(file_path)),
+                    source
+                )
+        else:
+            self.failed += 1
+            if self.manifest is not None:
+                self.manifest.remove(file_path)
+        self.progress.emit(processed, self.estimated_total())
+
+    def run(self):
+        if self.manifest is not None:
+            self.manifest.load()
+
+        self.progress.emit(0, 0)
+        tasks = self.iter_tasks()
+        if self.workers == 1:
+            self.run_inline(tasks)
+        else:
+            self.run_pool(tasks)
+
+        # Only a complete scan tells which sources have disappeared.
+        if self.manifest is not None and self.scanner.finished:
+            seen_paths = {scanned.path for scanned in self.scanned_files}
+            directories = None
+            if self.start_dirs:
+                directories = [
+                    self.photos_path if start_dir == "." else os.path.join(self.photos_path, start_dir)
+                    for start_dir in self.start_dirs
+                ]
+            orphans = self.manifest.remove_orphans(seen_paths, directories)
+            self.delete_thumbnails(orphans)
+            self.removed = len(orphans)
+
+        if self.store is not None:
+            self.store.save()
+        if self.manifest is not None:
+            self.manifest.save()
+
+        self.finished.emit()
+
+    def run_inline(self, tasks):
+        for processed, task in enumerate(tasks, start=1):
+            function, args = self.job(task)
+            self.record_result(task, function(*args), processed)
+            if self.cancelled:
+                break
+
+    def run_pool(self, tasks):
+        # Keep only a few tasks per worker in flight so cancelling does not
+        # have to wait for the whole library to drain out of the queue.
+        max_pending = self.workers * 4
+        pending = {}
+        processed = 0
+
+        # Forking a process that is running Qt threads is unsafe, so the
+        # workers are always spawned fresh.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            while not self.cancelled:
+                while len(pending) < max_pending:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    function, args = self.job(task)
+                    pending[executor.submit(function, *args)] = task
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    processed += 1
+                    task = pending.pop(future)
+                    result = future.result() if future.exception() is None else None
+                    self.record_result(task, result, processed)
+
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,57 @@
+from utils.file_cache import FILE_CACHE_DB, FileCache, file_identity
+
+
+class ThumbnailManifest:
+    """Remembers the stat data of every source that has a current thumbnail.
+
+    The entries live in the shared file cache (see FileCache).
+    """
+
+    def __init__(self, cache_file=FILE_CACHE_DB):
+        self.cache_file = cache_file
+        self.cache = None
+
+    @staticmethod
+    def signature(stat_result):
+        return file_identity(stat_result)
+
+    def load(self):
+        self.cache = FileCache(self.cache_file)
+
+    def save(self):
+        if self.cache is None:
+            return True
+        try:
+            self.cache.close()
+            return True
+        except Exception:
+            return False
+        finally:
+            self.cache = None
+
+    def contains(self, file_path):
+        return self.cache.contains(file_path, "thumbnail")
+
+    def is_current(self, file_path, signature, accept_preview=True):
+        entry = self.cache.get(file_path, signature)
+        if entry is None or entry["thumbnail"] is None:
+            return False
+        return accept_preview or entry["thumbnail_source"] != "preview"
+
+    def update(self, file_path, signature, thumbnail_path, source="original"):
+        self.cache.put(file_path, signature, thumbnail=thumbnail_path, thumbnail_source=source)
+
+    def remove(self, file_path):
+        self.cache.clear(file_path, "thumbnail", "thumbnail_source")
+
+    def remove_orphans(self, seen_paths, directories=None):
+        """Forgets sources that are gone and returns their thumbnail paths.
+
+        If directories is given, only sources inside them are considered.
+        """
+        orphans = {}
+        for path, thumbnail in self.cache.paths(directories):
+            if path not in seen_paths:
+                orphans[path] = thumbnail
+        self.cache.remove(orphans)
+        return [thumbnail for thumbnail in orphans.values() if thumbnail is not None]
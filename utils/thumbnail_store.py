@@ -0,0 +1,198 @@
+import os
+import json
+import mmap
+import threading
+
+
+class PackedThumbnailStore:
+    """Keeps every thumbnail in one append-only blob file plus an offset index.
+
+    Thumbnails are addressed by the same path the index uses, so the rest of
+    the application does not care whether they live in individual files or
+    in the pack. Reads go through a memory map of the blob file and writes
+    through one append handle that stays open for the current pack.
+
+    Removals are appended to a small tombstone log instead of rewriting the
+    offset index, one JSON list of keys per line. Loading applies the log on
+    top of the index and every save folds it in and clears it.
+    """
+
+    INDEX_FILE = "thumbnails.pack.json"
+    TOMBSTONE_FILE = "thumbnails.pack.deleted"
+
+    def __init__(self, thumbnails_path, compaction_ratio=0.25):
+        self.thumbnails_path = thumbnails_path
+        self.index_file = os.path.join(thumbnails_path, self.INDEX_FILE)
+        self.tombstone_file = os.path.join(thumbnails_path, self.TOMBSTONE_FILE)
+        self.compaction_ratio = compaction_ratio
+        self.generation = 0
+        self.pack_file = self.pack_path(self.generation)
+        self.entries = {}
+        self.dead_bytes = 0
+        self._mmap = None
+        self._append_file = None
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        with self._lock:
+            self._close_files()
+            self.generation = 0
+            self.entries = {}
+            if os.path.exists(self.index_file):
+                try:
+                    with open(self.index_file, "r") as f:
+                        index = json.load(f)
+                    self.generation = index["generation"]
+                    self.entries = index["entries"]
+                except Exception:
+                    self.generation = 0
+                    self.entries = {}
+            for keys in self.read_tombstones():
+                for key in keys:
+                    self.entries.pop(key, None)
+            self.pack_file = self.pack_path(self.generation)
+
+            pack_size = os.path.getsize(self.pack_file) if os.path.exists(self.pack_file) else 0
+            # Entries pointing past the end of the pack were never fully written
+            self.entries = {
+                key: entry for key, entry in self.entries.items()
+                if entry[0] + entry[1] <= pack_size
+            }
+            self.dead_bytes = pack_size - sum(length for _, length in self.entries.values())
+
+    def read_tombstones(self):
+        if not os.path.exists(self.tombstone_file):
+            return []
+        tombstones = []
+        with open(self.tombstone_file, "r") as f:
+            for line in f:
+                try:
+                    tombstones.append(json.loads(line))
+                except ValueError:
+                    # A crash while appending leaves at most a torn last line
+                    break
+        return tombstones
+
+    def save(self):
+        with self._lock:
+            temp_file = self.index_file + ".tmp"
+            try:
+                self._flush()
+                with open(temp_file, "w") as f:
+                    json.dump(
+                        {"generation": self.generation, "entries": self.entries},
+                        f,
+                        separators=(",", ":")
+                    )
+                os.replace(temp_file, self.index_file)
+                if os.path.exists(self.tombstone_file):
+                    os.remove(self.tombstone_file)
+                return True
+            except Exception:
+                return False
+
+    def pack_path(self, generation):
+        return os.path.join(self.thumbnails_path, f"thumbnails-{generation}.pack")
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _close_files(self):
+        self._close_map()
+        if self._append_file is not None:
+            self._append_file.close()
+            self._append_file = None
+
+    def _flush(self):
+        if self._append_file is not None:
+            self._append_file.flush()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def put(self, key, data):
+        with self._lock:
+            if self._append_file is None:
+                self._append_file = open(self.pack_file, "ab")
+            offset = self._append_file.tell()
+            self._append_file.write(data)
+            previous = self.entries.get(key)
+            if previous is not None:
+                self.dead_bytes += previous[1]
+            self.entries[key] = [offset, len(data)]
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            offset, length = entry
+            # The pack only grows between compactions, so the map is
+            # refreshed whenever a read falls past its end.
+            if self._mmap is None or offset + length > len(self._mmap):
+                self._close_map()
+                self._flush()
+                with open(self.pack_file, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[offset:offset + length]
+
+    def remove(self, keys):
+        with self._lock:
+            removed = []
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.dead_bytes += entry[1]
+                    removed.append(key)
+            if removed:
+                with open(self.tombstone_file, "a") as f:
+                    f.write(json.dumps(removed, separators=(",", ":")) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def needs_compaction(self):
+        live_bytes = sum(length for _, length in self.entries.values())
+        total_bytes = live_bytes + self.dead_bytes
+        return total_bytes > 0 and self.dead_bytes / total_bytes >= self.compaction_ratio
+
+    def compact(self):
+        """Copies the live thumbnails into a new pack.
+
+        The index is switched to the new pack with a single atomic rename,
+        so a crash at any point leaves either the old or the new pack in use.
+        """
+        with self._lock:
+            old_pack_file = self.pack_file
+            new_pack_file = self.pack_path(self.generation + 1)
+            compacted = {}
+            with open(new_pack_file, "wb") as out:
+                for key, (offset, length) in sorted(self.entries.items(), key=lambda item: item[1][0]):
+                    compacted[key] = [out.tell(), length]
+                    out.write(self.get(key))
+
+            old_state = (self.generation, self.entries)
+            self.generation += 1
+            self.entries = compacted
+            if not self.save():
+                self.generation, self.entries = old_state
+                os.remove(new_pack_file)
+                return False
+
+            self._close_files()
+            self.pack_file = new_pack_file
+            self.dead_bytes = 0
+            if os.path.exists(old_pack_file):
+                os.remove(old_pack_file)
+            return True
+
+    def compact_if_needed(self):
+        if self.needs_compaction():
+            return self.compact()
+        return False